@@ -1,135 +1,116 @@
-from llm_client import generate_text
+from llm_client import agenerate_text
+from document_store import document_store
+from analytics_engine import analytics_engine, Frame
 import json
+import asyncio
 
 class AnalyticsAgent:
-    def analyze(self, documents: list, query: str = None) -> dict:
+    async def analyze(self, documents: list, query: str = None) -> dict:
         """
-        Performs multi-document analytics and intelligence.
+        Performs multi-document analytics and intelligence over the given documents.
         Can answer natural language queries about documents.
         """
         print(f"Analyzing {len(documents)} documents...")
-        
-        # Basic analytics
-        total_documents = len(documents)
-        
-        # Extract amounts and vendors
-        amounts = []
-        vendors = {}
-        categories = {}
-        monthly_spend = {}
-        
-        for doc in documents:
-            extracted = doc.get("extracted_data", {})
-            
-            print(f"DEBUG: Processing doc {doc.get('filename', 'unknown')}")
-            print(f"DEBUG: Extracted data: {extracted}")
-            
-            # Parse amount
-            amount_str = (extracted.get("Total Amount") or 
-                         extracted.get("total_amount") or "0")
-            print(f"DEBUG: Amount string: {amount_str}")
-            
-            # Skip documents with pending extraction
-            if amount_str in ["Pending", "N/A", "Pending Extraction", None, "", "Unknown"]:
-                print(f"DEBUG: Skipping document with pending extraction")
-                continue
-            
-            try:
-                amount = float(str(amount_str).replace("$", "").replace(",", "").strip())
-                amounts.append(amount)
-                print(f"DEBUG: Parsed amount: {amount}")
-            except Exception as e:
-                print(f"DEBUG: Failed to parse amount: {e}")
-                continue
-            
-            # Track by vendor - check 'vendor' field (what we actually save)
-            vendor = (extracted.get("Vendor Name") or 
-                     extracted.get("vendor") or "Unknown")
-            print(f"DEBUG: Vendor: {vendor}")
-            
-            # Skip documents with pending vendor
-            if vendor in ["Pending Extraction", "Unknown", None, ""]:
-                print(f"DEBUG: Skipping document with unknown vendor")
-                continue
-                
-            vendors[vendor] = vendors.get(vendor, 0) + amount
-            
-            # Track by category/type
-            doc_type = extracted.get("detected_type", doc.get("file_type", "other"))
-            categories[doc_type] = categories.get(doc_type, 0) + amount
-            
-            # Track by month
-            date_str = extracted.get("date", "")
-            if date_str:
-                try:
-                    month = date_str[:7]  # YYYY-MM
-                    monthly_spend[month] = monthly_spend.get(month, 0) + amount
-                except:
-                    pass
-        
-        # Calculate statistics
-        total_spend = sum(amounts)
-        avg_spend = total_spend / len(amounts) if amounts else 0
-        max_spend = max(amounts) if amounts else 0
-        min_spend = min(amounts) if amounts else 0
-        
+
+        aggregates = await asyncio.to_thread(lambda: analytics_engine.compute(Frame.from_documents(documents)))
+        return await self._respond(aggregates, query)
+
+    async def analyze_store(self, user_id: str, filters: dict, query: str = None) -> dict:
+        """
+        Analytics over the subset of a user's stored documents matching `filters`
+        (DocumentStore.query filters), including p50/p95 spend per vendor.
+        """
+        def compute():
+            frame = analytics_engine.frame(user_id)
+            return analytics_engine.compute(frame, frame.mask(**filters))
+
+        aggregates = await asyncio.to_thread(compute)
+        print(f"Analyzed {aggregates['documents']} stored documents for {user_id}")
+        return await self._respond(aggregates, query)
+
+    async def summarize(self, user_id: str, query: str = None) -> dict:
+        """
+        Same analytics over all of a user's stored documents, answered from the
+        aggregates the document store maintains on every write. Percentiles are
+        not maintained there; use `analyze_store` without filters for those.
+        """
+        aggregates = document_store.aggregates(user_id)
+        print(f"Analyzing {aggregates['documents']} stored documents for {user_id}...")
+        return await self._respond(aggregates, query)
+
+    async def _respond(self, aggregates: dict, query: str) -> dict:
+        analytics = self._format(aggregates)
+
+        # Natural language query processing
+        if query:
+            analytics["query_response"] = await self._process_query(query, aggregates["documents"], analytics)
+
+        return analytics
+
+    def _format(self, aggregates: dict) -> dict:
+        amount = aggregates["amount"] or {"count": 0, "total_cents": 0, "min": 0, "max": 0}
+        total_spend = amount["total_cents"] / 100
+        avg_spend = total_spend / amount["count"] if amount["count"] else 0
+
+        def total(entry):
+            return entry["total_cents"] / 100
+
         # Top vendors
-        top_vendors = sorted(vendors.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        # Prepare response
-        analytics = {
-            "summary": {
-                "total_documents": total_documents,
-                "total_spend": f"${total_spend:,.2f}",
-                "average_spend": f"${avg_spend:,.2f}",
-                "highest_amount": f"${max_spend:,.2f}",
-                "lowest_amount": f"${min_spend:,.2f}"
-            },
-            "by_vendor": [
-                {
-                    "vendor": v, 
-                    "total": f"${amt:,.2f}", 
-                    "count": sum(1 for d in documents if (d.get("extracted_data", {}).get("vendor_name") or d.get("extracted_data", {}).get("vendor") or d.get("extracted_data", {}).get("merchant_name")) == v)
-                }
-                for v, amt in top_vendors
-            ],
+        top_vendors = sorted(aggregates["vendor"].items(), key=lambda x: x[1]["total_cents"], reverse=True)[:5]
+
+        def vendor_row(vendor, entry):
+            row = {"vendor": vendor, "total": f"${total(entry):,.2f}", "count": entry["count"]}
+            if "p50" in entry:
+                row["average"] = f"${total(entry) / entry['count']:,.2f}"
+                row["median"] = f"${entry['p50']:,.2f}"
+                row["p95"] = f"${entry['p95']:,.2f}"
+            return row
+
+        summary = {
+            "total_documents": aggregates["documents"],
+            "total_spend": f"${total_spend:,.2f}",
+            "average_spend": f"${avg_spend:,.2f}",
+            "highest_amount": f"${amount['max']:,.2f}",
+            "lowest_amount": f"${amount['min']:,.2f}"
+        }
+        if "p50" in amount:
+            summary["median_amount"] = f"${amount['p50']:,.2f}"
+            summary["p95_amount"] = f"${amount['p95']:,.2f}"
+
+        return {
+            "summary": summary,
+            "by_vendor": [vendor_row(vendor, entry) for vendor, entry in top_vendors],
             "by_category": [
-                {"category": cat, "total": f"${amt:,.2f}"}
-                for cat, amt in sorted(categories.items(), key=lambda x: x[1], reverse=True)
+                {"category": category, "total": f"${total(entry):,.2f}"}
+                for category, entry in sorted(aggregates["category"].items(), key=lambda x: x[1]["total_cents"], reverse=True)
             ],
             "monthly_trends": [
-                {"month": month, "total": f"${amt:,.2f}"}
-                for month, amt in sorted(monthly_spend.items())
+                {"month": month, "total": f"${total(entry):,.2f}"}
+                for month, entry in sorted(aggregates["month"].items())
             ]
         }
-        
-        # Natural language query processing
-        if query:
-            analytics["query_response"] = self._process_query(query, documents, analytics)
-        
-        return analytics
-    
-    def _process_query(self, query: str, documents: list, analytics: dict) -> str:
+
+    async def _process_query(self, query: str, document_count: int, analytics: dict) -> str:
         """Process natural language queries using LLM"""
         context = f"""
         Analytics Summary:
         {json.dumps(analytics, indent=2)}
-        
-        Total Documents: {len(documents)}
+
+        Total Documents: {document_count}
         """
-        
+
         prompt = f"""
         You are a financial analytics assistant. Answer the user's question based on the data provided.
-        
+
         {context}
-        
+
         User Question: {query}
-        
+
         Provide a clear, concise answer with specific numbers.
         """
-        
+
         try:
-            response = generate_text(prompt)
+            response = await agenerate_text(prompt)
             return response.strip()
         except:
             return "Unable to process query at this time."
@@ -1,18 +1,69 @@
-from llm_client import generate_text
+import os
+import asyncio
+from llm_client import agenerate_text, stream_text
+from chunk_index import chunk_index, rank_text
+
+# Retrieval budget for chat: at most CHAT_TOP_K chunks and CHAT_CONTEXT_CHARS characters of context
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", "8"))
+CHAT_CONTEXT_CHARS = int(os.getenv("CHAT_CONTEXT_CHARS", "6000"))
 
 class ChatAgent:
-    def chat(self, message: str, context_text: str) -> str:
+    async def chat(self, message: str, context_text: str, user_id: str = None, document_ids: list = None) -> str:
         """
         Answers a user question based on the provided document context.
         """
         print(f"Chat request: {message}")
-        
+        context = await asyncio.to_thread(self._retrieve, message, context_text, user_id, document_ids)
+        prompt = self._build_prompt(message, context)
+
+        try:
+            response = await agenerate_text(prompt)
+            return response
+        except Exception as e:
+            print(f"Error in ChatAgent: {e}")
+            return "I encountered an error while processing your request."
+
+    async def stream_chat(self, message: str, context_text: str, user_id: str = None, document_ids: list = None):
+        """
+        Same as `chat`, but yields the answer token by token as the model generates it.
+        """
+        print(f"Chat stream request: {message}")
+        context = await asyncio.to_thread(self._retrieve, message, context_text, user_id, document_ids)
+        tokens = stream_text(self._build_prompt(message, context))
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            # Stops generation right away when our consumer goes away
+            await tokens.aclose()
+
+    def _retrieve(self, message: str, context_text: str, user_id: str, document_ids: list) -> str:
+        """
+        Picks the chunks most relevant to the question. Documents indexed at ingest are
+        searched server-side; otherwise the context sent by the client is chunked on the fly.
+        Blocking (SQLite, index locks, tokenizing), so callers run it in a thread.
+        """
+        if document_ids and chunk_index.has_documents(user_id, document_ids):
+            chunks = chunk_index.search(message, user_id, document_ids, top_k=CHAT_TOP_K, char_budget=CHAT_CONTEXT_CHARS)
+        else:
+            chunks = rank_text(message, context_text or "", CHAT_TOP_K, CHAT_CONTEXT_CHARS)
+        print(f"Chat context: {len(chunks)} chunks, {sum(len(chunk['text']) for chunk in chunks)} chars")
+
+        # Keep document order so neighbouring chunks read naturally
+        chunks.sort(key=lambda chunk: (chunk["doc_id"], chunk["ordinal"]))
+        sections = []
+        for chunk in chunks:
+            header = f"[{chunk['filename']} #{chunk['ordinal'] + 1}]\n" if chunk["filename"] else ""
+            sections.append(header + chunk["text"])
+        return "\n\n".join(sections)
+
+    def _build_prompt(self, message: str, context_text: str) -> str:
         # Construct RAG prompt
-        prompt = f"""
+        return f"""
         You are RIDA, an intelligent document assistant. Answer the user's question based ONLY on the provided document context.
         
         Document Context:
-        {context_text[:10000]} # Limit context to avoid token overflow
+        {context_text}
         
         User Question:
         {message}
@@ -22,12 +73,5 @@ class ChatAgent:
         2. If the answer is not in the context, say "I cannot find that information in the documents."
         3. Do not hallucinate facts.
         """
-        
-        try:
-            response = generate_text(prompt)
-            return response
-        except Exception as e:
-            print(f"Error in ChatAgent: {e}")
-            return "I encountered an error while processing your request."
 
 chat_agent = ChatAgent()
@@ -1,41 +1,112 @@
+import os
 import csv
 import io
-from datetime import datetime
+import zlib
+from decimal import Decimal
+from datetime import date, datetime
+from normalize import normalized
+from xlsx_writer import iter_xlsx, ChunkSink, DATE_STYLE, NUMBER_STYLE
+
+# Parquet/Arrow export is optional: pyarrow is a large dependency
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Text is buffered into chunks of about this size before it is yielded to the response
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+
+CSV_HEADER = [
+    'Filename', 'Vendor', 'Invoice Number', 'Date', 'Due Date',
+    'Amount', 'Status', 'Category', 'Payment Terms'
+]
+
+XLSX_HEADER = CSV_HEADER + ['Summary']
+XLSX_WIDTHS = [30, 25, 16, 12, 12, 14, 14, 14, 16, 60]
+
+# Documents per Parquet row group / Arrow record batch
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+
+# Largest amount a decimal128(18, 2) column holds, in cents
+MAX_DECIMAL_CENTS = 10 ** 18 - 1
+
+def _date(value: str) -> date:
+    """A normalized ISO date as a date, or None."""
+    return date.fromisoformat(value) if value else None
+
+def _text(value) -> str:
+    return None if value is None or value == "" else str(value)
+
+def _decimal(cents: int) -> Decimal:
+    if cents is None or abs(cents) > MAX_DECIMAL_CENTS:
+        return None
+    return Decimal(cents).scaleb(-2)
+
+def columnar_schema():
+    return pa.schema([
+        ("filename", pa.string()),
+        ("vendor", pa.dictionary(pa.int32(), pa.string())),
+        ("invoice_number", pa.string()),
+        ("date", pa.date32()),
+        ("due_date", pa.date32()),
+        ("amount", pa.decimal128(18, 2)),
+        ("currency", pa.dictionary(pa.int32(), pa.string())),
+        ("status", pa.dictionary(pa.int32(), pa.string())),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+        ("payment_terms", pa.string()),
+        ("summary", pa.string()),
+    ])
+
+def gzip_stream(chunks):
+    """
+    Gzip-compresses a stream of byte chunks as it is produced.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
 
 class ExportAgent:
-    def export_to_csv(self, documents: list) -> str:
+    def iter_csv(self, documents):
         """
-        Export documents to CSV format
+        Streams documents as CSV, yielding UTF-8 chunks of about EXPORT_CHUNK_BYTES.
+        `documents` can be any iterable, e.g. DocumentStore.iter_query.
         """
         output = io.StringIO()
         writer = csv.writer(output)
         
         # Header
-        writer.writerow([
-            'Filename', 'Vendor', 'Invoice Number', 'Date', 'Due Date',
-            'Amount', 'Status', 'Category', 'Payment Terms'
-        ])
+        writer.writerow(CSV_HEADER)
         
         # Data rows
         for doc in documents:
             extracted = doc.get('extracted_data', {})
+            record = normalized(extracted)
+            amount = _decimal(record['amount_cents'])
             writer.writerow([
                 doc.get('filename', ''),
-                extracted.get('vendor', extracted.get('vendor_name', extracted.get('merchant_name', ''))),
+                record['vendor'] or '',
                 extracted.get('invoice_number', ''),
-                extracted.get('date', ''),
-                extracted.get('due_date', ''),
-                extracted.get('total_amount', ''),
+                record['date'] or extracted.get('date', ''),
+                record['due_date'] or extracted.get('due_date', ''),
+                extracted.get('total_amount', '') if amount is None else amount,
                 doc.get('status', ''),
                 extracted.get('detected_type', doc.get('file_type', '')),
                 extracted.get('payment_terms', '')
             ])
+            if output.tell() >= EXPORT_CHUNK_BYTES:
+                yield output.getvalue().encode("utf-8")
+                output.seek(0)
+                output.truncate()
         
-        return output.getvalue()
+        yield output.getvalue().encode("utf-8")
     
-    def export_to_quickbooks_iif(self, documents: list) -> str:
+    def iter_quickbooks_iif(self, documents):
         """
-        Export to QuickBooks IIF format (simplified)
+        Streams documents in QuickBooks IIF format (simplified), yielding UTF-8 chunks.
         """
         output = io.StringIO()
         
@@ -45,50 +116,123 @@ class ExportAgent:
         output.write("!ENDTRNS\n")
         
         for idx, doc in enumerate(documents):
-            extracted = doc.get('extracted_data', {})
-            vendor = extracted.get('vendor', extracted.get('vendor_name', 'Unknown'))
-            amount_str = extracted.get('total_amount', '0')
-            
-            # Clean amount
-            try:
-                amount = float(str(amount_str).replace('$', '').replace(',', '').strip())
-            except:
-                amount = 0
-            
-            date = extracted.get('date', datetime.now().strftime('%Y-%m-%d'))
+            record = normalized(doc.get('extracted_data') or {})
+            vendor = record['vendor'] or 'Unknown'
+            amount = (record['amount_cents'] or 0) / 100
+            date = record['date'] or datetime.now().strftime('%Y-%m-%d')
             memo = doc.get('filename', '')
             
             # Transaction line
             output.write(f"TRNS\t{idx+1}\tBILL\t{date}\tAccounts Payable\t{vendor}\t{amount:.2f}\t{memo}\n")
             # Split line (expense account)
-            output.write(f"SPL\t{idx+1}\tBILL\t{date}\tExpenses\t-{amount:.2f}\t{memo}\n")
+            output.write(f"SPL\t{idx+1}\tBILL\t{date}\tExpenses\t{-amount:.2f}\t{memo}\n")
             output.write("ENDTRNS\n")
+            if output.tell() >= EXPORT_CHUNK_BYTES:
+                yield output.getvalue().encode("utf-8")
+                output.seek(0)
+                output.truncate()
         
-        return output.getvalue()
+        yield output.getvalue().encode("utf-8")
+
+    def export_to_csv(self, documents: list) -> str:
+        """
+        Export documents to CSV format
+        """
+        return b"".join(self.iter_csv(documents)).decode("utf-8")
+    
+    def export_to_quickbooks_iif(self, documents: list) -> str:
+        """
+        Export to QuickBooks IIF format (simplified)
+        """
+        return b"".join(self.iter_quickbooks_iif(documents)).decode("utf-8")
     
-    def export_to_excel_compatible(self, documents: list) -> dict:
+    def iter_xlsx(self, documents):
+        """
+        Streams documents as an XLSX workbook: amounts are numeric cells and ISO dates
+        are date cells, so they sort and sum in Excel.
+        """
+        def rows():
+            for doc in documents:
+                extracted = doc.get('extracted_data', {})
+                record = normalized(extracted)
+                cents = record['amount_cents']
+                # Unparsed values are kept as text rather than dropped
+                yield [
+                    doc.get('filename', ''),
+                    record['vendor'],
+                    extracted.get('invoice_number', ''),
+                    _date(record['date']) or extracted.get('date', ''),
+                    _date(record['due_date']) or extracted.get('due_date', ''),
+                    extracted.get('total_amount', '') if cents is None else cents / 100,
+                    doc.get('status', ''),
+                    extracted.get('detected_type', doc.get('file_type', '')),
+                    extracted.get('payment_terms', ''),
+                    doc.get('summary', '')
+                ]
+
+        return iter_xlsx(
+            XLSX_HEADER, rows(), sheet_name="RIDA Export", widths=XLSX_WIDTHS,
+            styles=[0, 0, 0, DATE_STYLE, DATE_STYLE, NUMBER_STYLE, 0, 0, 0, 0], chunk_bytes=EXPORT_CHUNK_BYTES,
+        )
+
+    def iter_parquet(self, documents):
+        """
+        Streams documents as Parquet, one row group per EXPORT_BATCH_ROWS documents.
+        Raises RuntimeError when pyarrow is not installed.
+        """
+        if pq is None:
+            raise RuntimeError("Parquet export requires pyarrow")
+        return self._iter_columnar(documents, lambda sink, schema: pq.ParquetWriter(sink, schema, compression="zstd"))
+
+    def iter_arrow(self, documents):
         """
-        Export to Excel-compatible JSON format (can be converted to XLSX on frontend)
+        Streams documents in the Arrow IPC stream format, one record batch per
+        EXPORT_BATCH_ROWS documents. Raises RuntimeError when pyarrow is not installed.
         """
-        rows = []
+        if pa is None:
+            raise RuntimeError("Arrow export requires pyarrow")
+        return self._iter_columnar(documents, lambda sink, schema: pa.ipc.new_stream(sink, schema))
+
+    def _iter_columnar(self, documents, open_writer):
+        schema = columnar_schema()
+        sink = ChunkSink()
+        writer = open_writer(sink, schema)
+        batch = []
+
+        def flush():
+            columns = [list(column) for column in zip(*batch)]
+            # Dictionary columns are encoded per batch; readers see the dictionary type
+            arrays = [
+                pa.array(values, type=field.type.value_type).dictionary_encode() if pa.types.is_dictionary(field.type)
+                else pa.array(values, type=field.type)
+                for field, values in zip(schema, columns)
+            ]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            batch.clear()
+
         for doc in documents:
             extracted = doc.get('extracted_data', {})
-            rows.append({
-                'Filename': doc.get('filename', ''),
-                'Vendor': extracted.get('vendor', extracted.get('vendor_name', extracted.get('merchant_name', ''))),
-                'Invoice Number': extracted.get('invoice_number', ''),
-                'Date': extracted.get('date', ''),
-                'Due Date': extracted.get('due_date', ''),
-                'Amount': extracted.get('total_amount', ''),
-                'Status': doc.get('status', ''),
-                'Category': extracted.get('detected_type', doc.get('file_type', '')),
-                'Payment Terms': extracted.get('payment_terms', ''),
-                'Summary': doc.get('summary', '')
-            })
-        
-        return {
-            'headers': list(rows[0].keys()) if rows else [],
-            'data': rows
-        }
+            record = normalized(extracted)
+            batch.append((
+                _text(doc.get('filename')),
+                record['vendor'],
+                _text(extracted.get('invoice_number')),
+                _date(record['date']),
+                _date(record['due_date']),
+                _decimal(record['amount_cents']),
+                record['currency'],
+                _text(doc.get('status')),
+                _text(extracted.get('detected_type', doc.get('file_type'))),
+                _text(extracted.get('payment_terms')),
+                _text(doc.get('summary')),
+            ))
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                flush()
+                yield sink.take()
+
+        if batch:
+            flush()
+        writer.close()
+        yield sink.take()
 
 export_agent = ExportAgent()
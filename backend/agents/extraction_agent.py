@@ -1,50 +1,185 @@
+import os
 import json
-from llm_client import generate_text
+import asyncio
+from llm_client import agenerate_text, LLM_MAX_CONCURRENCY
+from context_packer import pack_text, context_options
+from normalize import normalize_fields
+
+# Chunks of a long document extracted concurrently per wave
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+
+# Fields extracted per document type: key -> description shown to the model
+DOCUMENT_FIELDS = {
+    "invoice": {
+        "vendor": "Vendor Name",
+        "invoice_number": "Invoice Number",
+        "date": "Invoice Date (YYYY-MM-DD)",
+        "due_date": "Due Date (YYYY-MM-DD)",
+        "total_amount": "Total Amount",
+        "currency": "Currency",
+        "payment_terms": "Payment Terms",
+    },
+    "receipt": {
+        "vendor": "Merchant Name",
+        "date": "Date (YYYY-MM-DD)",
+        "total_amount": "Total Amount",
+        "tax_amount": "Tax Amount",
+        "currency": "Currency",
+    },
+    "contract": {
+        "parties": "Parties Involved",
+        "effective_date": "Effective Date (YYYY-MM-DD)",
+        "expiration_date": "Expiration Date (YYYY-MM-DD)",
+        "key_terms": "Key Terms",
+    },
+    "other": {
+        "key_entities": "Key Entities",
+        "dates": "Dates",
+        "monetary_values": "Monetary Values",
+    },
+}
+
+# Fields that must be filled before extraction stops reading further chunks
+REQUIRED_FIELDS = {
+    "invoice": ["vendor", "invoice_number", "date", "total_amount"],
+    "receipt": ["vendor", "date", "total_amount"],
+    "contract": ["parties", "effective_date", "expiration_date"],
+    "other": ["key_entities", "dates", "monetary_values"],
+}
+
+def fields_for(doc_type: str) -> dict:
+    return DOCUMENT_FIELDS.get((doc_type or "").lower(), DOCUMENT_FIELDS["other"])
+
+def fields_schema(fields: dict) -> dict:
+    """
+    JSON schema for a flat object of nullable string fields, passed to Ollama's
+    structured-output `format` so the response is always parseable.
+    """
+    return {
+        "type": "object",
+        "properties": {key: {"type": ["string", "null"]} for key in fields},
+        "required": list(fields),
+    }
+
+def describe_fields(fields: dict) -> str:
+    return ", ".join(f"{key} ({label})" for key, label in fields.items())
+
+def required_fields(doc_type: str) -> list:
+    return REQUIRED_FIELDS.get((doc_type or "").lower(), REQUIRED_FIELDS["other"])
+
+def confidence_schema(fields: dict) -> dict:
+    """
+    Like `fields_schema`, but every field is a {value, confidence} pair so results
+    from different chunks of a document can be merged.
+    """
+    field = {
+        "type": "object",
+        "properties": {"value": {"type": ["string", "null"]}, "confidence": {"type": "number"}},
+        "required": ["value", "confidence"],
+    }
+    return {"type": "object", "properties": {key: field for key in fields}, "required": list(fields)}
+
+def merge_fields(merged: dict, values: dict, confidence=None):
+    """
+    Merges one chunk's fields into `merged` (key -> {value, confidence}), keeping the
+    most confident non-empty value per field. `values` holds {value, confidence} pairs,
+    or plain values that all share `confidence`.
+    """
+    for key, value in values.items():
+        field_confidence = confidence
+        if isinstance(value, dict):
+            value, field_confidence = value.get("value"), value.get("confidence")
+        if value in (None, "") or (key in merged and merged[key]["confidence"] >= (field_confidence or 0)):
+            continue
+        merged[key] = {"value": value, "confidence": float(field_confidence or 0)}
+    return merged
+
+def flatten_fields(merged: dict, fields: dict) -> dict:
+    """
+    Plain field values (null when never found) plus their confidences under `field_confidence`
+    and the parsed values under `normalized`.
+    """
+    result = {key: merged[key]["value"] if key in merged else None for key in fields}
+    result["field_confidence"] = {key: round(merged[key]["confidence"], 2) for key in fields if key in merged}
+    result["normalized"] = normalize_fields(result)
+    return result
+
 
 class ExtractionAgent:
-    def extract(self, text: str, doc_type: str) -> dict:
-        """
-        Extracts structured fields from text based on document type.
-        """
-        print(f"[Raindrop MCP] Starting SmartExtraction for document type: {doc_type}")
-        
-        # Define fields based on type
-        fields_prompt = ""
-        if doc_type.lower() == "invoice":
-            fields_prompt = "Vendor Name, Invoice Date, Invoice Number, Total Amount, Currency"
-        elif doc_type.lower() == "receipt":
-            fields_prompt = "Merchant Name, Date, Total Amount, Tax Amount"
-        elif doc_type.lower() == "contract":
-            fields_prompt = "Parties Involved, Effective Date, Expiration Date, Key Terms"
-        else:
-            fields_prompt = "Key Entities, Dates, Monetary Values, Summary"
-
-        prompt = f"""
+    PROMPT = """
         You are an expert data extraction AI. Extract the following fields from the document text below.
-        
+        The text is part {part} of {parts} of the document.
+
         Document Text:
-        {text[:3000]} # Truncate to fit context
+        {text}
 
-        Fields to Extract: {fields_prompt}
+        Fields to Extract: {fields}
+
+        For each field give its value and your confidence (0.0 to 1.0). If a field is not found in this part, use null.
+        """
 
-        Return ONLY valid JSON in this format:
-        {{
-            "field_name": "extracted_value",
-            ...
-        }}
-        If a field is not found, use null.
+    async def extract(self, text: str, doc_type: str) -> dict:
         """
+        Extracts structured fields from text based on document type. Long documents
+        are packed into context-sized chunks and extracted chunk by chunk (map-reduce).
+        """
+        print(f"[Raindrop MCP] Starting SmartExtraction for document type: {doc_type}")
+
+        # Define fields based on type
+        fields = fields_for(doc_type)
+        chunks = pack_text(text, self.PROMPT.format(part=1, parts=1, text="", fields=describe_fields(fields)))
 
         try:
-            llm_response = generate_text(prompt)
-            clean_response = llm_response.replace("```json", "").replace("```", "").strip()
-            result = json.loads(clean_response)
-            return result
-        except json.JSONDecodeError:
-            print(f"Failed to parse LLM response: {llm_response}")
-            return {"error": "Failed to parse extraction result", "raw": llm_response}
+            merged = await self.extract_chunks(chunks, doc_type)
+            return flatten_fields(merged, fields)
+        except json.JSONDecodeError as e:
+            print(f"Failed to parse LLM response: {e.doc}")
+            return {"error": "Failed to parse extraction result", "raw": e.doc}
         except Exception as e:
             print(f"Error in ExtractionAgent: {e}")
             return {"error": str(e)}
 
+    async def extract_chunks(self, chunks: list, doc_type: str, merged: dict = None, first_part: int = 1) -> dict:
+        """
+        Runs extraction over `chunks` in waves of EXTRACTION_CONCURRENCY concurrent calls
+        and merges the answers into `merged` (key -> {value, confidence}). Stops after
+        the wave that fills every required field. The first and last chunks go first,
+        since headers and totals are where most fields live. `first_part` numbers the chunks
+        when they are the tail of a document. Raises if every call failed.
+        """
+        fields = fields_for(doc_type)
+        required = required_fields(doc_type)
+        merged = merged if merged is not None else {}
+        order = list(range(len(chunks)))
+        if len(order) > 2:
+            order = [0, order[-1]] + order[1:-1]
+
+        errors, attempted = [], 0
+        for start in range(0, len(order), EXTRACTION_CONCURRENCY):
+            if all(key in merged for key in required):
+                print(f"[Raindrop MCP] Required fields filled after {start} of {len(chunks)} chunks")
+                break
+            wave = order[start:start + EXTRACTION_CONCURRENCY]
+            attempted += len(wave)
+            results = await asyncio.gather(
+                *(self._extract_chunk(chunks[i], fields, first_part + i, first_part + len(chunks) - 1) for i in wave), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    errors.append(result)
+                else:
+                    merge_fields(merged, result)
+
+        if errors and len(errors) == attempted:
+            raise errors[0]
+        return merged
+
+    async def _extract_chunk(self, chunk: str, fields: dict, part: int, parts: int) -> dict:
+        prompt = self.PROMPT.format(part=part, parts=parts, text=chunk, fields=describe_fields(fields))
+        # Deterministic decoding so re-runs on the same document can be served from the cache
+        llm_response = await agenerate_text(
+            prompt, options=context_options({"temperature": 0}), format=confidence_schema(fields), cache="extraction"
+        )
+        return json.loads(llm_response)
+
 extraction_agent = ExtractionAgent()
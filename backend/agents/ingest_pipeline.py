@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+from agents.ingestion_agent import ingestion_agent
+from agents.vultr_service import vultr_service
+from storage import store_blob, CHUNK_SIZE
+from agents.search_service import search_service
+from document_store import document_store
+from near_duplicates import near_duplicate_index
+from agents.workflow_agent import workflow_agent
+
+# Stage sizes for batch ingest: OCR is CPU-bound, the LLM stage is limited by the model server
+INGEST_OCR_WORKERS = int(os.getenv("INGEST_OCR_WORKERS", str(os.cpu_count() or 1)))
+INGEST_LLM_WORKERS = int(os.getenv("INGEST_LLM_WORKERS", "1"))
+INGEST_STORE_WORKERS = int(os.getenv("INGEST_STORE_WORKERS", "2"))
+# Bounded hand-off queues keep a large batch from OCRing far ahead of the LLM
+INGEST_PIPELINE_QUEUE_SIZE = int(os.getenv("INGEST_PIPELINE_QUEUE_SIZE", "8"))
+
+BATCH_CANCELLED = "Batch cancelled before this document was processed"
+
+class IngestPipeline:
+    """
+    Staged ingest for batches: OCR -> LLM classification -> backup/store. Each stage has
+    its own worker threads connected by bounded queues, so OCR for the next file
+    overlaps with the LLM call for the current one.
+    """
+
+    def __init__(self):
+        self.ocr_queue = queue.Queue(maxsize=INGEST_PIPELINE_QUEUE_SIZE)
+        self.llm_queue = queue.Queue(maxsize=INGEST_PIPELINE_QUEUE_SIZE)
+        self.store_queue = queue.Queue(maxsize=INGEST_PIPELINE_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.started = False
+
+    def _start(self):
+        with self.lock:
+            if self.started:
+                return
+            stages = [
+                (self._ocr_stage, INGEST_OCR_WORKERS, "ingest-ocr"),
+                (self._llm_stage, INGEST_LLM_WORKERS, "ingest-llm"),
+                (self._store_stage, INGEST_STORE_WORKERS, "ingest-store"),
+            ]
+            for target, count, name in stages:
+                for i in range(max(1, count)):
+                    threading.Thread(target=target, name=f"{name}-{i}", daemon=True).start()
+            self.started = True
+
+    def run(self, items: list, user_id: str = None, stop: threading.Event = None):
+        """
+        Feeds `items` (dicts with file_path, filename and sha256) through the pipeline
+        and yields one result per item, in completion order. Processed documents are
+        indexed for search under `user_id`. Once `stop` is set, items that have not
+        reached a stage yet are dropped (their spooled files removed) instead of processed.
+        """
+        self._start()
+        results = queue.Queue()
+        stop = stop or threading.Event()
+
+        def feed():
+            for index, item in enumerate(items):
+                item = dict(item, index=index, user_id=user_id, results=results, stop=stop)
+                if stop.is_set():
+                    self._fail(item, BATCH_CANCELLED)
+                else:
+                    self.ocr_queue.put(item)
+
+        threading.Thread(target=feed, name="ingest-feed", daemon=True).start()
+
+        for _ in range(len(items)):
+            yield results.get()
+
+    def _fail(self, item: dict, error: str):
+        if os.path.exists(item["file_path"]):
+            os.remove(item["file_path"])
+        item["results"].put({"index": item["index"], "filename": item["filename"], "error": error})
+
+    def _ocr_stage(self):
+        while True:
+            item = self.ocr_queue.get()
+            if item["stop"].is_set():
+                self._fail(item, BATCH_CANCELLED)
+                continue
+            try:
+                cached = ingestion_agent.lookup(item["sha256"], item["filename"])
+                if cached:
+                    item["result"] = cached
+                    self.store_queue.put(item)
+                    continue
+
+                item["text"] = ingestion_agent.extract_text(item["file_path"], item["filename"])
+                self.llm_queue.put(item)
+            except Exception as e:
+                self._fail(item, str(e))
+
+    def _llm_stage(self):
+        while True:
+            item = self.llm_queue.get()
+            if item["stop"].is_set():
+                self._fail(item, BATCH_CANCELLED)
+                continue
+            try:
+                classification = ingestion_agent.classify(item["text"])
+                item["result"] = ingestion_agent.finish(item["sha256"], item["filename"], item.pop("text"), classification)
+                self.store_queue.put(item)
+            except Exception as e:
+                print(f"Error in IngestPipeline: {e}")
+                self._fail(item, str(e))
+
+    def _store_stage(self):
+        while True:
+            item = self.store_queue.get()
+            if item["stop"].is_set():
+                self._fail(item, BATCH_CANCELLED)
+                continue
+            try:
+                backup = self._backup(item)
+
+                # Keeping the original makes the thumbnail endpoint work for this document
+                store_blob(item["file_path"], item["sha256"])
+                search_service.index_document(item["user_id"], item["sha256"], item["result"].get("text", ""), item["filename"])
+                workflow_agent.review_stored(item["user_id"], document_store.put_ingested(item["user_id"], item["result"]))
+                near_duplicate_index.add_ingested(item["user_id"], item["result"])
+                result = dict(item["result"], index=item["index"], vultr_backup_url=backup.get("url"), raindrop_status="processed")
+                item["results"].put(result)
+            except Exception as e:
+                self._fail(item, str(e))
+
+    def _backup(self, item: dict) -> dict:
+        """Streams the spooled file to Vultr off the request path, chunk by chunk."""
+        upload = vultr_service.begin_upload(f"{item['sha256']}{os.path.splitext(item['filename'])[1].lower()}")
+        with open(item["file_path"], "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                upload.write(chunk)
+        return upload.complete()
+
+ingest_pipeline = IngestPipeline()
@@ -1,90 +1,190 @@
 import os
 import json
-from ocr import extract_text_from_image, extract_text_from_pdf, generate_thumbnail
+import asyncio
+from ocr import extract_text_from_image, extract_text_from_pdf
 from llm_client import generate_text
+from ingest_cache import ingest_cache
+from storage import hash_file
+from agents.thumbnail_service import thumbnail_service
+from context_packer import pack_text, context_options
+from agents.extraction_agent import (
+    extraction_agent, DOCUMENT_FIELDS, fields_for, fields_schema, describe_fields, required_fields,
+    merge_fields, flatten_fields,
+)
+
+# Bumped when the shape of cached ingest results changes, so stale entries are re-processed
+CACHE_VERSION = 3
 
 class IngestionAgent:
     def __init__(self):
         self.supported_types = ["invoice", "receipt", "contract", "financial_statement", "other"]
 
-    def process(self, file_path: str, filename: str) -> dict:
+        all_fields = {key: label for fields in DOCUMENT_FIELDS.values() for key, label in fields.items()}
+        self.schema = {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "enum": self.supported_types},
+                "confidence": {"type": "number"},
+                "summary": {"type": "string"},
+                "fields": fields_schema(all_fields),
+            },
+            "required": ["type", "confidence", "summary", "fields"],
+        }
+
+    def process(self, file_path: str, filename: str, progress=None, content_hash: str = None) -> dict:
         """
         Ingests a document:
         1. Extracts text (OCR).
         2. Classifies the document type using LLM.
-        3. Generates a brief summary.
+        3. Generates a brief summary and extracts the type-specific fields (same LLM call).
+
+        Results are cached by content hash, so re-uploading the same bytes skips all three steps.
+        Thumbnails are rendered lazily by the thumbnail endpoint, not here.
+        `progress`, if given, is called with the name of each stage as it starts.
+        `content_hash` can be passed when the caller already hashed the file while receiving it.
         """
+        progress = progress or (lambda stage: None)
         print(f"[Raindrop MCP] Ingesting document: {filename}")
         print(f"[Raindrop MCP] Initializing SmartBucket for storage...")
-        
-        # 1. Extract Text
+
+        progress("cache_lookup")
+        content_hash = content_hash or hash_file(file_path)
+        cached = self.lookup(content_hash, filename)
+        if cached:
+            return cached
+
+        try:
+            # 1. Extract Text
+            progress("ocr")
+            text = self.extract_text(file_path, filename)
+
+            # 2. Classify, Summarize & Extract (One shot for efficiency)
+            progress("classify")
+            classification = self.classify(text)
+
+            return self.finish(content_hash, filename, text, classification)
+        except ValueError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            print(f"Error in IngestionAgent: {e}")
+            return {"error": str(e)}
+
+    def lookup(self, content_hash: str, filename: str) -> dict:
+        """
+        Returns the cached ingest result for this content, or None.
+        """
+        cached = ingest_cache.get(content_hash)
+        if cached and cached.get("version") == CACHE_VERSION:
+            print(f"[Raindrop MCP] Cache hit for {filename} ({content_hash[:12]})")
+            return self._build_result(cached, filename, content_hash, cache_status="hit")
+        return None
+
+    def extract_text(self, file_path: str, filename: str) -> str:
+        """
+        Extracts text from an image or PDF. Raises ValueError if nothing usable comes out.
+        """
         file_ext = os.path.splitext(filename)[1].lower()
         text = ""
-        
+
         if file_ext in [".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff"]:
             text = extract_text_from_image(file_path)
         elif file_ext == ".pdf":
             text = extract_text_from_pdf(file_path)
         else:
-            return {"error": f"Unsupported file type: {file_ext}"}
+            raise ValueError(f"Unsupported file type: {file_ext}")
 
         if not text:
-            return {"error": "No text extracted from document."}
+            raise ValueError("No text extracted from document.")
+        return text
+
+    PROMPT = """
+        You are an expert document analysis AI. Analyze the following document text.
 
-        # 2. Classify & Summarize (One shot for efficiency)
-        prompt = f"""
-        You are an expert document analysis AI. Analyze the following document text and provide a structured JSON response.
-        
         Document Text:
-        {text[:2000]}  # Truncate to avoid context limits if necessary, usually header contains type info
+        {text}
 
         Task:
-        1. Classify the document into one of these types: {', '.join(self.supported_types)}.
+        1. Classify the document into one of these types: {types}.
         2. Provide a confidence score (0.0 to 1.0).
         3. Write a 1-sentence summary of what this document is about.
+        4. Extract the fields for the detected type (other types use the "other" fields).
+           Use null for fields that are not found or do not apply:
+{fields}
+        """
 
-        Return ONLY valid JSON in this format:
-        {{
-            "type": "invoice",
-            "confidence": 0.95,
-            "summary": "Invoice from Acme Corp for web services."
-        }}
+    def classify(self, text: str) -> dict:
+        """
+        Classifies, summarizes and extracts the type-specific fields in a single LLM call
+        on the first context-sized chunk of the text. If the document is longer and
+        required fields are still missing, the remaining chunks go through map-reduce
+        extraction. The response is constrained to a JSON schema through Ollama's
+        structured output; if it still cannot be parsed, the result carries
+        `raw_llm_response` instead.
         """
-        
+        field_lines = "\n".join(
+            f"           - {doc_type}: {describe_fields(fields)}" for doc_type, fields in DOCUMENT_FIELDS.items()
+        )
+        types = ", ".join(self.supported_types)
+        chunks = pack_text(text, self.PROMPT.format(text="", types=types, fields=field_lines))
+        prompt = self.PROMPT.format(text=chunks[0], types=types, fields=field_lines)
+
+        llm_response = generate_text(prompt, options=context_options({"temperature": 0}), format=self.schema, cache="ingestion")
         try:
-            llm_response = generate_text(prompt)
-            # Clean up response if LLM adds markdown blocks
-            clean_response = llm_response.replace("```json", "").replace("```", "").strip()
-            result = json.loads(clean_response)
-            
-            # Generate Thumbnail
-            print(f"[Raindrop MCP] Generating SmartThumbnail...")
-            thumbnail_filename = f"{os.path.splitext(os.path.basename(filename))[0]}_{os.path.basename(file_path)}.png"
-            thumbnail_path = os.path.join("backend/static/thumbnails", thumbnail_filename)
-            thumbnail_url = ""
-            
-            if generate_thumbnail(file_path, thumbnail_path):
-                # URL accessible from frontend
-                thumbnail_url = f"http://localhost:8000/static/thumbnails/{thumbnail_filename}"
-
-            # Add metadata
-            result["filename"] = filename
-            result["extracted_text_length"] = len(text)
-            result["text"] = text  # Return full text for extraction
-            result["thumbnail_url"] = thumbnail_url
-            
-            return result
+            result = json.loads(llm_response)
         except json.JSONDecodeError:
             print(f"Failed to parse LLM response: {llm_response}")
             return {
-                "filename": filename,
                 "type": "unknown",
                 "confidence": 0.0,
                 "summary": "Failed to classify document.",
                 "raw_llm_response": llm_response
             }
-        except Exception as e:
-            print(f"Error in IngestionAgent: {e}")
-            return {"error": str(e)}
+
+        # Keep only the fields that belong to the detected type
+        doc_type = result.get("type")
+        fields = fields_for(doc_type)
+        found = result.pop("fields", None) or {}
+        merged = merge_fields({}, {key: found.get(key) for key in fields}, confidence=result.get("confidence"))
+
+        if len(chunks) > 1 and not all(key in merged for key in required_fields(doc_type)):
+            try:
+                # Worker threads have no event loop of their own
+                asyncio.run(extraction_agent.extract_chunks(chunks[1:], doc_type, merged, first_part=2))
+            except Exception as e:
+                print(f"Error extracting remaining chunks: {e}")
+
+        extracted = flatten_fields(merged, fields)
+        extracted["detected_type"] = doc_type
+        result["extracted_data"] = extracted
+        return result
+
+    def finish(self, content_hash: str, filename: str, text: str, classification: dict) -> dict:
+        """
+        Caches a successful classification and builds the ingest result.
+        """
+        if "raw_llm_response" in classification:
+            return dict(classification, filename=filename)
+
+        entry = {
+            "version": CACHE_VERSION,
+            "classification": classification,
+            "text": text,
+        }
+        ingest_cache.put(content_hash, entry)
+
+        return self._build_result(entry, filename, content_hash, cache_status="miss")
+
+    def _build_result(self, entry: dict, filename: str, content_hash: str, cache_status: str) -> dict:
+        result = dict(entry["classification"])
+
+        # Add metadata
+        result["filename"] = filename
+        result["extracted_text_length"] = len(entry["text"])
+        result["text"] = entry["text"]  # Return full text for extraction
+        result["thumbnail_url"] = thumbnail_service.url_for(content_hash)
+        result["content_hash"] = content_hash
+        result["cache"] = cache_status
+
+        return result
 
 ingestion_agent = IngestionAgent()
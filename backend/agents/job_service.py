@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from storage import data_path
+
+# Number of ingest jobs processed concurrently (OCR + LLM are the bottleneck)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# How long finished jobs stay pollable before they are dropped
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+class JobService:
+    """
+    Background ingest jobs. Jobs run on this process's worker pool, but their state
+    is kept in SQLite under DATA_DIR, so any uvicorn worker can answer a poll for a
+    job another worker accepted.
+    """
+
+    def __init__(self, db_path: str, max_workers: int = INGEST_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.lock = threading.Lock()
+        # The timeout waits out other workers' write transactions instead of failing
+        self.db = sqlite3.connect(db_path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT NOT NULL, stages TEXT NOT NULL, "
+            "result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+
+    def submit(self, fn, *args, **kwargs) -> dict:
+        """
+        Queues `fn(*args, progress=..., **kwargs)` on the worker pool and returns the job record.
+        The callable receives a `progress(stage)` callback to report which stage it is in.
+        """
+        self._prune()
+
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (job_id, status, stage, stages, result, error, created_at, updated_at) "
+                "VALUES (?, 'queued', 'queued', '[]', NULL, NULL, ?, ?)",
+                (job_id, now, now),
+            )
+
+        self.executor.submit(self._run, job_id, fn, args, kwargs)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT job_id, status, stage, stages, result, error, created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "stage": row[2],
+            "stages": json.loads(row[3]),
+            "result": json.loads(row[4]) if row[4] is not None else None,
+            "error": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+    def _update(self, job_id: str, status: str, stage: str, result=None, error: str = None):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, stage = ?, result = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, stage, json.dumps(result, default=str) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def _progress(self, job_id: str, stage: str):
+        with self.lock:
+            # json_insert appends in place, so progress never rewrites the stage list from a stale copy
+            self.db.execute(
+                "UPDATE jobs SET stage = ?, stages = json_insert(stages, '$[#]', ?), updated_at = ? WHERE job_id = ?",
+                (stage, stage, time.time(), job_id),
+            )
+
+    def _run(self, job_id: str, fn, args, kwargs):
+        self._update(job_id, status="running", stage="started")
+        try:
+            result = fn(*args, progress=lambda stage: self._progress(job_id, stage), **kwargs)
+            if isinstance(result, dict) and result.get("error"):
+                self._update(job_id, status="failed", stage="failed", error=result["error"], result=result)
+            else:
+                self._update(job_id, status="completed", stage="completed", result=result)
+        except Exception as e:
+            print(f"[Jobs] Job {job_id} failed: {e}")
+            self._update(job_id, status="failed", stage="failed", error=str(e))
+
+    def _prune(self):
+        """
+        Drops finished jobs older than the retention window so the table stays bounded.
+        Unfinished jobs with no progress for that long belonged to a worker that exited;
+        they are marked failed so pollers stop waiting.
+        """
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self.lock:
+            self.db.execute("DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?", (cutoff,))
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', error = 'Job lost: its worker stopped', updated_at = ? "
+                "WHERE status IN ('queued', 'running') AND updated_at < ?",
+                (time.time(), cutoff),
+            )
+
+job_service = JobService(data_path("jobs.sqlite3"))
@@ -0,0 +1,51 @@
+from llm_client import llm_client
+from chunk_index import chunk_index
+from vector_store import vector_store
+
+class SearchService:
+    """
+    SmartMemory: every processed document is chunked once, then indexed twice -
+    BM25 for chat retrieval and embeddings for semantic search.
+    """
+
+    def index_document(self, user_id: str, doc_id: str, text: str, filename: str = None):
+        """
+        Indexes a processed document. Embedding failures are logged rather than raised,
+        so ingest still succeeds when the embedding model is unavailable; the document
+        is embedded the next time it is ingested.
+        """
+        chunks = chunk_index.add_document(user_id, doc_id, text, filename)
+        # Same content hash means same chunks, so re-ingesting never re-embeds
+        if not chunks or vector_store.has_document(user_id, doc_id):
+            return
+
+        try:
+            vectors = llm_client.embed_sync(chunks)
+            vector_store.add(user_id, doc_id, vectors)
+            print(f"[SmartMemory] Embedded {len(chunks)} chunks of {filename or doc_id}")
+        except Exception as e:
+            print(f"[SmartMemory] Failed to embed {filename or doc_id}: {e}")
+
+    def remove_document(self, user_id: str, doc_id: str):
+        chunk_index.remove_document(user_id, doc_id)
+        vector_store.remove_document(user_id, doc_id)
+
+    def search(self, query: str, user_id: str, top_k: int = 10) -> list:
+        """
+        Semantic search over a user's documents. Blocks on the embedding call and
+        the vector scan, so call it from a worker thread.
+        """
+        vector = llm_client.embed_sync([query])[0]
+        results = []
+        for hit in vector_store.search(vector, user_id, top_k):
+            chunk = chunk_index.get_chunk(user_id, hit["doc_id"], hit["ordinal"]) or {}
+            results.append({
+                "doc_id": hit["doc_id"],
+                "chunk": hit["ordinal"],
+                "filename": chunk.get("filename"),
+                "score": hit["score"],
+                "text": chunk.get("text", ""),
+            })
+        return results
+
+search_service = SearchService()
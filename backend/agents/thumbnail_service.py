@@ -0,0 +1,128 @@
+import os
+import threading
+from PIL import Image
+import pypdfium2 as pdfium
+from storage import data_dir, blob_path
+
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000")
+THUMBNAIL_DEFAULT_SIZE = int(os.getenv("THUMBNAIL_DEFAULT_SIZE", "320"))
+# Requested sizes are rounded up to one of these, so a document has at most a few cached renditions
+THUMBNAIL_SIZES = tuple(sorted(int(size) for size in os.getenv("THUMBNAIL_SIZES", "64,128,320,640,1024").split(",")))
+THUMBNAIL_MAX_SIZE = THUMBNAIL_SIZES[-1]
+# Past this many bytes of cached thumbnails, the least recently served ones are deleted
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_BYTES", str(512 * 1024 * 1024)))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+def snap_size(size: int) -> int:
+    """The smallest of THUMBNAIL_SIZES at least `size` (the largest for anything bigger)."""
+    return next((fixed for fixed in THUMBNAIL_SIZES if fixed >= size), THUMBNAIL_MAX_SIZE)
+
+class ThumbnailService:
+    def __init__(self):
+        self.cache_dir = data_dir("thumbnails")
+        self.lock = threading.Lock()
+        self.cache_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self) -> list:
+        return [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+
+    def url_for(self, content_hash: str) -> str:
+        return f"{PUBLIC_BASE_URL}/documents/{content_hash}/thumbnail"
+
+    def get_or_create(self, content_hash: str, size: int, fmt: str) -> str:
+        """
+        Returns the path of the cached thumbnail, rendering it from the stored
+        original on first request. Returns None if the original is unknown.
+        """
+        thumbnail_path = os.path.join(self.cache_dir, f"{content_hash}_{size}.{fmt}")
+        try:
+            # The modification time doubles as last use for eviction
+            os.utime(thumbnail_path)
+            return thumbnail_path
+        except FileNotFoundError:
+            pass
+
+        source_path = blob_path(content_hash)
+        if not os.path.exists(source_path):
+            return None
+
+        print(f"[Raindrop MCP] Generating SmartThumbnail {size}px {fmt} for {content_hash[:12]}...")
+        image = self._render(source_path, size)
+        if fmt == "jpeg" or image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+
+        # Write under a temporary name so concurrent requests never serve a partial file
+        tmp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+        pil_format, _ = FORMATS[fmt]
+        if pil_format == "JPEG":
+            image.save(tmp_path, pil_format, quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        else:
+            image.save(tmp_path, pil_format, quality=THUMBNAIL_QUALITY, method=4)
+        os.replace(tmp_path, thumbnail_path)
+
+        with self.lock:
+            self.cache_bytes += os.path.getsize(thumbnail_path)
+            if self.cache_bytes > THUMBNAIL_CACHE_BYTES:
+                self._evict(keep=thumbnail_path)
+        return thumbnail_path
+
+    def _evict(self, keep: str):
+        """Deletes least recently served thumbnails until the cache is back under 90% of its cap."""
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        removed = 0
+        for entry in entries:
+            if total <= THUMBNAIL_CACHE_BYTES * 0.9:
+                break
+            if entry.path == keep:
+                continue
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self.cache_bytes = total
+        print(f"[Raindrop MCP] Evicted {removed} cached SmartThumbnails")
+
+    def remove(self, content_hash: str):
+        """Deletes every cached rendition of a document."""
+        with self.lock:
+            for entry in self._entries():
+                if entry.name.startswith(f"{content_hash}_"):
+                    try:
+                        size = entry.stat().st_size
+                        os.remove(entry.path)
+                        self.cache_bytes -= size
+                    except FileNotFoundError:
+                        pass
+
+    def _render(self, source_path: str, size: int) -> Image.Image:
+        with open(source_path, "rb") as f:
+            is_pdf = f.read(5) == b"%PDF-"
+
+        if is_pdf:
+            pdf = pdfium.PdfDocument(source_path)
+            try:
+                page = pdf[0]
+                width, height = page.get_size()
+                # Render straight at the target size instead of full size + resize
+                bitmap = page.render(scale=size / max(width, height))
+                return bitmap.to_pil()
+            finally:
+                pdf.close()
+
+        with Image.open(source_path) as img:
+            # Lets the JPEG decoder downscale while decoding
+            img.draft("RGB", (size, size))
+            img.thumbnail((size, size))
+            img.load()
+            return img.copy()
+
+thumbnail_service = ThumbnailService()
@@ -11,21 +11,19 @@ class VultrService:
         """
         Simulates uploading a file to Vultr Object Storage.
         """
+        upload = self.begin_upload(filename)
+        upload.write(file_data)
+        return upload.complete()
+
+    def begin_upload(self, filename: str) -> "VultrUpload":
+        """
+        Simulates opening a streaming (multipart) upload to Vultr Object Storage.
+        Chunks are passed to `write` as they arrive; `complete` finalises the object.
+        """
         print(f"[Vultr] Connecting to Object Storage in region {self.region}...")
         time.sleep(0.5) # Simulate network latency
         print(f"[Vultr] Uploading {filename} to bucket {self.storage_bucket}...")
-        time.sleep(0.5)
-        
-        # Generate a mock URL
-        mock_url = f"https://{self.region}.vultrobjects.com/{self.storage_bucket}/{filename}"
-        print(f"[Vultr] Upload successful. Public URL: {mock_url}")
-        
-        return {
-            "success": True,
-            "url": mock_url,
-            "provider": "Vultr Object Storage",
-            "region": self.region
-        }
+        return VultrUpload(self, filename)
 
     def log_metadata(self, metadata: dict) -> dict:
         """
@@ -55,4 +53,32 @@ class VultrService:
             "execution_time": "0.45s"
         }
 
+class VultrUpload:
+    def __init__(self, service: VultrService, filename: str):
+        self.service = service
+        self.filename = filename
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        # Simulate streaming one part of the object
+        self.size += len(chunk)
+
+    def complete(self) -> dict:
+        time.sleep(0.5) # Simulate network latency
+
+        # Generate a mock URL
+        mock_url = f"https://{self.service.region}.vultrobjects.com/{self.service.storage_bucket}/{self.filename}"
+        print(f"[Vultr] Upload successful ({self.size} bytes). Public URL: {mock_url}")
+
+        return {
+            "success": True,
+            "url": mock_url,
+            "provider": "Vultr Object Storage",
+            "region": self.service.region,
+            "size": self.size
+        }
+
+    def abort(self):
+        print(f"[Vultr] Aborted upload of {self.filename}")
+
 vultr_service = VultrService()
@@ -1,32 +1,160 @@
+import math
 from datetime import datetime, timedelta
+from vendor_history import vendor_history, invoice_key
+from document_store import document_store
+from normalize import normalized, first_field, amount_of, AMOUNT_FIELDS
 
 class WorkflowAgent:
     def __init__(self):
-        # In-memory cache for vendor averages (in production, use database)
-        self.vendor_history = {}
+        # Persisted per-vendor index of approved documents
+        self.vendor_history = vendor_history
     
-    def evaluate(self, doc_data: dict, all_documents: list = None) -> dict:
+    def evaluate(self, doc_data: dict, all_documents: list = None, user_id: str = None) -> dict:
         """
         Evaluates document data against business rules and detects anomalies.
+        Vendor history comes from `all_documents` when given (one pass over them),
+        otherwise from the user's approved documents in the vendor index.
         """
         print(f"Evaluating workflow for: {doc_data.get('filename', 'Unknown')}")
-        
+
+        extracted = doc_data.get("extracted_data") or {}
+        record = normalized(extracted)
+        invoice_number = extracted.get("invoice_number", "")
+        # Neither this document nor its stored copy counts as a duplicate of itself
+        own_ids = {doc_data.get("id"), extracted.get("content_hash")} - {None}
+
+        stats = duplicate = None
+        if record["vendor_key"] and all_documents is not None:
+            stats, duplicate = self._document_history(all_documents, record["vendor_key"], invoice_key(invoice_number), own_ids)
+        elif record["vendor_key"] and user_id is not None:
+            stats = self.vendor_history.stats(user_id, record["vendor"])
+            if invoice_number:
+                duplicate = self.vendor_history.find_invoice(user_id, record["vendor"], invoice_number, exclude=own_ids)
+
+        return self._apply_rules(doc_data, stats, duplicate, record)
+
+    def _document_history(self, documents: list, key: str, invoice: str, own_ids: set) -> tuple:
+        """
+        Vendor statistics (Welford) and the first other document with the same
+        invoice number among ad-hoc documents, in one pass without an index.
+        """
+        count, mean, m2 = 0, 0.0, 0.0
+        duplicate = None
+        for index, doc in enumerate(documents):
+            extracted = doc.get("extracted_data") or {}
+            record = normalized(extracted)
+            if record["vendor_key"] != key:
+                continue
+            amount = amount_of(record)
+            if amount is not None:
+                count += 1
+                delta = amount - mean
+                mean += delta / count
+                m2 += delta * (amount - mean)
+            doc_id = doc.get("id") or f"#{index}"
+            if duplicate is None and invoice and doc_id not in own_ids and invoice_key(extracted.get("invoice_number")) == invoice:
+                duplicate = {"id": doc_id, "filename": doc.get("filename")}
+        stats = {"count": count, "mean": mean, "std_dev": math.sqrt(m2 / (count - 1)) if count > 1 else 0.0} if count else None
+        return stats, duplicate
+
+    def review_stored(self, user_id: str, doc: dict) -> dict:
+        """
+        Runs the rules on a freshly stored document against the user's vendor index
+        and stores the resulting status; documents the rules approve then join their
+        vendor's history. Documents already reviewed keep their status. Returns the
+        stored document.
+        """
+        if doc.get("status") == "processed":
+            result = self.evaluate(doc, user_id=user_id)
+            doc = document_store.update(user_id, doc["id"], {"status": result["status"]}) or doc
+        self.vendor_history.sync(user_id, doc)
+        return doc
+
+    def evaluate_batch(self, documents: list) -> dict:
+        """
+        Evaluates every document against the rest of the batch in one pass: documents
+        are grouped by normalised vendor, outliers are judged against the other
+        documents in the group and duplicate invoice numbers are found by hashing.
+        Each document gets the same result `evaluate` would give it with the other
+        documents as `all_documents`.
+        """
+        print(f"Evaluating workflow for a batch of {len(documents)} documents")
+
+        ids = [doc.get("id") or f"#{index}" for index, doc in enumerate(documents)]
+        records = [normalized(doc.get("extracted_data") or {}) for doc in documents]
+        # vendor key -> amount count/sum/sum of squares (exact, in cents) and invoice key -> document positions
+        groups = {}
+        for index, doc in enumerate(documents):
+            extracted = doc.get("extracted_data") or {}
+            key = records[index]["vendor_key"]
+            if not key:
+                continue
+            group = groups.setdefault(key, {"count": 0, "sum": 0, "squares": 0, "invoices": {}})
+            cents = records[index]["amount_cents"]
+            if cents is not None:
+                group["count"] += 1
+                group["sum"] += cents
+                group["squares"] += cents * cents
+            invoice = invoice_key(extracted.get("invoice_number"))
+            if invoice:
+                group["invoices"].setdefault(invoice, []).append(index)
+
+        results = []
+        summary = {"documents": len(documents), "requires_human_review": 0, "by_status": {}, "by_risk_level": {}, "anomalies": {}}
+        for index, doc in enumerate(documents):
+            extracted = doc.get("extracted_data") or {}
+            group = groups.get(records[index]["vendor_key"])
+            stats = duplicate = None
+            if group:
+                stats = self._peer_stats(group, records[index]["amount_cents"])
+                own_ids = {ids[index], extracted.get("content_hash")} - {None}
+                for other in group["invoices"].get(invoice_key(extracted.get("invoice_number")), ()):
+                    if other != index and ids[other] not in own_ids:
+                        duplicate = {"id": ids[other], "filename": documents[other].get("filename")}
+                        break
+
+            result = self._apply_rules(doc, stats, duplicate, records[index])
+            results.append({"id": ids[index], "filename": doc.get("filename"), **result})
+
+            summary["requires_human_review"] += result["requires_human_review"]
+            summary["by_status"][result["status"]] = summary["by_status"].get(result["status"], 0) + 1
+            summary["by_risk_level"][result["risk_level"]] = summary["by_risk_level"].get(result["risk_level"], 0) + 1
+            for anomaly in result["anomalies"]:
+                summary["anomalies"][anomaly["type"]] = summary["anomalies"].get(anomaly["type"], 0) + 1
+
+        return {"results": results, "summary": summary}
+
+    def _peer_stats(self, group: dict, cents: int) -> dict:
+        """Vendor statistics over a batch group with this document's own amount left out."""
+        count, total, squares = group["count"], group["sum"], group["squares"]
+        if cents is not None:
+            count, total, squares = count - 1, total - cents, squares - cents * cents
+        if count <= 0:
+            return None
+        mean = total / count
+        variance = max(squares - total * total / count, 0.0) / (count - 1) if count > 1 else 0.0
+        return {"count": count, "mean": mean / 100, "std_dev": math.sqrt(variance) / 100}
+
+    def _apply_rules(self, doc_data: dict, stats: dict, duplicate: dict, record: dict = None) -> dict:
+        """
+        Runs the business rules for one document, given its vendor's history
+        statistics and another document with the same invoice number, if any.
+        `record` is the document's normalized record when the caller already has it.
+        """
         triggers = []
         anomalies = []
         status = "approved"
         
         # Extract key data
-        extracted = doc_data.get("extracted_data", {})
-        vendor = extracted.get("vendor", "").strip()
-        total_amount_str = extracted.get("total_amount", "0")
+        extracted = doc_data.get("extracted_data") or {}
+        record = record or normalized(extracted)
+        vendor = record["vendor"] or ""
         invoice_number = extracted.get("invoice_number", "")
         date_str = extracted.get("date", "")
         
-        # Parse amount
-        try:
-            clean_amount = float(str(total_amount_str).replace("$", "").replace(",", "").strip())
-        except:
-            clean_amount = 0
+        # Amount, parsed once at extraction
+        clean_amount = amount_of(record) or 0
+        if record["amount_cents"] is None and first_field(extracted, AMOUNT_FIELDS) is not None:
             anomalies.append({
                 "type": "missing_amount",
                 "severity": "high",
@@ -55,56 +183,35 @@ class WorkflowAgent:
                 "message": "Invoice date is missing"
             })
         
-        # Anomaly Detection (if we have historical data)
-        if all_documents and vendor:
-            # Calculate vendor average
-            vendor_amounts = []
-            vendor_invoices = []
-            
-            for doc in all_documents:
-                doc_vendor = doc.get("extracted_data", {}).get("vendor", "").strip()
-                if doc_vendor.lower() == vendor.lower():
-                    try:
-                        amt_str = doc.get("extracted_data", {}).get("total_amount", "0")
-                        amt = float(str(amt_str).replace("$", "").replace(",", "").strip())
-                        vendor_amounts.append(amt)
-                        vendor_invoices.append(doc)
-                    except:
-                        pass
-            
-            # Anomaly 1: Outlier Detection (amount > 3x average)
-            if len(vendor_amounts) >= 2:
-                avg_amount = sum(vendor_amounts) / len(vendor_amounts)
-                if clean_amount > avg_amount * 3:
-                    anomalies.append({
-                        "type": "outlier_amount",
-                        "severity": "high",
-                        "message": f"Amount ${clean_amount:,.2f} is {clean_amount/avg_amount:.1f}x higher than average ${avg_amount:,.2f} for {vendor}",
-                        "details": {
-                            "average": avg_amount,
-                            "current": clean_amount,
-                            "multiplier": clean_amount / avg_amount
-                        }
-                    })
-                    status = "needs_review"
-            
-            # Anomaly 2: Duplicate Invoice Detection
-            if invoice_number:
-                for doc in vendor_invoices:
-                    doc_inv_num = doc.get("extracted_data", {}).get("invoice_number", "")
-                    if doc_inv_num and doc_inv_num.strip().lower() == invoice_number.strip().lower():
-                        if doc.get("id") != doc_data.get("id"):  # Not the same document
-                            anomalies.append({
-                                "type": "duplicate_invoice",
-                                "severity": "critical",
-                                "message": f"Duplicate invoice number {invoice_number} detected for {vendor}",
-                                "details": {
-                                    "duplicate_doc_id": doc.get("id"),
-                                    "duplicate_filename": doc.get("filename")
-                                }
-                            })
-                            status = "needs_review"
-                            break
+        # Anomaly 1: Outlier Detection (amount > 3x average)
+        if stats and stats["count"] >= 2 and stats["mean"] > 0:
+            avg_amount = stats["mean"]
+            if clean_amount > avg_amount * 3:
+                anomalies.append({
+                    "type": "outlier_amount",
+                    "severity": "high",
+                    "message": f"Amount ${clean_amount:,.2f} is {clean_amount/avg_amount:.1f}x higher than average ${avg_amount:,.2f} for {vendor}",
+                    "details": {
+                        "average": avg_amount,
+                        "std_dev": stats["std_dev"],
+                        "current": clean_amount,
+                        "multiplier": clean_amount / avg_amount
+                    }
+                })
+                status = "needs_review"
+        
+        # Anomaly 2: Duplicate Invoice Detection
+        if duplicate and invoice_number:
+            anomalies.append({
+                "type": "duplicate_invoice",
+                "severity": "critical",
+                "message": f"Duplicate invoice number {invoice_number} detected for {vendor}",
+                "details": {
+                    "duplicate_doc_id": duplicate["id"],
+                    "duplicate_filename": duplicate["filename"]
+                }
+            })
+            status = "needs_review"
         
         # Anomaly 3: Unusually Low Amount (possible data entry error)
         if clean_amount > 0 and clean_amount < 1:
@@ -0,0 +1,233 @@
+import threading
+import numpy as np
+from document_store import document_store, aggregate_keys
+from normalize import normalized, vendor_key
+
+PERCENTILES = {"p50": 50, "p95": 95}
+TOP_VENDORS = 5
+
+def encode(values) -> tuple:
+    """
+    Dictionary-encodes a column: returns (int32 codes, list of distinct values),
+    with None encoded as -1.
+    """
+    dictionary = {}
+    codes = np.fromiter(
+        (-1 if value is None else dictionary.setdefault(value, len(dictionary)) for value in values),
+        dtype=np.int32, count=len(values),
+    )
+    return codes, list(dictionary)
+
+def recode(codes: np.ndarray, dictionary: list, new_codes: np.ndarray, new_dictionary: list) -> tuple:
+    """
+    Re-expresses codes from another column's dictionary in terms of `dictionary`,
+    extended with any values it lacks. Returns (codes, extended dictionary).
+    """
+    index = {value: code for code, value in enumerate(dictionary)}
+    merged = list(dictionary)
+    # The extra trailing slot maps code -1 (None) to itself
+    mapping = np.full(len(new_dictionary) + 1, -1, dtype=np.int32)
+    for code, value in enumerate(new_dictionary):
+        if value not in index:
+            index[value] = len(merged)
+            merged.append(value)
+        mapping[code] = index[value]
+    return mapping[new_codes], merged
+
+def group_stats(codes: np.ndarray, cents: np.ndarray, groups: int) -> dict:
+    """
+    Per-group count, total, min, max and percentiles (in cents) for rows already
+    filtered to valid codes. One sort by (group, amount) serves every statistic.
+    """
+    counts = np.bincount(codes, minlength=groups)
+    totals = np.bincount(codes, weights=cents, minlength=groups).round().astype(np.int64)
+    order = np.lexsort((cents, codes))
+    values = cents[order]
+    starts = np.cumsum(counts) - counts
+
+    filled = counts > 0
+    stats = {"count": counts, "total_cents": totals}
+    low = np.zeros(groups)
+    high = np.zeros(groups)
+    low[filled] = values[starts[filled]]
+    high[filled] = values[starts[filled] + counts[filled] - 1]
+    stats["min"], stats["max"] = low, high
+
+    for name, q in PERCENTILES.items():
+        # Linear interpolation between closest ranks, as np.percentile does
+        position = q / 100 * (counts[filled] - 1)
+        below = np.floor(position).astype(np.int64)
+        above = np.ceil(position).astype(np.int64)
+        fraction = position - below
+        result = np.zeros(groups)
+        result[filled] = values[starts[filled] + below] * (1 - fraction) + values[starts[filled] + above] * fraction
+        stats[name] = result
+    return stats
+
+class Frame:
+    """
+    Columnar view of a set of documents: amounts as int64 cents, everything that is
+    grouped or filtered on as dictionary-encoded int32 codes (dates as fixed-width
+    strings, which compare correctly as ISO dates).
+    """
+
+    def __init__(self, rows: list):
+        # rows: (doc_id, doc_type, status, vendor_key, date, amount, vendor, category, month)
+        columns = list(zip(*rows)) if rows else [()] * 9
+        doc_ids, doc_types, statuses, vendor_keys, dates, amounts, vendors, categories, months = columns
+        self.size = len(rows)
+        self.doc_ids = np.array(doc_ids, dtype=object)
+        self.positions = dict(zip(doc_ids, range(self.size)))
+        self.type_codes, self.types = encode(doc_types)
+        self.status_codes, self.statuses = encode(statuses)
+        self.vendor_key_codes, self.vendor_keys = encode(vendor_keys)
+        self.dates = np.array([date or "" for date in dates], dtype="U10")
+
+        amount_values = np.array([np.nan if amount is None else amount for amount in amounts], dtype=np.float64)
+        self.has_amount = ~np.isnan(amount_values)
+        self.cents = np.where(self.has_amount, np.round(amount_values * 100), 0).astype(np.int64)
+
+        self.groups = {}
+        for dimension, values in (("vendor", vendors), ("category", categories), ("month", months)):
+            self.groups[dimension] = encode(values)
+
+    @classmethod
+    def from_documents(cls, documents: list) -> "Frame":
+        rows = []
+        for doc in documents:
+            extracted = doc.get("extracted_data") or {}
+            record = normalized(extracted)
+            amount, vendor, category, month = aggregate_keys(dict(extracted, normalized=record), doc.get("file_type"))
+            rows.append((
+                doc.get("id"), doc.get("file_type"), doc.get("status"), record["vendor_key"],
+                record["date"], amount, vendor, category, month,
+            ))
+        return cls(rows)
+
+    def merged(self, rows: list) -> "Frame":
+        """
+        A new Frame with `rows` (as passed to the constructor) replacing the rows of the
+        same documents and appending the rest. This Frame is left as it was, so readers
+        still holding it are unaffected.
+        """
+        delta = Frame(rows)
+        at = np.fromiter((self.positions.get(doc_id, -1) for doc_id in delta.doc_ids), dtype=np.int64, count=delta.size)
+        added = at < 0
+        at[added] = np.arange(self.size, self.size + int(added.sum()))
+
+        frame = Frame.__new__(Frame)
+        frame.size = self.size + int(added.sum())
+        frame.positions = dict(self.positions)
+        frame.positions.update(zip(delta.doc_ids[added], at[added].tolist()))
+
+        def column(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+            out = np.resize(old, frame.size) if frame.size != self.size else old.copy()
+            out[at] = new
+            return out
+
+        frame.doc_ids = column(self.doc_ids, delta.doc_ids)
+        frame.dates = column(self.dates, delta.dates)
+        frame.has_amount = column(self.has_amount, delta.has_amount)
+        frame.cents = column(self.cents, delta.cents)
+        for codes, dictionary in (("type_codes", "types"), ("status_codes", "statuses"), ("vendor_key_codes", "vendor_keys")):
+            new_codes, values = recode(getattr(self, codes), getattr(self, dictionary), getattr(delta, codes), getattr(delta, dictionary))
+            setattr(frame, codes, column(getattr(self, codes), new_codes))
+            setattr(frame, dictionary, values)
+        frame.groups = {}
+        for dimension, (codes, dictionary) in self.groups.items():
+            new_codes, values = recode(codes, dictionary, *delta.groups[dimension])
+            frame.groups[dimension] = (column(codes, new_codes), values)
+        return frame
+
+    def _equals(self, codes: np.ndarray, dictionary: list, value) -> np.ndarray:
+        return codes == (dictionary.index(value) if value in dictionary else -2)
+
+    def mask(self, doc_ids: list = None, doc_type: str = None, vendor: str = None, status: str = None,
+             date_from: str = None, date_to: str = None) -> np.ndarray:
+        """
+        Boolean row mask with the same semantics as DocumentStore.query filters.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        if doc_ids is not None:
+            mask &= np.isin(self.doc_ids, np.array(list(doc_ids), dtype=object))
+        if doc_type is not None:
+            mask &= self._equals(self.type_codes, self.types, doc_type)
+        if vendor_key(vendor):
+            mask &= self._equals(self.vendor_key_codes, self.vendor_keys, vendor_key(vendor))
+        if status is not None:
+            mask &= self._equals(self.status_codes, self.statuses, status)
+        if date_from:
+            mask &= (self.dates >= date_from) & (self.dates != "")
+        if date_to:
+            mask &= (self.dates <= date_to) & (self.dates != "")
+        return mask
+
+class AnalyticsEngine:
+    """
+    Vectorised analytics over Frames. Frames loaded from the document store are
+    cached per user. When the user's store revision moves on, only the rows written
+    since are fetched and merged in; the Frame is reloaded in full only after
+    deletions, which bump the store's epoch.
+    """
+
+    def __init__(self):
+        self.frames = {}  # user_id -> (revision, epoch, Frame)
+        self.lock = threading.Lock()
+
+    def frame(self, user_id: str) -> Frame:
+        revision = document_store.revision(user_id)
+        with self.lock:
+            cached = self.frames.get(user_id)
+        if cached and cached[0] == revision:
+            return cached[2]
+
+        frame = None
+        if cached:
+            revision, epoch, rows = document_store.columns(user_id, since=cached[0])
+            if epoch == cached[1]:
+                frame = cached[2].merged(rows)
+        if frame is None:
+            revision, epoch, rows = document_store.columns(user_id)
+            frame = Frame(rows)
+        with self.lock:
+            self.frames[user_id] = (revision, epoch, frame)
+        return frame
+
+    def compute(self, frame: Frame, mask: np.ndarray = None, top_vendors: int = TOP_VENDORS) -> dict:
+        """
+        Aggregates in the shape DocumentStore.aggregates returns (totals in cents,
+        min/max in dollars), plus p50/p95 per bucket. Only the `top_vendors` vendors
+        by total are returned.
+        """
+        mask = np.ones(frame.size, dtype=bool) if mask is None else mask
+        priced = mask & frame.has_amount
+        cents = frame.cents[priced]
+
+        result = {"documents": int(mask.sum()), "amount": None, "vendor": {}, "category": {}, "month": {}}
+        if len(cents):
+            result["amount"] = {
+                "count": len(cents),
+                "total_cents": int(cents.sum()),
+                "min": cents.min() / 100,
+                "max": cents.max() / 100,
+            }
+            for name, value in zip(PERCENTILES, np.percentile(cents, list(PERCENTILES.values()))):
+                result["amount"][name] = value / 100
+
+        for dimension, (codes, dictionary) in frame.groups.items():
+            valid = priced & (codes >= 0)
+            if not valid.any():
+                continue
+            stats = group_stats(codes[valid], frame.cents[valid], len(dictionary))
+            present = np.flatnonzero(stats["count"])
+            if dimension == "vendor" and len(present) > top_vendors:
+                top = np.argpartition(-stats["total_cents"][present], top_vendors)[:top_vendors]
+                present = present[top]
+            for i in present:
+                entry = {"count": int(stats["count"][i]), "total_cents": int(stats["total_cents"][i])}
+                for name in ("min", "max", *PERCENTILES):
+                    entry[name] = float(stats[name][i]) / 100
+                result[dimension][dictionary[i]] = entry
+        return result
+
+analytics_engine = AnalyticsEngine()
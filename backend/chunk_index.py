@@ -0,0 +1,232 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from storage import data_path
+
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "1000"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP_CHARS", "200"))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "how", "i", "in",
+    "is", "it", "me", "my", "of", "on", "or", "our", "the", "this", "to", "was", "we", "what", "when",
+    "where", "which", "who", "with", "you", "your",
+}
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def split_chunks(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> list:
+    """
+    Splits text into overlapping chunks of about `size` characters, breaking on
+    whitespace where possible so words are not cut in half.
+    """
+    text = text.strip()
+    if len(text) <= size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space
+        chunks.append(text[start:end].strip())
+        if end == len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+class UserChunks:
+    """
+    One user's chunks with their inverted index and BM25 statistics, so a search
+    only scores (and weighs terms against) that user's documents.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.next_id = 0
+        self.chunks = {}  # chunk_id -> (doc_id, ordinal, filename, text, length)
+        self.documents = defaultdict(list)  # doc_id -> [chunk_id]
+        self.postings = defaultdict(dict)  # term -> {chunk_id: term frequency}
+        self.total_length = 0
+
+    def add_chunk(self, doc_id: str, ordinal: int, filename: str, text: str):
+        chunk_id = self.next_id
+        self.next_id += 1
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self.chunks[chunk_id] = (doc_id, ordinal, filename, text, length)
+        self.documents[doc_id].append(chunk_id)
+        self.total_length += length
+        for term, count in terms.items():
+            self.postings[term][chunk_id] = count
+
+    def remove_chunks(self, doc_id: str):
+        for chunk_id in self.documents.pop(doc_id, []):
+            text, length = self.chunks[chunk_id][3], self.chunks[chunk_id][4]
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= length
+            del self.chunks[chunk_id]
+
+class ChunkIndex:
+    """
+    BM25 index over overlapping document chunks. Chunks are persisted in SQLite;
+    each user's inverted index is rebuilt in memory the first time that user is
+    searched or written to, and IDF is computed over that user's chunks only.
+    Pass db_path=None for a throwaway in-memory index (e.g. over ad-hoc chat context).
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path
+        # Guards `users` and the connection; each user's index has its own lock
+        self.lock = threading.Lock()
+        self.users = {}  # user_id -> UserChunks
+
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "user_id TEXT NOT NULL, doc_id TEXT NOT NULL, ordinal INTEGER NOT NULL, "
+                "filename TEXT, text TEXT NOT NULL, PRIMARY KEY (user_id, doc_id, ordinal))"
+            )
+
+    def _user(self, user_id: str) -> UserChunks:
+        """The user's index, created empty; callers hold its lock and call `_load`."""
+        with self.lock:
+            return self.users.setdefault(user_id, UserChunks())
+
+    def _load(self, user_id: str, user: UserChunks):
+        if user.loaded:
+            return
+        if self.db:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT doc_id, ordinal, filename, text FROM chunks WHERE user_id = ? ORDER BY doc_id, ordinal",
+                    (user_id,),
+                ).fetchall()
+            for doc_id, ordinal, filename, text in rows:
+                user.add_chunk(doc_id, ordinal, filename, text)
+        user.loaded = True
+
+    def add_document(self, user_id: str, doc_id: str, text: str, filename: str = None) -> list:
+        """
+        (Re)indexes a document's text. Returns the chunks written, in ordinal order.
+        """
+        chunks = split_chunks(text)
+        user = self._user(user_id)
+        with user.lock:
+            self._load(user_id, user)
+            user.remove_chunks(doc_id)
+            for ordinal, chunk in enumerate(chunks):
+                user.add_chunk(doc_id, ordinal, filename, chunk)
+
+            if self.db:
+                with self.lock:
+                    self.db.execute("BEGIN")
+                    self.db.execute("DELETE FROM chunks WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+                    self.db.executemany(
+                        "INSERT INTO chunks (user_id, doc_id, ordinal, filename, text) VALUES (?, ?, ?, ?, ?)",
+                        [(user_id, doc_id, ordinal, filename, chunk) for ordinal, chunk in enumerate(chunks)],
+                    )
+                    self.db.execute("COMMIT")
+        return chunks
+
+    def remove_document(self, user_id: str, doc_id: str):
+        user = self._user(user_id)
+        with user.lock:
+            self._load(user_id, user)
+            user.remove_chunks(doc_id)
+            if self.db:
+                with self.lock:
+                    self.db.execute("DELETE FROM chunks WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+
+    def get_chunk(self, user_id: str, doc_id: str, ordinal: int) -> dict:
+        user = self._user(user_id)
+        with user.lock:
+            self._load(user_id, user)
+            chunk_ids = user.documents.get(doc_id, [])
+            if ordinal >= len(chunk_ids):
+                return None
+            _, _, filename, text, _ = user.chunks[chunk_ids[ordinal]]
+            return {"filename": filename, "text": text}
+
+    def has_documents(self, user_id: str, doc_ids: list) -> bool:
+        user = self._user(user_id)
+        with user.lock:
+            self._load(user_id, user)
+            return any(doc_id in user.documents for doc_id in doc_ids)
+
+    def search(self, query: str, user_id: str, doc_ids: list = None, top_k: int = 8, char_budget: int = None) -> list:
+        """
+        Returns the top-k of the user's chunks for `query` by BM25, optionally
+        restricted to a set of documents, and trimmed to fit `char_budget` characters.
+        """
+        user = self._user(user_id)
+        with user.lock:
+            self._load(user_id, user)
+            if not user.chunks:
+                return []
+
+            allowed = None
+            if doc_ids is not None:
+                allowed = {chunk_id for doc_id in doc_ids for chunk_id in user.documents.get(doc_id, [])}
+
+            chunk_count = len(user.chunks)
+            average_length = user.total_length / chunk_count or 1
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = user.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    length = user.chunks[chunk_id][4]
+                    norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[chunk_id] += idf * frequency * (BM25_K1 + 1) / norm
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            if not ranked:
+                # Nothing matched (e.g. "summarize this"): fall back to the opening chunks
+                candidates = allowed if allowed is not None else user.chunks
+                ranked = [(chunk_id, 0.0) for chunk_id in sorted(candidates, key=lambda c: (user.chunks[c][1], c))]
+            results = []
+            used = 0
+            for chunk_id, score in ranked:
+                if len(results) >= top_k:
+                    break
+                doc_id, ordinal, filename, text, _ = user.chunks[chunk_id]
+                if char_budget is not None and used + len(text) > char_budget:
+                    continue
+                used += len(text)
+                results.append({"doc_id": doc_id, "ordinal": ordinal, "filename": filename, "text": text, "score": round(score, 4)})
+            return results
+
+def rank_text(query: str, text: str, top_k: int, char_budget: int) -> list:
+    """
+    Ranks chunks of an ad-hoc text against `query` without touching the persistent index.
+    """
+    index = ChunkIndex()
+    index.add_document("", "context", text)
+    return index.search(query, "", top_k=top_k, char_budget=char_budget)
+
+chunk_index = ChunkIndex(data_path("chunks.sqlite3"))
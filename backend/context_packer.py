@@ -0,0 +1,30 @@
+import os
+import math
+from chunk_index import split_chunks
+
+# Context window requested from Ollama (num_ctx) and the share of it kept free for the answer
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "4096"))
+LLM_RESPONSE_TOKENS = int(os.getenv("LLM_RESPONSE_TOKENS", "512"))
+
+# Conservative average for English and OCR output; Ollama has no tokenizer endpoint to ask
+CHARS_PER_TOKEN = 3.5
+PACK_OVERLAP_CHARS = 200
+MIN_PACK_CHARS = 1000
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def pack_text(text: str, prompt: str) -> list:
+    """
+    Splits `text` into overlapping chunks that each fit the context window next to
+    `prompt` (the prompt template without the document) and the response reserve.
+    """
+    budget = LLM_CONTEXT_TOKENS - estimate_tokens(prompt) - LLM_RESPONSE_TOKENS
+    size = max(int(budget * CHARS_PER_TOKEN), MIN_PACK_CHARS)
+    return split_chunks(text, size, PACK_OVERLAP_CHARS)
+
+def context_options(options: dict = None) -> dict:
+    """
+    LLM options with the context window the chunks were packed for.
+    """
+    return dict(options or {}, num_ctx=LLM_CONTEXT_TOKENS)
@@ -0,0 +1,444 @@
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from storage import data_path
+from normalize import normalize_fields, normalized, amount_of, vendor_key
+
+# Columns PATCH /documents/{doc_id} may change directly; everything else lives in extracted_data
+UPDATABLE_COLUMNS = {"filename", "status", "doc_type", "summary"}
+
+# Bumped when derived columns change meaning; older stores are rebuilt from the stored JSON on open
+SCHEMA_VERSION = 3
+
+AGGREGATE_DIMENSIONS = ("vendor", "category", "month")
+
+def aggregate_keys(extracted: dict, doc_type: str = None) -> tuple:
+    """
+    Where a document counts in the analytics: (amount, vendor, category, month).
+    Documents without a usable amount count towards nothing but the document total;
+    documents with an amount but no known vendor only count towards the spend summary.
+    """
+    record = normalized(extracted)
+    amount = amount_of(record)
+    if amount is None:
+        return None, None, None, None
+    if record["vendor"] is None:
+        return amount, None, None, None
+    category = extracted.get("detected_type") or doc_type or "other"
+    month = record["date"][:7] if record["date"] else None
+    return amount, record["vendor"], category, month
+
+def empty_aggregates() -> dict:
+    return {"documents": 0, "amount": None, "vendor": {}, "category": {}, "month": {}}
+
+def accumulate(aggregates: dict, keys: tuple) -> dict:
+    """
+    Adds one document's `aggregate_keys` to an aggregates dict (see `empty_aggregates`).
+    """
+    amount, vendor, category, month = keys
+    aggregates["documents"] += 1
+    if amount is None:
+        return aggregates
+
+    cents = round(amount * 100)
+    buckets = [(aggregates, "amount")]
+    for dimension, bucket in zip(AGGREGATE_DIMENSIONS, (vendor, category, month)):
+        if bucket is not None:
+            buckets.append((aggregates[dimension], bucket))
+    for parent, key in buckets:
+        entry = parent.get(key)
+        if entry is None:
+            parent[key] = {"count": 1, "total_cents": cents, "min": amount, "max": amount}
+        else:
+            entry["count"] += 1
+            entry["total_cents"] += cents
+            entry["min"] = min(entry["min"], amount)
+            entry["max"] = max(entry["max"], amount)
+    return aggregates
+
+class DocumentStore:
+    """
+    Server-side copy of every processed document, keyed by (user_id, doc_id) where
+    doc_id is the content hash. Extracted fields are kept as JSON, with the ones
+    analytics and workflow filter on also stored as indexed columns.
+
+    Per-user analytics aggregates (counts, cent totals and min/max, overall and per
+    vendor/category/month) are maintained in the same transaction as every write,
+    so the summary never needs a pass over the documents.
+    """
+
+    def __init__(self, db_path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "user_id TEXT NOT NULL, doc_id TEXT NOT NULL, filename TEXT, doc_type TEXT, status TEXT, "
+            "summary TEXT, extracted TEXT NOT NULL, vendor_key TEXT, invoice_number TEXT, date TEXT, amount REAL, "
+            "agg_vendor TEXT, agg_category TEXT, agg_month TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, revision INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (user_id, doc_id))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS aggregates ("
+            "user_id TEXT NOT NULL, dimension TEXT NOT NULL, bucket TEXT NOT NULL, count INTEGER NOT NULL, "
+            "total_cents INTEGER NOT NULL, min REAL, max REAL, PRIMARY KEY (user_id, dimension, bucket))"
+        )
+        # `revision` is bumped on every write and stamped on the rows it touched, so readers can
+        # cache derived data per user and catch up on changed rows only; `epoch` is bumped when
+        # rows are deleted or rewritten wholesale, which a cached copy cannot patch
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS revisions ("
+            "user_id TEXT PRIMARY KEY, revision INTEGER NOT NULL, epoch INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Stores created before the aggregate columns existed are migrated and backfilled
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(documents)")}
+        migrated = self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION
+        for column in ("agg_vendor", "agg_category", "agg_month"):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")
+                migrated = True
+        if "revision" not in columns:
+            self.db.execute("ALTER TABLE documents ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        if "epoch" not in {row[1] for row in self.db.execute("PRAGMA table_info(revisions)")}:
+            self.db.execute("ALTER TABLE revisions ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0")
+
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_type ON documents (user_id, doc_type)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_vendor ON documents (user_id, vendor_key)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_date ON documents (user_id, date)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_amount ON documents (user_id, amount)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_revision ON documents (user_id, revision)")
+        for dimension in AGGREGATE_DIMENSIONS:
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS documents_agg_{dimension} ON documents (user_id, agg_{dimension}, amount)")
+
+        if migrated:
+            self.rebuild_aggregates()
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def _transaction(self, user_id: str = None):
+        with self.lock:
+            self.db.execute("BEGIN")
+            if user_id is not None:
+                self.db.execute(
+                    "INSERT INTO revisions (user_id, revision) VALUES (?, 1) "
+                    "ON CONFLICT (user_id) DO UPDATE SET revision = revision + 1",
+                    (user_id,),
+                )
+            try:
+                yield
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _row(self, record: dict) -> tuple:
+        # Normalised on every write, so edited fields never leave a stale record behind
+        extracted = dict(record["extracted_data"], normalized=normalize_fields(record["extracted_data"]))
+        amount, vendor, category, month = aggregate_keys(extracted, record["doc_type"])
+        return (
+            record["filename"], record["doc_type"], record["status"], record["summary"], json.dumps(extracted),
+            extracted["normalized"]["vendor_key"], extracted.get("invoice_number"),
+            extracted["normalized"]["date"], amount, vendor, category, month,
+        )
+
+    def _stamp(self, user_id: str, doc_id: str):
+        # Marks the row as changed in the revision the current transaction created
+        self.db.execute(
+            "UPDATE documents SET revision = (SELECT revision FROM revisions WHERE user_id = ?) "
+            "WHERE user_id = ? AND doc_id = ?",
+            (user_id, user_id, doc_id),
+        )
+
+    def _keys(self, user_id: str, doc_id: str) -> tuple:
+        return self.db.execute(
+            "SELECT amount, agg_vendor, agg_category, agg_month FROM documents WHERE user_id = ? AND doc_id = ?",
+            (user_id, doc_id),
+        ).fetchone()
+
+    def _add_aggregates(self, user_id: str, keys: tuple):
+        for dimension, bucket in self._buckets(keys):
+            amount = keys[0] if dimension != "documents" else None
+            cents = round(amount * 100) if amount is not None else 0
+            self.db.execute(
+                "INSERT INTO aggregates (user_id, dimension, bucket, count, total_cents, min, max) VALUES (?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT (user_id, dimension, bucket) DO UPDATE SET count = count + 1, "
+                "total_cents = total_cents + excluded.total_cents, "
+                "min = CASE WHEN min IS NULL OR excluded.min < min THEN excluded.min ELSE min END, "
+                "max = CASE WHEN max IS NULL OR excluded.max > max THEN excluded.max ELSE max END",
+                (user_id, dimension, bucket, cents, amount, amount),
+            )
+
+    def _remove_aggregates(self, user_id: str, keys: tuple):
+        """
+        Takes a document out of its buckets. Must run after its row has been changed or
+        deleted, so a bucket whose min or max it held can be recomputed from the index.
+        """
+        for dimension, bucket in self._buckets(keys):
+            amount = keys[0] if dimension != "documents" else None
+            cents = round(amount * 100) if amount is not None else 0
+            self.db.execute(
+                "UPDATE aggregates SET count = count - 1, total_cents = total_cents - ? "
+                "WHERE user_id = ? AND dimension = ? AND bucket = ?",
+                (cents, user_id, dimension, bucket),
+            )
+            self.db.execute(
+                "DELETE FROM aggregates WHERE user_id = ? AND dimension = ? AND bucket = ? AND count <= 0",
+                (user_id, dimension, bucket),
+            )
+            if amount is None:
+                continue
+
+            entry = self.db.execute(
+                "SELECT min, max FROM aggregates WHERE user_id = ? AND dimension = ? AND bucket = ?",
+                (user_id, dimension, bucket),
+            ).fetchone()
+            if entry and (amount <= entry[0] or amount >= entry[1]):
+                column = "amount" if dimension == "amount" else f"agg_{dimension}"
+                match = "amount IS NOT NULL" if dimension == "amount" else f"{column} = ?"
+                params = (user_id,) if dimension == "amount" else (user_id, bucket)
+                low, high = self.db.execute(
+                    f"SELECT MIN(amount), MAX(amount) FROM documents WHERE user_id = ? AND {match}", params
+                ).fetchone()
+                self.db.execute(
+                    "UPDATE aggregates SET min = ?, max = ? WHERE user_id = ? AND dimension = ? AND bucket = ?",
+                    (low, high, user_id, dimension, bucket),
+                )
+
+    def _buckets(self, keys: tuple) -> list:
+        amount, vendor, category, month = keys
+        buckets = [("documents", "")]
+        if amount is not None:
+            buckets.append(("amount", ""))
+            buckets.extend(
+                (dimension, bucket) for dimension, bucket in zip(AGGREGATE_DIMENSIONS, (vendor, category, month))
+                if bucket is not None
+            )
+        return buckets
+
+    def rebuild_aggregates(self):
+        """
+        Recomputes the normalized record, every derived column and every aggregate from
+        the stored fields. Runs after a schema migration; normal writes keep them current.
+        """
+        with self._transaction():
+            rows = self.db.execute(
+                "SELECT user_id, doc_id, filename, doc_type, status, summary, extracted FROM documents"
+            ).fetchall()
+            self.db.execute("DELETE FROM aggregates")
+            self.db.execute("UPDATE revisions SET revision = revision + 1, epoch = epoch + 1")
+            for user_id, doc_id, filename, doc_type, status, summary, extracted in rows:
+                record = {
+                    "filename": filename, "doc_type": doc_type, "status": status,
+                    "summary": summary, "extracted_data": json.loads(extracted),
+                }
+                self.db.execute(
+                    "UPDATE documents SET filename = ?, doc_type = ?, status = ?, summary = ?, extracted = ?, "
+                    "vendor_key = ?, invoice_number = ?, date = ?, amount = ?, agg_vendor = ?, agg_category = ?, "
+                    "agg_month = ? WHERE user_id = ? AND doc_id = ?",
+                    self._row(record) + (user_id, doc_id),
+                )
+                self._add_aggregates(user_id, self._keys(user_id, doc_id))
+        print(f"[DocumentStore] Rebuilt aggregates for {len(rows)} documents")
+
+    def upsert(self, user_id: str, doc_id: str, filename: str, doc_type: str, extracted_data: dict,
+               status: str = "processed", summary: str = None) -> dict:
+        """
+        Inserts or replaces a document. An existing document keeps its status, so
+        re-ingesting the same file does not undo an approval.
+        """
+        record = {
+            "filename": filename, "doc_type": doc_type, "status": status,
+            "summary": summary, "extracted_data": extracted_data or {},
+        }
+        now = time.time()
+        with self._transaction(user_id):
+            old_keys = self._keys(user_id, doc_id)
+            self.db.execute(
+                "INSERT INTO documents (user_id, doc_id, filename, doc_type, status, summary, extracted, vendor_key, "
+                "invoice_number, date, amount, agg_vendor, agg_category, agg_month, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, doc_id) DO UPDATE SET filename = excluded.filename, doc_type = excluded.doc_type, "
+                "summary = excluded.summary, extracted = excluded.extracted, "
+                "vendor_key = excluded.vendor_key, invoice_number = excluded.invoice_number, date = excluded.date, "
+                "amount = excluded.amount, agg_vendor = excluded.agg_vendor, agg_category = excluded.agg_category, "
+                "agg_month = excluded.agg_month, updated_at = excluded.updated_at",
+                (user_id, doc_id) + self._row(record) + (now, now),
+            )
+            self._stamp(user_id, doc_id)
+            if old_keys:
+                self._remove_aggregates(user_id, old_keys)
+            self._add_aggregates(user_id, self._keys(user_id, doc_id))
+            return self._get(user_id, doc_id)
+
+    def put_ingested(self, user_id: str, result: dict) -> dict:
+        """
+        Stores a successful ingest result (from IngestionAgent) for `user_id`.
+        """
+        return self.upsert(
+            user_id, result["content_hash"], result.get("filename"), result.get("type"),
+            result.get("extracted_data"), summary=result.get("summary"),
+        )
+
+    def update(self, user_id: str, doc_id: str, changes: dict) -> dict:
+        """
+        Applies a partial update: top-level columns are replaced, `extracted_data` is
+        merged field by field. Returns the updated document, or None if it does not exist.
+        """
+        with self._transaction(user_id):
+            current = self._get(user_id, doc_id)
+            if current is None:
+                return None
+            record = {
+                "filename": current["filename"], "doc_type": current["file_type"], "status": current["status"],
+                "summary": current["summary"], "extracted_data": current["extracted_data"],
+            }
+            record.update({key: value for key, value in changes.items() if key in UPDATABLE_COLUMNS})
+            record["extracted_data"] = dict(record["extracted_data"], **(changes.get("extracted_data") or {}))
+
+            old_keys = self._keys(user_id, doc_id)
+            self.db.execute(
+                "UPDATE documents SET filename = ?, doc_type = ?, status = ?, summary = ?, extracted = ?, vendor_key = ?, "
+                "invoice_number = ?, date = ?, amount = ?, agg_vendor = ?, agg_category = ?, agg_month = ?, updated_at = ? "
+                "WHERE user_id = ? AND doc_id = ?",
+                self._row(record) + (time.time(), user_id, doc_id),
+            )
+            self._stamp(user_id, doc_id)
+            self._remove_aggregates(user_id, old_keys)
+            self._add_aggregates(user_id, self._keys(user_id, doc_id))
+            return self._get(user_id, doc_id)
+
+    def delete(self, user_id: str, doc_id: str) -> bool:
+        with self._transaction(user_id):
+            old_keys = self._keys(user_id, doc_id)
+            if old_keys is None:
+                return False
+            self.db.execute("DELETE FROM documents WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+            self.db.execute("UPDATE revisions SET epoch = epoch + 1 WHERE user_id = ?", (user_id,))
+            self._remove_aggregates(user_id, old_keys)
+            return True
+
+    def is_referenced(self, doc_id: str) -> bool:
+        """Whether any user still has this document (content hashes are shared across users)."""
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM documents WHERE doc_id = ? LIMIT 1", (doc_id,)).fetchone() is not None
+
+    def get(self, user_id: str, doc_id: str) -> dict:
+        with self.lock:
+            return self._get(user_id, doc_id)
+
+    def _get(self, user_id: str, doc_id: str) -> dict:
+        row = self.db.execute(
+            "SELECT doc_id, filename, doc_type, status, summary, extracted FROM documents WHERE user_id = ? AND doc_id = ?",
+            (user_id, doc_id),
+        ).fetchone()
+        return self._document(row) if row else None
+
+    def _document(self, row: tuple) -> dict:
+        # Same shape the agents accept from clients
+        doc_id, filename, doc_type, status, summary, extracted = row
+        return {
+            "id": doc_id, "filename": filename, "file_type": doc_type, "status": status,
+            "summary": summary, "extracted_data": json.loads(extracted),
+        }
+
+    def aggregates(self, user_id: str) -> dict:
+        """
+        The user's materialised aggregates, in the shape `accumulate` builds.
+        Reads one row per bucket, independent of the number of documents.
+        """
+        result = empty_aggregates()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT dimension, bucket, count, total_cents, min, max FROM aggregates WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        for dimension, bucket, count, total_cents, low, high in rows:
+            entry = {"count": count, "total_cents": total_cents, "min": low, "max": high}
+            if dimension == "documents":
+                result["documents"] = count
+            elif dimension == "amount":
+                result["amount"] = entry
+            else:
+                result[dimension][bucket] = entry
+        return result
+
+    def revision(self, user_id: str) -> int:
+        with self.lock:
+            row = self.db.execute("SELECT revision FROM revisions WHERE user_id = ?", (user_id,)).fetchone()
+            return row[0] if row else 0
+
+    def columns(self, user_id: str, since: int = None) -> tuple:
+        """
+        The indexed columns of the user's documents, without decoding any JSON:
+        (revision, epoch, rows of (doc_id, doc_type, status, vendor_key, date, amount,
+        agg_vendor, agg_category, agg_month)). With `since`, only rows written after
+        that revision are returned; deletions since then show up as a new epoch.
+        """
+        where, params = "user_id = ?", (user_id,)
+        if since is not None:
+            where, params = "user_id = ? AND revision > ?", (user_id, since)
+        with self.lock:
+            # One read transaction, so the revision matches the rows even while other workers write
+            self.db.execute("BEGIN")
+            try:
+                row = self.db.execute("SELECT revision, epoch FROM revisions WHERE user_id = ?", (user_id,)).fetchone()
+                rows = self.db.execute(
+                    "SELECT doc_id, doc_type, status, vendor_key, date, amount, agg_vendor, agg_category, agg_month "
+                    f"FROM documents WHERE {where}",
+                    params,
+                ).fetchall()
+            finally:
+                self.db.execute("COMMIT")
+        return (row or (0, 0)) + (rows,)
+
+    def _filter(self, user_id: str, doc_ids: list = None, doc_type: str = None, vendor: str = None,
+                status: str = None, date_from: str = None, date_to: str = None) -> tuple:
+        clauses, params = ["user_id = ?"], [user_id]
+        if doc_ids is not None:
+            # One JSON parameter instead of one per id keeps large selections under SQLite's variable limit
+            clauses.append("doc_id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(doc_ids)))
+        for column, value in (("doc_type", doc_type), ("vendor_key", vendor_key(vendor) or None), ("status", status)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if date_from:
+            clauses.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("date <= ?")
+            params.append(date_to)
+        return " AND ".join(clauses), params
+
+    def query(self, user_id: str, **filters) -> list:
+        """
+        Returns the user's documents matching every given filter (doc_ids, doc_type,
+        vendor, status, date_from, date_to). Dates are ISO strings (YYYY-MM-DD),
+        compared as text.
+        """
+        where, params = self._filter(user_id, **filters)
+        sql = "SELECT doc_id, filename, doc_type, status, summary, extracted FROM documents WHERE " + where
+        with self.lock:
+            rows = self.db.execute(sql + " ORDER BY created_at", params).fetchall()
+        return [self._document(row) for row in rows]
+
+    def iter_query(self, user_id: str, page_size: int = 1000, **filters):
+        """
+        Same selection as `query`, yielded one page at a time (in insertion order), so
+        large exports never hold the whole result. The lock is only held per page.
+        """
+        where, params = self._filter(user_id, **filters)
+        sql = "SELECT rowid, doc_id, filename, doc_type, status, summary, extracted FROM documents WHERE " + where
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute(sql + " AND rowid > ? ORDER BY rowid LIMIT ?", params + [last, page_size]).fetchall()
+            for row in rows:
+                yield self._document(row[1:])
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+document_store = DocumentStore(data_path("documents.sqlite3"))
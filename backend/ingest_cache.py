@@ -0,0 +1,109 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from storage import data_dir
+
+# Bounds for the on-disk ingest cache
+INGEST_CACHE_MAX_ENTRIES = int(os.getenv("INGEST_CACHE_MAX_ENTRIES", "5000"))
+INGEST_CACHE_MAX_BYTES = int(os.getenv("INGEST_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+class IngestCache:
+    """
+    Content-addressed cache of ingest results (OCR text and classification),
+    keyed by the SHA-256 of the uploaded bytes. One JSON file per entry; least
+    recently used entries are evicted once the entry or byte budget is exceeded.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = OrderedDict()  # content_hash -> entry size, oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}.json")
+
+    def _load(self):
+        """Rebuilds the LRU order from file access times left by previous runs."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, name[:-5], stat.st_size))
+
+        for _, content_hash, size in sorted(entries):
+            self.index[content_hash] = size
+            self.total_bytes += size
+
+    def get(self, content_hash: str) -> dict:
+        with self.lock:
+            if content_hash not in self.index:
+                self.misses += 1
+                return None
+
+            path = self._path(content_hash)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                os.utime(path)
+            except Exception as e:
+                print(f"[IngestCache] Dropping unreadable entry {content_hash}: {e}")
+                self._remove(content_hash)
+                self.misses += 1
+                return None
+
+            self.index.move_to_end(content_hash)
+            self.hits += 1
+            return entry
+
+    def put(self, content_hash: str, entry: dict):
+        data = json.dumps(entry).encode("utf-8")
+        path = self._path(content_hash)
+        tmp_path = f"{path}.tmp"
+
+        with self.lock:
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"[IngestCache] Failed to store entry {content_hash}: {e}")
+                return
+
+            self.total_bytes += len(data) - self.index.get(content_hash, 0)
+            self.index[content_hash] = len(data)
+            self.index.move_to_end(content_hash)
+            self._evict()
+
+    def _remove(self, content_hash: str):
+        self.total_bytes -= self.index.pop(content_hash, 0)
+        try:
+            os.remove(self._path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.index and (len(self.index) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest = next(iter(self.index))
+            self._remove(oldest)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.index),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+ingest_cache = IngestCache(data_dir("ingest_cache"), INGEST_CACHE_MAX_ENTRIES, INGEST_CACHE_MAX_BYTES)
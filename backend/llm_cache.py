@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from storage import data_path
+
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+class LLMCache:
+    """
+    Two-tier cache for LLM responses to deterministic prompts: an in-memory LRU
+    in front of a SQLite table that survives restarts. Entries expire after a TTL
+    and the table is trimmed to a maximum size, least recently used first.
+    """
+
+    def __init__(self, db_path: str, memory_entries: int, max_entries: int, ttl_seconds: int):
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()  # key -> (response, created_at)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.writes = 0
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    @staticmethod
+    def key(model: str, options: dict, format, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        material = json.dumps([model, options or {}, format, prompt_hash], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _count(self, namespace: str, outcome: str):
+        counters = self.counters.setdefault(namespace, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def get(self, key: str, namespace: str) -> str:
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and now - entry[1] < self.ttl_seconds:
+                self.memory.move_to_end(key)
+                self._count(namespace, "memory_hits")
+                return entry[0]
+
+            row = self.db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl_seconds:
+                self.db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self._remember(key, row[0], row[1])
+                self._count(namespace, "disk_hits")
+                return row[0]
+
+            self._count(namespace, "misses")
+            return None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            self._remember(key, response, now)
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self._evict(now)
+
+    def _remember(self, key: str, response: str, created_at: float):
+        self.memory[key] = (response, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        self.db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self.lock:
+            disk_entries = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "memory_entries": len(self.memory),
+                "disk_entries": disk_entries,
+                "by_agent": {namespace: dict(counters) for namespace, counters in self.counters.items()},
+            }
+
+llm_cache = LLMCache(data_path("llm_cache.sqlite3"), LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
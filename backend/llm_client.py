@@ -1,27 +1,292 @@
-import ollama
 import os
+import json
+import random
+import asyncio
+import hashlib
+import threading
+import httpx
 from dotenv import load_dotenv
+from llm_cache import llm_cache, LLMCache
 
 load_dotenv()
 
 # Configuration
-OLLAMA_MODEL = "gemma3:4b"
-
-def generate_text(prompt: str) -> str:
-    """
-    Generates text using local Ollama model.
-    """
-    try:
-        response = ollama.chat(model=OLLAMA_MODEL, messages=[
-            {
-                'role': 'user',
-                'content': prompt,
-            },
-        ])
-        return response['message']['content']
-    except Exception as e:
-        print(f"Ollama API Error: {e}")
-        return f"Error generating text: {str(e)}"
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+# Texts per /api/embed request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+# Maximum in-flight requests per model; Ollama queues the rest anyway, this keeps the queue here
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    pass
+
+class LLMClient:
+    """
+    Async Ollama client on a pooled httpx connection. The client runs on its own
+    event loop thread, so request handlers (await) and worker threads (sync) share
+    one connection pool, one per-model concurrency limit and one table of
+    in-flight prompts, which lets identical concurrent prompts share a single call.
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.loop = None
+        self.client = None
+        self.semaphores = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.client = httpx.AsyncClient(
+                    base_url=self.host,
+                    timeout=LLM_TIMEOUT,
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+                )
+                threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True).start()
+            return self.loop
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self.semaphores:
+            self.semaphores[model] = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphores[model]
+
+    async def _chat(self, payload: dict, timeout: float, cache: str = None) -> str:
+        """
+        Runs on the client loop. Opted-in callers are answered from the response cache
+        when possible; identical payloads already in flight share one request.
+        """
+        cache_key = None
+        if cache:
+            cache_key = LLMCache.key(payload["model"], payload.get("options"), payload.get("format"), payload["messages"][-1]["content"])
+            cached = llm_cache.get(cache_key, cache)
+            if cached is not None:
+                return cached
+
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._chat_with_retries(payload, timeout, cache_key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+
+        # Shield so one cancelled caller does not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    async def _chat_with_retries(self, payload: dict, timeout: float, cache_key: str = None) -> str:
+        content = (await self._post_with_retries("/api/chat", payload, timeout))["message"]["content"]
+        if cache_key:
+            llm_cache.put(cache_key, content)
+        return content
+
+    async def _post_with_retries(self, path: str, payload: dict, timeout: float) -> dict:
+        semaphore = self._semaphore(payload["model"])
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                async with semaphore:
+                    self.requests += 1
+                    response = await self.client.post(path, json=payload, timeout=timeout)
+                if response.status_code in RETRYABLE_STATUS:
+                    raise httpx.HTTPStatusError(f"Ollama returned {response.status_code}", request=response.request, response=response)
+                if response.status_code >= 400:
+                    self.failures += 1
+                    raise LLMError(f"Ollama returned {response.status_code}: {response.text[:200]}")
+                return response.json()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if attempt == LLM_MAX_RETRIES:
+                    self.failures += 1
+                    raise LLMError(f"Ollama request failed after {attempt + 1} attempts: {e}") from e
+                self.retries += 1
+                # Exponential backoff with jitter
+                await asyncio.sleep(LLM_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random() / 4))
+
+    async def _stream(self, payload: dict, timeout: float, emit):
+        """
+        Runs on the client loop. Passes ("token", text) to `emit` as Ollama produces
+        tokens, then ("done", None) or ("error", message). Connection failures are
+        retried only while nothing has been emitted yet.
+        """
+        semaphore = self._semaphore(payload["model"])
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            emitted = False
+            try:
+                async with semaphore:
+                    self.requests += 1
+                    async with self.client.stream("POST", "/api/chat", json=payload, timeout=timeout) as response:
+                        if response.status_code >= 400:
+                            await response.aread()
+                            if response.status_code in RETRYABLE_STATUS:
+                                raise httpx.HTTPStatusError(f"Ollama returned {response.status_code}", request=response.request, response=response)
+                            raise LLMError(f"Ollama returned {response.status_code}: {response.text[:200]}")
+
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            chunk = json.loads(line)
+                            if chunk.get("error"):
+                                raise LLMError(chunk["error"])
+                            token = chunk.get("message", {}).get("content", "")
+                            if token:
+                                emitted = True
+                                emit(("token", token))
+                            if chunk.get("done"):
+                                break
+                emit(("done", None))
+                return
+            except LLMError as e:
+                self.failures += 1
+                emit(("error", str(e)))
+                return
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if emitted or attempt == LLM_MAX_RETRIES:
+                    self.failures += 1
+                    emit(("error", f"Ollama stream failed: {e}"))
+                    return
+                self.retries += 1
+                await asyncio.sleep(LLM_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random() / 4))
+            except json.JSONDecodeError as e:
+                self.failures += 1
+                emit(("error", f"Ollama sent a malformed stream line: {e}"))
+                return
+            except Exception as e:
+                # Anything else must still end the stream, or the consumer waits forever
+                self.failures += 1
+                emit(("error", f"Ollama stream failed: {e}"))
+                return
+
+    def _payload(self, prompt: str, model: str, options: dict, format, stream: bool) -> dict:
+        payload = {
+            "model": model or OLLAMA_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream,
+        }
+        if options:
+            payload["options"] = options
+        if format:
+            payload["format"] = format
+        return payload
+
+    def _submit(self, prompt: str, model: str, options: dict, format, timeout: float, cache: str):
+        payload = self._payload(prompt, model, options, format, stream=False)
+        return asyncio.run_coroutine_threadsafe(self._chat(payload, timeout or LLM_TIMEOUT, cache), self._ensure_loop())
+
+    async def generate(self, prompt: str, model: str = None, options: dict = None, format=None,
+                       timeout: float = None, cache: str = None) -> str:
+        """
+        Awaitable from any event loop without blocking it. Raises LLMError on failure.
+        Pass `cache` (the caller's name) to opt in to the response cache; omit it to bypass.
+        """
+        return await asyncio.wrap_future(self._submit(prompt, model, options, format, timeout, cache))
+
+    def generate_sync(self, prompt: str, model: str = None, options: dict = None, format=None,
+                      timeout: float = None, cache: str = None) -> str:
+        """
+        Blocking variant for worker threads. Raises LLMError on failure.
+        """
+        return self._submit(prompt, model, options, format, timeout, cache).result()
+
+    async def _embed(self, texts: list, model: str, timeout: float) -> list:
+        embeddings = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            payload = {"model": model, "input": texts[start:start + EMBED_BATCH_SIZE]}
+            embeddings.extend((await self._post_with_retries("/api/embed", payload, timeout))["embeddings"])
+        return embeddings
+
+    def embed_sync(self, texts: list, model: str = None, timeout: float = None) -> list:
+        """
+        Embeds `texts` with the embedding model, in batches. Blocks the calling
+        thread; returns one vector (list of floats) per text. Raises LLMError on failure.
+        """
+        coroutine = self._embed(texts, model or OLLAMA_EMBED_MODEL, timeout or LLM_TIMEOUT)
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result()
+
+    async def embed(self, texts: list, model: str = None, timeout: float = None) -> list:
+        """
+        Awaitable variant of `embed_sync`.
+        """
+        coroutine = self._embed(texts, model or OLLAMA_EMBED_MODEL, timeout or LLM_TIMEOUT)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()))
+
+    async def stream(self, prompt: str, model: str = None, options: dict = None, timeout: float = None):
+        """
+        Async generator yielding tokens as they are generated. Closing the generator
+        (e.g. because the HTTP client went away) cancels the request to Ollama.
+        """
+        caller_loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(event):
+            caller_loop.call_soon_threadsafe(events.put_nowait, event)
+
+        payload = self._payload(prompt, model, options, None, stream=True)
+        future = asyncio.run_coroutine_threadsafe(self._stream(payload, timeout or LLM_TIMEOUT, emit), self._ensure_loop())
+
+        def ended(done):
+            # Backstop: a coroutine that dies without emitting still ends the stream
+            if not done.cancelled() and done.exception() is not None:
+                emit(("error", f"Ollama stream failed: {done.exception()}"))
+
+        future.add_done_callback(ended)
+        try:
+            while True:
+                kind, value = await events.get()
+                if kind == "token":
+                    yield value
+                elif kind == "error":
+                    raise LLMError(value)
+                else:
+                    return
+        finally:
+            future.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "model": OLLAMA_MODEL,
+            "embed_model": OLLAMA_EMBED_MODEL,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": len(self.inflight),
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failures": self.failures,
+            "cache": llm_cache.stats(),
+        }
+
+llm_client = LLMClient()
+
+def generate_text(prompt: str, **kwargs) -> str:
+    """
+    Generates text using local Ollama model. Blocks the calling thread.
+    """
+    return llm_client.generate_sync(prompt, **kwargs)
+
+async def agenerate_text(prompt: str, **kwargs) -> str:
+    """
+    Generates text using local Ollama model without blocking the event loop.
+    """
+    return await llm_client.generate(prompt, **kwargs)
+
+def stream_text(prompt: str, **kwargs):
+    """
+    Streams generated tokens from local Ollama model as an async generator.
+    """
+    return llm_client.stream(prompt, **kwargs)
 
 def analyze_document(text: str, prompt: str) -> str:
     """
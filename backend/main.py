@@ -1,43 +1,76 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response, Header, Depends
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from pydantic import BaseModel
-import shutil
+from typing import List
 import os
+import json
 import uuid
+import threading
+import zipfile
 from datetime import datetime
 from dotenv import load_dotenv
 from ocr import extract_text_from_image, extract_text_from_pdf
-from llm_client import generate_text
+from ocr_pool import ocr_pool
+from llm_client import agenerate_text, llm_client, LLMError
 from agents.ingestion_agent import ingestion_agent
 from agents.extraction_agent import extraction_agent
 from agents.chat_agent import chat_agent
 from agents.workflow_agent import workflow_agent
 from agents.analytics_agent import analytics_agent
-from agents.export_agent import export_agent
+from agents.export_agent import export_agent, gzip_stream
 from agents.vultr_service import vultr_service
+from agents.job_service import job_service
+from agents.ingest_pipeline import ingest_pipeline
+from ingest_cache import ingest_cache
+from agents.search_service import search_service
+from vector_store import vector_store
+from document_store import document_store
+from normalize import normalized
+from near_duplicates import near_duplicate_index, DUPLICATE_JACCARD_THRESHOLD
+from agents.thumbnail_service import thumbnail_service, snap_size, FORMATS, THUMBNAIL_DEFAULT_SIZE
+from upload_limit import UploadLimitMiddleware
+from rate_limiter import rate_limiter, RateLimitMiddleware
+from storage import spool_stream, store_blob, delete_blob, UploadTooLargeError
 
 load_dotenv()
 
 app = FastAPI()
 
-# Simple in-memory rate limiting (for hackathon demo)
-# Structure: { "user_id": { "uploads": 0, "questions": 0 } }
-usage_limits = {}
-
-def check_limit(user_id: str, limit_type: str, max_count: int):
-    if user_id not in usage_limits:
-        usage_limits[user_id] = {"uploads": 0, "questions": 0}
-    
-    if usage_limits[user_id][limit_type] >= max_count:
-        raise HTTPException(status_code=429, detail=f"Free Tier Limit Reached: Max {max_count} {limit_type} allowed.")
-    
-    usage_limits[user_id][limit_type] += 1
-
-
-# Mount static directory for thumbnails
-os.makedirs("backend/static/thumbnails", exist_ok=True)
-app.mount("/static", StaticFiles(directory="backend/static"), name="static")
+# Token-bucket limits shared by all workers; each request to these routes costs one token
+RATE_LIMITED_ROUTES = {
+    ("POST", "/agents/ingest"): "uploads",
+    ("POST", "/agents/ingest/batch"): "batches",
+    ("POST", "/agents/chat"): "questions",
+    ("POST", "/agents/chat/stream"): "questions",
+}
+
+# Mount static directory for thumbnails issued before /documents/{content_hash}/thumbnail
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "static")
+os.makedirs(os.path.join(STATIC_DIR, "thumbnails"), exist_ok=True)
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+
+# Largest accepted upload; larger requests are rejected before the file is spooled
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Most documents accepted by one batch ingest request (after expanding zip archives)
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "500"))
+# Largest accepted batch request body; each file in it is still held to MAX_UPLOAD_BYTES
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+# Room for multipart boundaries and part headers around a single file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Request bodies are capped by middleware, before Starlette spools them into UploadFiles
+UPLOAD_LIMITED_ROUTES = {
+    ("POST", "/documents/ocr-test"): MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+    ("POST", "/agents/ingest"): MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+    ("POST", "/agents/ingest/batch"): MAX_BATCH_UPLOAD_BYTES,
+}
+
+# Added before CORS so CORS wraps them and 413/429 responses stay readable by the frontend
+app.add_middleware(UploadLimitMiddleware, routes=UPLOAD_LIMITED_ROUTES)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, routes=RATE_LIMITED_ROUTES)
 
 # Configure CORS
 app.add_middleware(
@@ -46,12 +79,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the frontend read the export filename
+    expose_headers=["Content-Disposition"],
 )
 
 # Ensure tmp directory exists
 TMP_DIR = os.path.join(os.path.dirname(__file__), "tmp")
 os.makedirs(TMP_DIR, exist_ok=True)
 
+# Documents of callers that name no user
+DEFAULT_USER_ID = "demo_user"
+
+def resolve_user(user_id: str = None, x_user_id: str = Header(None)) -> str:
+    """
+    The caller's user id, resolved like the rate limiter does: the `user_id` query
+    parameter, then the X-User-Id header the frontend sends, then DEFAULT_USER_ID.
+    Request bodies that carry a `user_id` still take precedence over both.
+    """
+    return user_id or x_user_id or DEFAULT_USER_ID
+
+SUPPORTED_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff", ".pdf"]
+
+def spool_upload(file: UploadFile, file_path: str, storage_key: str = None) -> dict:
+    """
+    Streams an upload to `file_path` in one pass, hashing it on the fly. If `storage_key`
+    is given the same chunks are streamed to Vultr Object Storage as well.
+    """
+    if storage_key is None:
+        return spool_stream(file.file, file_path, MAX_UPLOAD_BYTES)
+
+    backup = vultr_service.begin_upload(storage_key)
+    try:
+        upload = spool_stream(file.file, file_path, MAX_UPLOAD_BYTES, on_chunk=backup.write)
+    except Exception:
+        backup.abort()
+        raise
+    upload["backup"] = backup.complete()
+    return upload
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
@@ -64,8 +129,7 @@ async def ocr_test(file: UploadFile = File(...)):
 
     try:
         # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await run_in_threadpool(spool_upload, file, file_path)
 
         extracted_text = ""
         content_type = "unknown"
@@ -85,6 +149,8 @@ async def ocr_test(file: UploadFile = File(...)):
             "text": extracted_text
         }
 
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
@@ -95,49 +161,206 @@ async def ocr_test(file: UploadFile = File(...)):
             except Exception as cleanup_error:
                 print(f"Failed to remove temp file {file_path}: {cleanup_error}")
 
+@app.get("/documents/ocr-stats")
+async def ocr_stats():
+    return ocr_pool.stats()
+
 @app.post("/llm-test")
 async def llm_test(prompt: str = "Hello, who are you?"):
-    response = generate_text(prompt)
+    try:
+        response = await agenerate_text(prompt)
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     return {"response": response}
 
+@app.get("/llm/stats")
+async def llm_stats():
+    return llm_client.stats()
+
+def run_ingest_job(file_path: str, filename: str, upload: dict, user_id: str, progress=None) -> dict:
+    """
+    Runs on the ingest worker pool: processes the spooled file, then keeps it in the
+    blob store (for lazy thumbnails), the search indexes and the document store, or
+    removes the temp copy if processing failed.
+    """
+    try:
+        result = ingestion_agent.process(file_path, filename, progress=progress, content_hash=upload["sha256"])
+        if not result.get("error"):
+            store_blob(file_path, upload["sha256"])
+            search_service.index_document(user_id, upload["sha256"], result.get("text", ""), filename)
+            workflow_agent.review_stored(user_id, document_store.put_ingested(user_id, result))
+            near_duplicate_index.add_ingested(user_id, result)
+
+        # Add Vultr metadata to result
+        result["vultr_backup_url"] = upload["backup"].get("url")
+        result["raindrop_status"] = "processed"
+
+        return result
+    finally:
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except:
+                pass
+
 @app.post("/agents/ingest")
-async def ingest_document(file: UploadFile = File(...), user_id: str = "demo_user"):
-    # Enforce Rate Limit (3 uploads)
-    check_limit(user_id, "uploads", 3)
+async def ingest_document(file: UploadFile = File(...), user_id: str = Depends(resolve_user)):
 
     file_extension = os.path.splitext(file.filename)[1].lower()
     unique_filename = f"{uuid.uuid4()}{file_extension}"
     file_path = os.path.join(TMP_DIR, unique_filename)
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
         # Simulate Raindrop MCP Routing
         print(f"[Raindrop MCP] Routing document {file.filename} to SmartBuckets...")
-        
-        # Simulate Vultr Backup
-        with open(file_path, "rb") as f:
-            file_data = f.read()
-            vultr_response = vultr_service.upload_file(unique_filename, file_data)
-            print(f"[Vultr] Backup status: {vultr_response}")
 
-        result = ingestion_agent.process(file_path, file.filename)
-        
-        # Add Vultr metadata to result
-        result["vultr_backup_url"] = vultr_response.get("url")
-        result["raindrop_status"] = "processed"
-        
-        return result
+        # Spool to disk, hash and back up to Vultr in a single pass over the upload
+        upload = await run_in_threadpool(spool_upload, file, file_path, unique_filename)
+        print(f"[Vultr] Backup status: {upload['backup']}")
+
+        # OCR and classification run on the worker pool; poll /agents/jobs/{job_id}
+        job = job_service.submit(run_ingest_job, file_path, file.filename, upload, user_id)
+        return job
 
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
         if os.path.exists(file_path):
             try:
                 os.remove(file_path)
             except:
                 pass
+        raise HTTPException(status_code=500, detail=str(e))
+
+def spool_batch_file(file: UploadFile) -> list:
+    """
+    Spools one file of a batch upload. Zip archives are expanded into their supported
+    members, each spooled and hashed individually; the archive itself is discarded.
+    """
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    file_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}{file_extension}")
+    upload = spool_upload(file, file_path)
+    if file_extension != ".zip":
+        return [{"file_path": file_path, "filename": file.filename, "sha256": upload["sha256"]}]
+
+    items = []
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            for member in archive.infolist():
+                member_extension = os.path.splitext(member.filename)[1].lower()
+                if member.is_dir() or member_extension not in SUPPORTED_EXTENSIONS:
+                    continue
+                if len(items) >= MAX_BATCH_FILES:
+                    raise UploadTooLargeError(f"Batch exceeds the {MAX_BATCH_FILES} document limit")
+
+                member_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}{member_extension}")
+                with archive.open(member) as source:
+                    spooled = spool_stream(source, member_path, MAX_UPLOAD_BYTES)
+                items.append({"file_path": member_path, "filename": os.path.basename(member.filename), "sha256": spooled["sha256"]})
+    except Exception:
+        remove_spooled(items)
+        raise
+    finally:
+        os.remove(file_path)
+    return items
+
+def remove_spooled(items: list):
+    for item in items:
+        if os.path.exists(item["file_path"]):
+            os.remove(item["file_path"])
+
+@app.post("/agents/ingest/batch")
+async def ingest_batch(request: Request, files: List[UploadFile] = File(...), user_id: str = Depends(resolve_user)):
+    """
+    Ingests many files (or zip archives) through the staged pipeline and streams one
+    NDJSON line per document as it finishes.
+    """
+    items = []
+    try:
+        for file in files:
+            items.extend(await run_in_threadpool(spool_batch_file, file))
+        if len(items) > MAX_BATCH_FILES:
+            raise UploadTooLargeError(f"Batch exceeds the {MAX_BATCH_FILES} document limit")
+    except UploadTooLargeError as e:
+        remove_spooled(items)
+        raise HTTPException(status_code=413, detail=str(e))
+    except zipfile.BadZipFile as e:
+        remove_spooled(items)
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    except Exception as e:
+        remove_spooled(items)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    print(f"[Raindrop MCP] Routing batch of {len(items)} documents to SmartBuckets...")
+
+    async def stream_results():
+        # Set when the client goes away, so documents not yet started are dropped
+        stop = threading.Event()
+        try:
+            async for result in iterate_in_threadpool(ingest_pipeline.run(items, user_id, stop)):
+                yield json.dumps(result) + "\n"
+                if await request.is_disconnected():
+                    print("[Batch] Client disconnected, dropping the rest of the batch")
+                    break
+        finally:
+            stop.set()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/agents/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@app.get("/documents/{content_hash}/thumbnail")
+async def get_thumbnail(content_hash: str, request: Request, size: int = THUMBNAIL_DEFAULT_SIZE, format: str = "webp"):
+    content_hash = content_hash.lower()
+    if len(content_hash) != 64 or any(c not in "0123456789abcdef" for c in content_hash):
+        raise HTTPException(status_code=400, detail="Invalid content hash")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use {', '.join(FORMATS)}")
+    size = snap_size(size)
+
+    # Content-addressed, so a given URL always maps to the same bytes
+    etag = f'"{content_hash}-{size}-{format}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        thumbnail_path = await run_in_threadpool(thumbnail_service.get_or_create, content_hash, size, format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate thumbnail: {e}")
+    if thumbnail_path is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    return FileResponse(thumbnail_path, media_type=FORMATS[format][1], headers=headers)
+
+@app.get("/documents/search")
+async def search_documents(q: str, user_id: str = Depends(resolve_user), top_k: int = 10):
+    """
+    Semantic search over the user's ingested documents; returns ranked chunks.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    top_k = max(1, min(top_k, 100))
+    try:
+        results = await run_in_threadpool(search_service.search, q, user_id, top_k)
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"query": q, "results": results}
+
+@app.get("/documents/search/stats")
+async def search_stats():
+    return vector_store.stats()
+
+@app.get("/agents/ingest/cache")
+async def get_ingest_cache_stats():
+    return ingest_cache.stats()
 
 class ExtractRequest(BaseModel):
     text: str
@@ -146,71 +369,248 @@ class ExtractRequest(BaseModel):
 @app.post("/agents/extract")
 async def extract_data(request: ExtractRequest):
     try:
-        result = extraction_agent.extract(request.text, request.doc_type)
+        result = await extraction_agent.extract(request.text, request.doc_type)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 class ChatRequest(BaseModel):
     message: str
-    context: str
-    user_id: str = "demo_user"
+    context: str = ""
+    user_id: str = None
+    # Content hashes of ingested documents; retrieval then runs against the server-side index
+    document_ids: List[str] = None
 
 @app.post("/agents/chat")
-async def chat_with_docs(request: ChatRequest):
-    # Enforce Rate Limit (5 questions)
-    check_limit(request.user_id, "questions", 5)
-
+async def chat_with_docs(request: ChatRequest, user: str = Depends(resolve_user)):
+    request.user_id = request.user_id or user
     try:
-        response = chat_agent.chat(request.message, request.context)
+        response = await chat_agent.chat(request.message, request.context, request.user_id, request.document_ids)
         return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/agents/chat/stream")
+async def chat_with_docs_stream(request: ChatRequest, http_request: Request, user: str = Depends(resolve_user)):
+    """
+    Streams the answer as Server-Sent Events: one `data: {"token": ...}` event per
+    token, then `event: done` (or `event: error`). Generation stops if the client disconnects.
+    """
+    request.user_id = request.user_id or user
+    async def events():
+        tokens = chat_agent.stream_chat(request.message, request.context, request.user_id, request.document_ids)
+        try:
+            async for token in tokens:
+                if await http_request.is_disconnected():
+                    print("Chat stream client disconnected, stopping generation")
+                    return
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Error in chat stream: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            await tokens.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class DocumentFilter(BaseModel):
+    """
+    Selects documents from the server-side store instead of shipping them in the body.
+    """
+    user_id: str = None
+    doc_ids: List[str] = None
+    doc_type: str = None
+    vendor: str = None
+    status: str = None
+    date_from: str = None
+    date_to: str = None
+
+    def filters(self) -> dict:
+        return {
+            "doc_ids": self.doc_ids, "doc_type": self.doc_type, "vendor": self.vendor,
+            "status": self.status, "date_from": self.date_from, "date_to": self.date_to,
+        }
+
+    def is_filtered(self) -> bool:
+        return any(value is not None for value in self.filters().values())
+
+    def select(self) -> list:
+        return document_store.query(self.user_id, **self.filters())
+
+    def iter_select(self):
+        return document_store.iter_query(self.user_id, **self.filters())
+
 class WorkflowRequest(BaseModel):
-    doc_data: dict
+    # Either the document itself or the id of a stored one
+    doc_data: dict = None
+    doc_id: str = None
+    # Vendor history; defaults to the user's approved documents in the vendor index
     all_documents: list = None
+    user_id: str = None
 
 @app.post("/agents/workflow")
-async def run_workflow(request: WorkflowRequest):
+async def run_workflow(request: WorkflowRequest, user: str = Depends(resolve_user)):
+    request.user_id = request.user_id or user
+    doc_data = request.doc_data
+    if doc_data is None:
+        if not request.doc_id:
+            raise HTTPException(status_code=400, detail="Provide doc_data or doc_id")
+        doc_data = await run_in_threadpool(document_store.get, request.user_id, request.doc_id)
+        if doc_data is None:
+            raise HTTPException(status_code=404, detail=f"Document not found: {request.doc_id}")
+
     try:
-        result = workflow_agent.evaluate(request.doc_data, request.all_documents)
+        result = await run_in_threadpool(workflow_agent.evaluate, doc_data, request.all_documents, request.user_id)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class WorkflowBatchRequest(BaseModel):
+    # Either the documents themselves or the ids of stored ones
+    documents: list = None
+    doc_ids: List[str] = None
+    user_id: str = None
+
+@app.post("/agents/workflow/batch")
+async def run_workflow_batch(request: WorkflowBatchRequest, user: str = Depends(resolve_user)):
+    request.user_id = request.user_id or user
+    documents = request.documents
+    missing = []
+    if documents is None:
+        if request.doc_ids is None:
+            raise HTTPException(status_code=400, detail="Provide documents or doc_ids")
+        documents = await run_in_threadpool(document_store.query, request.user_id, doc_ids=request.doc_ids)
+        found = {doc["id"] for doc in documents}
+        missing = [doc_id for doc_id in request.doc_ids if doc_id not in found]
+
+    try:
+        result = await run_in_threadpool(workflow_agent.evaluate_batch, documents)
+        result["missing"] = missing
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Analytics endpoint
-class AnalyticsRequest(BaseModel):
-    documents: list
+class AnalyticsRequest(DocumentFilter):
+    # Raw documents are still accepted; without them the filter selects from the store
+    documents: list = None
     query: str = None
+    # Adds median/p95 statistics, which whole-store requests otherwise skip to stay constant-time
+    detailed: bool = False
 
 @app.post("/agents/analytics")
-async def get_analytics(request: AnalyticsRequest):
+async def get_analytics(request: AnalyticsRequest, user: str = Depends(resolve_user)):
+    request.user_id = request.user_id or user
     try:
-        result = analytics_agent.analyze(request.documents, request.query)
+        if request.documents is not None:
+            return await analytics_agent.analyze(request.documents, request.query)
+        if not request.is_filtered() and not request.detailed:
+            # Whole store: answered from the maintained aggregates
+            return await analytics_agent.summarize(request.user_id, request.query)
+        result = await analytics_agent.analyze_store(request.user_id, request.filters(), request.query)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Export endpoint
-class ExportRequest(BaseModel):
-    documents: list
-    format: str  # 'csv', 'quickbooks', 'excel'
+class ExportRequest(DocumentFilter):
+    documents: list = None
+    format: str  # 'csv', 'quickbooks', 'excel', 'parquet', 'arrow'
+    # Gzip the file (xlsx and parquet are already compressed); it downloads as .gz
+    gzip: bool = False
+
+# Export formats: (streaming writer, extension, media type)
+EXPORT_FORMATS = {
+    "csv": (export_agent.iter_csv, "csv", "text/csv"),
+    "quickbooks": (export_agent.iter_quickbooks_iif, "iif", "text/plain"),
+    "excel": (export_agent.iter_xlsx, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": (export_agent.iter_parquet, "parquet", "application/vnd.apache.parquet"),
+    "arrow": (export_agent.iter_arrow, "arrows", "application/vnd.apache.arrow.stream"),
+}
+# Formats that compress internally and are never gzipped
+COMPRESSED_EXPORT_FORMATS = {"excel", "parquet"}
 
 @app.post("/agents/export")
-async def export_documents(request: ExportRequest):
+async def export_documents(request: ExportRequest, user: str = Depends(resolve_user)):
+    request.user_id = request.user_id or user
+    if request.format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'csv', 'quickbooks', 'excel', 'parquet' or 'arrow'")
+
+    # Rows are written as they are read from the store, so memory stays flat
+    # and the first bytes go out before the last document is loaded
+    generate, extension, media_type = EXPORT_FORMATS[request.format]
+    documents = request.documents if request.documents is not None else request.iter_select()
     try:
-        if request.format == 'csv':
-            content = export_agent.export_to_csv(request.documents)
-            return {"content": content, "filename": f"rida_export_{datetime.now().strftime('%Y%m%d')}.csv"}
-        elif request.format == 'quickbooks':
-            content = export_agent.export_to_quickbooks_iif(request.documents)
-            return {"content": content, "filename": f"rida_export_{datetime.now().strftime('%Y%m%d')}.iif"}
-        elif request.format == 'excel':
-            data = export_agent.export_to_excel_compatible(request.documents)
-            return {"data": data, "filename": f"rida_export_{datetime.now().strftime('%Y%m%d')}.xlsx"}
-        else:
-            raise HTTPException(status_code=400, detail="Invalid format. Use 'csv', 'quickbooks', or 'excel'")
+        chunks = generate(documents)
+    except RuntimeError as e:
+        # Optional dependency (pyarrow) missing
+        raise HTTPException(status_code=501, detail=str(e))
+    filename = f"rida_export_{datetime.now().strftime('%Y%m%d')}.{extension}"
+    if request.gzip and request.format not in COMPRESSED_EXPORT_FORMATS:
+        chunks = gzip_stream(chunks)
+        filename, media_type = f"{filename}.gz", "application/gzip"
+    return StreamingResponse(
+        chunks, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Document store endpoints
+class DocumentUpdate(BaseModel):
+    user_id: str = None
+    filename: str = None
+    status: str = None
+    doc_type: str = None
+    summary: str = None
+    # Merged into the stored fields; send only the fields that changed
+    extracted_data: dict = None
+
+@app.get("/documents/{doc_id}")
+async def get_document(doc_id: str, user_id: str = Depends(resolve_user)):
+    document = await run_in_threadpool(document_store.get, user_id, doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+    return document
+
+@app.patch("/documents/{doc_id}")
+async def update_document(doc_id: str, request: DocumentUpdate, user: str = Depends(resolve_user)):
+    request.user_id = request.user_id or user
+    changes = request.model_dump(exclude_unset=True, exclude={"user_id"})
+    document = await run_in_threadpool(document_store.update, request.user_id, doc_id, changes)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+    # Approved documents feed the vendor history used by duplicate/outlier checks
+    await run_in_threadpool(workflow_agent.vendor_history.sync, request.user_id, document)
+    return document
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: str, user_id: str = Depends(resolve_user)):
+    if not await run_in_threadpool(document_store.delete, user_id, doc_id):
+        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+    await run_in_threadpool(search_service.remove_document, user_id, doc_id)
+    await run_in_threadpool(workflow_agent.vendor_history.forget, user_id, doc_id)
+    await run_in_threadpool(near_duplicate_index.remove_document, user_id, doc_id)
+    # The original and its thumbnails go once no user has this content any more
+    if not await run_in_threadpool(document_store.is_referenced, doc_id):
+        await run_in_threadpool(delete_blob, doc_id)
+        await run_in_threadpool(thumbnail_service.remove, doc_id)
+    return {"deleted": doc_id}
+
+# Near-duplicate detection (re-scans, re-photographed copies) over everything a user has ingested
+@app.get("/agents/duplicates")
+async def find_duplicates(user_id: str = Depends(resolve_user), doc_id: str = None, threshold: float = DUPLICATE_JACCARD_THRESHOLD):
+    if not 0 < threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be in (0, 1]")
+    try:
+        if doc_id:
+            matches = await run_in_threadpool(near_duplicate_index.similar, user_id, doc_id, threshold)
+            return {"doc_id": doc_id, "threshold": threshold, "duplicates": matches}
+        clusters = await run_in_threadpool(near_duplicate_index.clusters, user_id, threshold)
+        return {"threshold": threshold, "clusters": clusters}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -225,6 +625,7 @@ async def compare_documents(request: ComparisonRequest):
         # Extract data from both documents
         doc1_extracted = request.doc1_data.get("extracted_data", {})
         doc2_extracted = request.doc2_data.get("extracted_data", {})
+        doc1_record, doc2_record = normalized(doc1_extracted), normalized(doc2_extracted)
         
         # Build comparison
         comparison = {
@@ -247,14 +648,15 @@ async def compare_documents(request: ComparisonRequest):
         }
         
         # Check for differences
-        if doc1_extracted.get("vendor") != doc2_extracted.get("vendor"):
+        # Compared on the normalized values, so "ACME" / "Acme " and "$1,000" / "1000.00" match
+        if doc1_record["vendor_key"] != doc2_record["vendor_key"]:
             comparison["differences"].append({"field": "vendor", "type": "different"})
         
-        if doc1_extracted.get("total_amount") != doc2_extracted.get("total_amount"):
+        if doc1_record["amount_cents"] != doc2_record["amount_cents"]:
             comparison["differences"].append({"field": "amount", "type": "different"})
         
         # Check for duplicate
-        if (doc1_extracted.get("vendor", "").lower() == doc2_extracted.get("vendor", "").lower() and
+        if (doc1_record["vendor_key"] == doc2_record["vendor_key"] and
             doc1_extracted.get("invoice_number") == doc2_extracted.get("invoice_number") and
             doc1_extracted.get("invoice_number")):
             comparison["is_duplicate"] = True
@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import zlib
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from storage import data_path
+from normalize import normalized, vendor_key
+
+# Signature length and LSH banding (bands * rows must equal permutations). Changing
+# either invalidates stored signatures: clear the index and re-ingest.
+MINHASH_PERMUTATIONS = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+LSH_BANDS = int(os.getenv("LSH_BANDS", "16"))
+# Character shingles tolerate OCR noise: one misread letter only touches SHINGLE_CHARS shingles
+SHINGLE_CHARS = int(os.getenv("SHINGLE_CHARS", "5"))
+DUPLICATE_JACCARD_THRESHOLD = float(os.getenv("DUPLICATE_JACCARD_THRESHOLD", "0.8"))
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; a * x stays below 2^64
+HASH_PRIME = 4294967311
+HASH_BLOCK = 8192
+MINHASH_SEED = 1
+
+WORD_PATTERN = re.compile(r"[0-9a-z]+")
+
+def shingles(text: str, vendor: str = None) -> set:
+    """
+    Character shingles of the normalised text (lowercase words, single spaces),
+    plus vendor-tagged shingles of the normalised vendor name.
+    """
+    normalised = " ".join(WORD_PATTERN.findall((text or "").lower()))
+    result = {normalised[i:i + SHINGLE_CHARS] for i in range(max(len(normalised) - SHINGLE_CHARS + 1, 0))}
+    if len(normalised) < SHINGLE_CHARS and normalised:
+        result.add(normalised)
+    key = vendor_key(vendor)
+    if key:
+        result.update("vendor:" + key[i:i + SHINGLE_CHARS] for i in range(max(len(key) - SHINGLE_CHARS + 1, 1)))
+    return result
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of every ingested document, banded into an LSH index kept in
+    SQLite. Documents whose text is at least DUPLICATE_JACCARD_THRESHOLD similar share
+    a band bucket with high probability, so clustering a corpus only verifies
+    candidate pairs from shared buckets instead of comparing every pair.
+    """
+
+    def __init__(self, db_path: str):
+        if MINHASH_PERMUTATIONS % LSH_BANDS:
+            raise ValueError("MINHASH_PERMUTATIONS must be a multiple of LSH_BANDS")
+        self.rows_per_band = MINHASH_PERMUTATIONS // LSH_BANDS
+        rng = np.random.default_rng(MINHASH_SEED)
+        self.a = rng.integers(1, HASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+        self.b = rng.integers(0, HASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "user_id TEXT NOT NULL, doc_id TEXT NOT NULL, filename TEXT, vendor TEXT, signature BLOB NOT NULL, "
+            "PRIMARY KEY (user_id, doc_id))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bands ("
+            "user_id TEXT NOT NULL, band INTEGER NOT NULL, bucket INTEGER NOT NULL, doc_id TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (user_id, band, bucket)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS bands_doc ON bands (user_id, doc_id)")
+
+    def signature(self, shingle_set: set) -> np.ndarray:
+        """
+        MinHash signature (uint32 per permutation) of a shingle set, hashed in blocks
+        so long documents never materialise the full shingles x permutations matrix.
+        """
+        hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingle_set), dtype=np.uint64, count=len(shingle_set))
+        result = np.full(MINHASH_PERMUTATIONS, HASH_PRIME, dtype=np.uint64)
+        for start in range(0, len(hashes), HASH_BLOCK):
+            block = hashes[start:start + HASH_BLOCK, None]
+            np.minimum(result, ((block * self.a + self.b) % HASH_PRIME).min(axis=0), out=result)
+        return (result & 0xFFFFFFFF).astype(np.uint32)
+
+    def _buckets(self, signature: np.ndarray) -> list:
+        rows = signature.reshape(LSH_BANDS, self.rows_per_band)
+        return [int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "big", signed=True) for row in rows]
+
+    def add(self, user_id: str, doc_id: str, text: str, vendor: str = None, filename: str = None):
+        """
+        Signs and indexes a document, replacing any previous entry for the same id.
+        Documents with no text are not indexed.
+        """
+        shingle_set = shingles(text, vendor)
+        if not shingle_set:
+            return
+        signature = self.signature(shingle_set)
+        buckets = self._buckets(signature)
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self._remove(user_id, doc_id)
+                self.db.execute(
+                    "INSERT INTO signatures (user_id, doc_id, filename, vendor, signature) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, doc_id, filename, vendor, signature.tobytes()),
+                )
+                self.db.executemany(
+                    "INSERT INTO bands (user_id, band, bucket, doc_id) VALUES (?, ?, ?, ?)",
+                    [(user_id, band, bucket, doc_id) for band, bucket in enumerate(buckets)],
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def add_ingested(self, user_id: str, result: dict):
+        """Indexes a successful ingest result (from IngestionAgent) for `user_id`."""
+        vendor = normalized(result.get("extracted_data") or {})["vendor"]
+        self.add(user_id, result["content_hash"], result.get("text", ""), vendor, result.get("filename"))
+
+    def _remove(self, user_id: str, doc_id: str):
+        self.db.execute("DELETE FROM signatures WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+        self.db.execute("DELETE FROM bands WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+
+    def remove_document(self, user_id: str, doc_id: str):
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self._remove(user_id, doc_id)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _signatures(self, user_id: str, doc_ids=None) -> dict:
+        sql = "SELECT doc_id, filename, vendor, signature FROM signatures WHERE user_id = ?"
+        params = [user_id]
+        if doc_ids is not None:
+            sql += " AND doc_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(list(doc_ids)))
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return {
+            doc_id: {"filename": filename, "vendor": vendor, "signature": np.frombuffer(blob, dtype=np.uint32)}
+            for doc_id, filename, vendor, blob in rows
+        }
+
+    def similar(self, user_id: str, doc_id: str, threshold: float = DUPLICATE_JACCARD_THRESHOLD) -> list:
+        """
+        Near-duplicates of one indexed document, most similar first, found through
+        its own band buckets.
+        """
+        with self.lock:
+            candidates = [row[0] for row in self.db.execute(
+                "SELECT DISTINCT other.doc_id FROM bands mine JOIN bands other "
+                "ON other.user_id = mine.user_id AND other.band = mine.band AND other.bucket = mine.bucket "
+                "WHERE mine.user_id = ? AND mine.doc_id = ? AND other.doc_id != mine.doc_id",
+                (user_id, doc_id),
+            )]
+        if not candidates:
+            return []
+
+        signatures = self._signatures(user_id, candidates + [doc_id])
+        mine = signatures.pop(doc_id)["signature"]
+        matches = []
+        for other, entry in signatures.items():
+            similarity = float(np.mean(entry["signature"] == mine))
+            if similarity >= threshold:
+                matches.append({"id": other, "filename": entry["filename"], "vendor": entry["vendor"], "similarity": similarity})
+        return sorted(matches, key=lambda match: match["similarity"], reverse=True)
+
+    def clusters(self, user_id: str, threshold: float = DUPLICATE_JACCARD_THRESHOLD) -> list:
+        """
+        Groups a user's documents into near-duplicate clusters: candidate pairs come
+        from shared band buckets, are kept when their estimated Jaccard similarity
+        reaches `threshold`, and are merged with union-find. Returns clusters of two
+        or more documents, largest first.
+        """
+        with self.lock:
+            buckets = self.db.execute(
+                "SELECT group_concat(doc_id, char(31)) FROM bands WHERE user_id = ? "
+                "GROUP BY band, bucket HAVING COUNT(*) > 1",
+                (user_id,),
+            ).fetchall()
+        if not buckets:
+            return []
+
+        signatures = self._signatures(user_id)
+        parent = {}
+
+        def find(doc_id):
+            parent.setdefault(doc_id, doc_id)
+            while parent[doc_id] != doc_id:
+                parent[doc_id] = parent[parent[doc_id]]
+                doc_id = parent[doc_id]
+            return doc_id
+
+        checked = set()
+        lowest = {}  # cluster root -> lowest similarity among the pairs that joined it
+        for (members,) in buckets:
+            members = sorted(set(members.split("\x1f")))
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    # Pairs already in one cluster, or verified from another band, need no check
+                    if (first, second) in checked or find(first) == find(second):
+                        continue
+                    checked.add((first, second))
+                    similarity = float(np.mean(signatures[first]["signature"] == signatures[second]["signature"]))
+                    if similarity < threshold:
+                        continue
+                    a, b = find(first), find(second)
+                    parent[b] = a
+                    lowest[a] = min(similarity, lowest.get(a, 1.0), lowest.pop(b, 1.0))
+
+        groups = {}
+        for doc_id in parent:
+            groups.setdefault(find(doc_id), []).append(doc_id)
+
+        clusters = []
+        for root, members in groups.items():
+            if len(members) < 2:
+                continue
+            clusters.append({
+                "size": len(members),
+                "min_similarity": lowest[root],
+                "documents": [
+                    {"id": doc_id, "filename": signatures[doc_id]["filename"], "vendor": signatures[doc_id]["vendor"]}
+                    for doc_id in sorted(members)
+                ],
+            })
+        return sorted(clusters, key=lambda cluster: cluster["size"], reverse=True)
+
+near_duplicate_index = NearDuplicateIndex(data_path("near_duplicates.sqlite3"))
@@ -0,0 +1,168 @@
+import os
+import re
+import math
+from functools import lru_cache
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Currency assumed for amounts that name none
+DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "USD")
+
+# Raw key variants, in order of preference (extraction prompts, older clients, manual edits)
+VENDOR_FIELDS = ("vendor", "Vendor Name", "vendor_name", "merchant_name")
+AMOUNT_FIELDS = ("total_amount", "Total Amount")
+# Placeholders the frontend and older extractions use for "no value"
+MISSING_VALUES = {"", "pending", "pending extraction", "n/a", "na", "none", "null", "unknown"}
+
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR"}
+CURRENCY_CODE_PATTERN = re.compile(r"\b[A-Z]{3}\b")
+# ISO 4217 codes in current use; other three-letter words ("TBD", "NET") are not currencies
+CURRENCY_CODES = frozenset("""
+    AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BRL BSD BTN BWP BYN BZD
+    CAD CDF CHF CLP CNY COP CRC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS GIP GMD
+    GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW KWD KYD KZT
+    LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MYR MZN NAD NGN NIO NOK NPR
+    NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD SHP SLE SOS SRD SSP
+    STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD UYU UZS VES VND VUV WST XAF XCD XOF
+    XPF YER ZAR ZMW ZWL
+""".split())
+# Thousands separators only between exact 3-digit groups (used consistently), so "$100 2 items"
+# stays 100 rather than merging into 1002; plain numbers may carry a decimal part or exponent
+NUMBER_PATTERN = re.compile(
+    r"-?(?:\d{1,3}([,.' ])\d{3}(?:\1\d{3})*(?:[.,]\d+)?|\d+(?:[.,]\d+)?(?:[eE][-+]?\d+)?)(?!\d)"
+)
+ISO_DATE_PATTERN = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+# Tried in order; day-first formats only where the separator makes them unambiguous
+DATE_FORMATS = (
+    "%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%m/%d/%Y", "%m/%d/%y", "%d.%m.%Y", "%d-%m-%Y",
+    "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%Y%m%d",
+)
+
+def first_field(extracted: dict, names: tuple):
+    """The first of `names` with a non-empty value in `extracted`, or None."""
+    for name in names:
+        value = extracted.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+def is_missing(value) -> bool:
+    return value is None or str(value).strip().lower() in MISSING_VALUES
+
+def amount_cents(value) -> int:
+    """
+    Integer cents from an amount as written on a document: "$1,234.50", "1.234,50 EUR",
+    "(42.00)" and 1234.5 all parse. Returns None when there is no number.
+    """
+    if isinstance(value, bool) or is_missing(value):
+        return None
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        number = str(value)
+    else:
+        text = str(value).strip()
+        match = NUMBER_PATTERN.search(text)
+        if not match:
+            return None
+        number = match.group().replace("'", "").replace(" ", "")
+        # The last separator followed by exactly two digits is the decimal point
+        comma, dot = number.rfind(","), number.rfind(".")
+        if comma > dot and len(number) - comma - 1 == 2:
+            number = number.replace(".", "").replace(",", ".")
+        else:
+            number = number.replace(",", "")
+        # "(42.00)" and a minus ahead of the currency ("-$50.00", "- EUR 50") are negative too
+        if (text.startswith("(") and text.endswith(")")) or text[:match.start()].lstrip().startswith("-"):
+            number = "-" + number.lstrip("-")
+    try:
+        amount = Decimal(number)
+        if not amount.is_finite():
+            return None
+        return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return None
+
+def currency_code(amount, currency=None) -> str:
+    """
+    ISO currency code: the extracted currency field if it is one, else a symbol or
+    code written in the amount, else DEFAULT_CURRENCY. None when no amount parses.
+    """
+    if amount_cents(amount) is None:
+        return None
+    for text in (None if is_missing(currency) else str(currency).upper(), amount):
+        if is_missing(text):
+            continue
+        text = str(text)
+        for symbol, code in CURRENCY_SYMBOLS.items():
+            if symbol in text:
+                return code
+        for code in CURRENCY_CODE_PATTERN.findall(text):
+            if code in CURRENCY_CODES:
+                return code
+    return DEFAULT_CURRENCY
+
+def iso_date(value) -> str:
+    """YYYY-MM-DD from the date formats invoices commonly use, or None."""
+    if is_missing(value):
+        return None
+    text = " ".join(str(value).split())
+    # Fast path for what the extraction prompt asks for; text without digits is no date
+    match = ISO_DATE_PATTERN.match(text)
+    if match:
+        try:
+            return date(*map(int, match.groups())).isoformat()
+        except ValueError:
+            return None
+    if not any(character.isdigit() for character in text):
+        return None
+    return _parse_date(text)
+
+@lru_cache(maxsize=4096)
+def _parse_date(text: str) -> str:
+    # strptime over every format is slow; a corpus repeats the same few dates a lot
+    for candidate in (text, text[:10]):
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.strptime(candidate, date_format).date().isoformat()
+            except ValueError:
+                continue
+    return None
+
+def vendor_name(vendor) -> str:
+    """Vendor name as displayed: whitespace collapsed, None when missing."""
+    return None if is_missing(vendor) else " ".join(str(vendor).split())
+
+def vendor_key(vendor) -> str:
+    """Case-folded vendor name used for grouping and lookups ("" when missing)."""
+    name = vendor_name(vendor)
+    return name.casefold() if name else ""
+
+def normalize_fields(extracted: dict) -> dict:
+    """
+    The canonical record every downstream consumer reads instead of the raw fields:
+    integer-cent amount, currency code, ISO dates and vendor name/key.
+    """
+    amount = first_field(extracted, AMOUNT_FIELDS)
+    vendor = first_field(extracted, VENDOR_FIELDS)
+    return {
+        "amount_cents": amount_cents(amount),
+        "currency": currency_code(amount, extracted.get("currency")),
+        "date": iso_date(extracted.get("date")),
+        "due_date": iso_date(extracted.get("due_date")),
+        "vendor": vendor_name(vendor),
+        "vendor_key": vendor_key(vendor) or None,
+    }
+
+def normalized(extracted: dict) -> dict:
+    """
+    The record stored with the fields at extraction time, or computed now for
+    documents that predate it (e.g. sent by an older client).
+    """
+    record = extracted.get("normalized")
+    return record if isinstance(record, dict) else normalize_fields(extracted)
+
+def amount_of(record: dict) -> float:
+    """A normalized record's amount in currency units, or None."""
+    cents = record["amount_cents"]
+    return None if cents is None else cents / 100
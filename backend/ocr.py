@@ -2,8 +2,11 @@ import pytesseract
 import pdfplumber
 from PIL import Image
 import pypdfium2 as pdfium
+from ocr_pool import ocr_pool
 import os
 import platform
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 # Set Tesseract path for Windows
 if platform.system() == "Windows":
@@ -11,26 +14,15 @@ if platform.system() == "Windows":
     if os.path.exists(tesseract_path):
         pytesseract.pytesseract.tesseract_cmd = tesseract_path
 
-def generate_thumbnail(file_path: str, output_path: str) -> bool:
-    """
-    Generates a PNG thumbnail for a given file (PDF or Image).
-    """
-    try:
-        if file_path.lower().endswith(".pdf"):
-            pdf = pdfium.PdfDocument(file_path)
-            page = pdf[0]  # Get first page
-            bitmap = page.render(scale=1) # Render to bitmap
-            pil_image = bitmap.to_pil()
-            pil_image.save(output_path)
-        else:
-            # It's an image
-            with Image.open(file_path) as img:
-                img.thumbnail((400, 400)) # Resize to max 400x400
-                img.save(output_path)
-        return True
-    except Exception as e:
-        print(f"Error generating thumbnail: {e}")
-        return False
+# PDF pages are split across a process pool sized to the machine
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+# Smaller PDFs are extracted inline; pool start-up and IPC would cost more than they save
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+# Resolution used to render pages that have no text layer before OCR
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
 
 def extract_text_from_image(image_path: str) -> str:
     """
@@ -38,24 +30,74 @@ def extract_text_from_image(image_path: str) -> str:
     """
     try:
         with Image.open(image_path) as image:
-            text = pytesseract.image_to_string(image)
+            text = ocr_pool.recognize(image)
             return text.strip()
     except Exception as e:
         print(f"Error extracting text from image {image_path}: {e}")
         return ""
 
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, initializer=_init_pdf_worker)
+        return _pdf_pool
+
+def _init_pdf_worker():
+    # Forked workers inherit the parent's worker list, but not its threads
+    ocr_pool.reset()
+    # Each PDF process handles one page range at a time, so one OCR engine is enough
+    ocr_pool.configure(workers=1)
+
+def _extract_pdf_pages(pdf_path: str, start: int, end: int) -> list:
+    """
+    Extracts text for pages [start, end). Pages without a text layer (scans) are
+    rendered with pypdfium2 and sent through Tesseract. Runs inside pool workers.
+    """
+    texts = []
+    scanned_pdf = None
+    try:
+        with pdfplumber.open(pdf_path, pages=list(range(start + 1, end + 1))) as pdf:
+            for index, page in zip(range(start, end), pdf.pages):
+                page_text = page.extract_text() or ""
+                if not page_text.strip():
+                    if scanned_pdf is None:
+                        scanned_pdf = pdfium.PdfDocument(pdf_path)
+                    try:
+                        bitmap = scanned_pdf[index].render(scale=PDF_OCR_DPI / 72)
+                        page_text = ocr_pool.recognize(bitmap.to_pil())
+                    except Exception as e:
+                        print(f"Error running OCR on page {index + 1} of {pdf_path}: {e}")
+                texts.append(page_text.strip())
+    finally:
+        if scanned_pdf is not None:
+            scanned_pdf.close()
+    return texts
+
+def _page_ranges(page_count: int, workers: int) -> list:
+    """Splits pages into contiguous ranges, a few per worker so scanned pages balance out."""
+    chunk = max(1, -(-page_count // (workers * 4)))
+    return [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+
 def extract_text_from_pdf(pdf_path: str) -> str:
     """
-    Extracts text from a PDF file using pdfplumber.
+    Extracts text from a PDF file using pdfplumber, falling back to OCR for scanned pages.
+    Large PDFs are processed in parallel and reassembled in page order.
     """
-    text = ""
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        return text.strip()
+        pdf = pdfium.PdfDocument(pdf_path)
+        page_count = len(pdf)
+        pdf.close()
+
+        if PDF_WORKERS <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            page_texts = _extract_pdf_pages(pdf_path, 0, page_count)
+        else:
+            pool = _get_pdf_pool()
+            futures = [pool.submit(_extract_pdf_pages, pdf_path, start, end)
+                       for start, end in _page_ranges(page_count, PDF_WORKERS)]
+            page_texts = [text for future in futures for text in future.result()]
+
+        return "\n".join(text for text in page_texts if text)
     except Exception as e:
         print(f"Error extracting text from PDF {pdf_path}: {e}")
         return ""
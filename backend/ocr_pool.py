@@ -0,0 +1,150 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import pytesseract
+
+# tesserocr binds libtesseract directly, so an engine can stay initialised between images
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_POOL_ENABLED = os.getenv("OCR_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_POOL_WORKERS = int(os.getenv("OCR_POOL_WORKERS", str(os.cpu_count() or 1)))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_PSM = int(os.getenv("OCR_PSM", "3"))  # 3 = fully automatic page segmentation
+# Longest a caller waits for one image before giving up on it
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "120"))
+
+class OCRWorker(threading.Thread):
+    """
+    Long-lived OCR worker that owns one initialised Tesseract engine and
+    serves images from the pool queue.
+    """
+
+    def __init__(self, pool: "OCRPool", index: int):
+        super().__init__(name=f"ocr-worker-{index}", daemon=True)
+        self.pool = pool
+        self.index = index
+        self.images = 0
+        self.characters = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.api = None
+        self.lang = None
+
+    def _engine(self, lang: str, psm: int):
+        path = os.getenv("TESSDATA_PREFIX") or tesserocr.get_languages()[0]
+        if self.api is None:
+            self.api = tesserocr.PyTessBaseAPI(path=path, lang=lang, psm=psm)
+        elif lang != self.lang:
+            # Only a language change forces the traineddata to be reloaded
+            self.api.End()
+            self.api.Init(path=path, lang=lang)
+        self.lang = lang
+        self.api.SetPageSegMode(psm)
+        return self.api
+
+    def run(self):
+        while True:
+            image, lang, psm, future = self.pool.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            start = time.perf_counter()
+            try:
+                api = self._engine(lang, psm)
+                api.SetImage(image)
+                text = api.GetUTF8Text()
+                self.images += 1
+                self.characters += len(text)
+                future.set_result(text)
+            except Exception as e:
+                self.errors += 1
+                future.set_exception(e)
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {
+            "worker": self.name,
+            "images": self.images,
+            "characters": self.characters,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "images_per_second": round(self.images / self.busy_seconds, 3) if self.busy_seconds else 0.0,
+        }
+
+class OCRPool:
+    """
+    Pool of persistent Tesseract workers fed through a queue. Falls back to
+    pytesseract (one tesseract process per image) when the pool is disabled
+    or tesserocr is not installed.
+    """
+
+    def __init__(self, workers: int = OCR_POOL_WORKERS, enabled: bool = OCR_POOL_ENABLED):
+        self.size = workers
+        self.enabled = enabled and tesserocr is not None
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.fallback_images = 0
+
+    def configure(self, workers: int = None, enabled: bool = None):
+        """Adjusts the pool before first use (e.g. one worker inside each PDF process)."""
+        with self.lock:
+            if workers is not None:
+                self.size = workers
+            if enabled is not None:
+                self.enabled = enabled and tesserocr is not None
+
+    def reset(self):
+        """
+        Forgets workers, queue and lock inherited from a forked parent: their
+        threads do not exist in the child, so the first image starts new ones.
+        """
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if not self.workers:
+                self.workers = [OCRWorker(self, i) for i in range(max(1, self.size))]
+                for worker in self.workers:
+                    worker.start()
+                print(f"[OCR] Started {len(self.workers)} persistent Tesseract workers")
+
+    def recognize(self, image, lang: str = None, psm: int = None) -> str:
+        """
+        Runs OCR on a PIL image and returns the recognised text.
+        """
+        lang = lang or OCR_LANG
+        psm = OCR_PSM if psm is None else psm
+
+        if not self.enabled:
+            self.fallback_images += 1
+            return pytesseract.image_to_string(image, lang=lang, config=f"--psm {psm}")
+
+        self._start()
+        future = Future()
+        self.queue.put((image, lang, psm, future))
+        try:
+            return future.result(timeout=OCR_TIMEOUT_SECONDS)
+        except TimeoutError:
+            # Still queued: workers skip cancelled futures
+            future.cancel()
+            raise TimeoutError(f"OCR did not finish within {OCR_TIMEOUT_SECONDS}s")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "engine": "tesserocr" if self.enabled else "pytesseract",
+            "queued": self.queue.qsize(),
+            "fallback_images": self.fallback_images,
+            "workers": [worker.stats() for worker in self.workers],
+        }
+
+ocr_pool = OCRPool()
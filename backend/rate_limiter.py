@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+from urllib.parse import parse_qsl
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from storage import data_path
+
+# "<tokens>/<period>": bucket size, refilled evenly over the period (second, minute, hour or day)
+UPLOAD_RATE_LIMIT = os.getenv("UPLOAD_RATE_LIMIT", "3/hour")
+QUESTION_RATE_LIMIT = os.getenv("QUESTION_RATE_LIMIT", "5/hour")
+# Batch ingest requests, each charged one token however many documents it carries
+BATCH_RATE_LIMIT = os.getenv("BATCH_RATE_LIMIT", "3/hour")
+RATE_LIMITS = {"uploads": UPLOAD_RATE_LIMIT, "questions": QUESTION_RATE_LIMIT, "batches": BATCH_RATE_LIMIT}
+# How often each worker deletes buckets that have refilled (a full bucket is the same as none)
+RATE_LIMIT_SWEEP_SECONDS = float(os.getenv("RATE_LIMIT_SWEEP_SECONDS", "60"))
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+def parse_rate(rate: str) -> tuple:
+    """'5/hour' -> (5.0, 3600). Returns (capacity, period in seconds)."""
+    count, _, period = rate.partition("/")
+    if period.strip().lower() not in PERIODS or float(count) <= 0:
+        raise ValueError(f"Invalid rate limit {rate!r}: expected <count>/<{'|'.join(PERIODS)}>")
+    return float(count), PERIODS[period.strip().lower()]
+
+def client_identity(scope: dict) -> str:
+    """
+    Who a request is charged to: the `user_id` query parameter, else the X-User-Id
+    header, else the client address. JSON bodies are not read, so limits apply
+    before any of the request body is received.
+    """
+    for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1")):
+        if name == "user_id" and value:
+            return "user:" + value
+    for name, value in scope.get("headers", []):
+        if name == b"x-user-id" and value:
+            return "user:" + value.decode("latin-1")
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+class RateLimiter:
+    """
+    Token buckets per (identity, limit), kept in SQLite so every worker process
+    shares them. Each bucket holds `capacity` tokens and refills at
+    capacity / period per second; a request spends tokens or is refused. Buckets
+    are deleted once they would be full again, so the table only holds clients
+    seen within the last period.
+    """
+
+    def __init__(self, db_path: str, limits: dict):
+        self.limits = {name: parse_rate(rate) for name, rate in limits.items()}
+        self.lock = threading.Lock()
+        self.last_sweep = 0.0
+        # The timeout waits out other workers' write transactions instead of failing
+        self.db = sqlite3.connect(db_path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "identity TEXT NOT NULL, name TEXT NOT NULL, tokens REAL NOT NULL, updated_at REAL NOT NULL, "
+            "full_at REAL NOT NULL, PRIMARY KEY (identity, name))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+
+    def acquire(self, identity: str, name: str, cost: float = 1) -> float:
+        """
+        Spends `cost` tokens from the bucket. Returns 0 when granted, otherwise the
+        seconds until enough tokens are available (inf if `cost` exceeds the bucket).
+        """
+        capacity, period = self.limits[name]
+        if cost > capacity:
+            return math.inf
+        rate = capacity / period
+        now = time.time()
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE identity = ? AND name = ?", (identity, name)
+                ).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+                if tokens < cost:
+                    self.db.execute("COMMIT")
+                    return (cost - tokens) / rate
+                tokens -= cost
+                self.db.execute(
+                    "INSERT OR REPLACE INTO buckets (identity, name, tokens, updated_at, full_at) VALUES (?, ?, ?, ?, ?)",
+                    (identity, name, tokens, now, now + (capacity - tokens) / rate),
+                )
+                if now - self.last_sweep >= RATE_LIMIT_SWEEP_SECONDS:
+                    self.db.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+                    self.last_sweep = now
+                self.db.execute("COMMIT")
+                return 0.0
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def refund(self, identity: str, name: str, tokens: float = 1):
+        """Returns tokens spent on a request that was rejected later on (never above capacity)."""
+        capacity, period = self.limits[name]
+        rate = capacity / period
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE identity = ? AND name = ?", (identity, name)
+                ).fetchone()
+                if row is not None:
+                    balance = min(capacity, row[0] + max(now - row[1], 0) * rate + tokens)
+                    self.db.execute(
+                        "UPDATE buckets SET tokens = ?, updated_at = ?, full_at = ? WHERE identity = ? AND name = ?",
+                        (balance, now, now + (capacity - balance) / rate, identity, name),
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def size(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+def retry_headers(retry_after: float) -> dict:
+    """Retry-After for a refusal; none when waiting would not help."""
+    return {} if math.isinf(retry_after) else {"Retry-After": str(math.ceil(retry_after))}
+
+def limit_exceeded_detail(name: str, retry_after: float) -> str:
+    if math.isinf(retry_after):
+        return f"Rate Limit Reached: request exceeds the {name} limit ({RATE_LIMITS[name]})."
+    return f"Rate Limit Reached: {RATE_LIMITS[name]} {name} allowed. Retry in {math.ceil(retry_after)}s."
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware charging one token per request to the routes in `routes`
+    ({(method, path): limit name}). Refused requests get a 429 with Retry-After
+    before the app (and so any upload body) is touched.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, routes: dict):
+        self.app = app
+        self.limiter = limiter
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        name = self.routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if name is not None:
+            retry_after = await run_in_threadpool(self.limiter.acquire, client_identity(scope), name)
+            if retry_after:
+                print(f"[RateLimit] Refused {scope['method']} {scope['path']} for {client_identity(scope)}")
+                response = JSONResponse(
+                    {"detail": limit_exceeded_detail(name, retry_after)},
+                    status_code=429,
+                    headers=retry_headers(retry_after),
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+rate_limiter = RateLimiter(data_path("rate_limits.sqlite3"), RATE_LIMITS)
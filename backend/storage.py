@@ -0,0 +1,91 @@
+import os
+import hashlib
+
+# Root for everything the backend persists locally (caches, indexes, stores)
+DATA_DIR = os.getenv("RIDA_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+CHUNK_SIZE = 1024 * 1024
+
+class UploadTooLargeError(ValueError):
+    pass
+
+def data_path(*parts: str) -> str:
+    """
+    Returns a path under DATA_DIR, creating its parent directory.
+    """
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def data_dir(*parts: str) -> str:
+    """
+    Returns a directory under DATA_DIR, creating it if needed.
+    """
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def blob_path(content_hash: str) -> str:
+    """
+    Returns where the original bytes for `content_hash` are kept (sharded by hash prefix).
+    """
+    return os.path.join(DATA_DIR, "blobs", content_hash[:2], content_hash)
+
+def store_blob(src_path: str, content_hash: str) -> str:
+    """
+    Moves a spooled upload into the content-addressed blob store. Identical content
+    is stored once; the source file is consumed either way.
+    """
+    path = blob_path(content_hash)
+    if os.path.exists(path):
+        os.remove(src_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+    return path
+
+def delete_blob(content_hash: str) -> bool:
+    """
+    Removes the stored original for `content_hash`. Returns False if there was none.
+    """
+    try:
+        os.remove(blob_path(content_hash))
+        return True
+    except FileNotFoundError:
+        return False
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file, read in fixed-size chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def spool_stream(source, dest_path: str, max_bytes: int, on_chunk=None) -> dict:
+    """
+    Copies a binary stream to `dest_path` in fixed-size chunks, hashing and counting
+    bytes as they pass. Each chunk is also handed to `on_chunk` (e.g. a storage upload),
+    so the content is read exactly once and never held in memory as a whole.
+    Raises UploadTooLargeError as soon as more than `max_bytes` have been read.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, "wb") as out:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+                digest.update(chunk)
+                out.write(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+
+    return {"sha256": digest.hexdigest(), "size": size}
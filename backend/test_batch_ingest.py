@@ -0,0 +1,34 @@
+import requests
+import json
+import os
+
+def test_batch_ingestion():
+    url = "http://localhost:8000/agents/ingest/batch"
+    file_paths = ["backend/test_image.png", "backend/test_image.pdf"]
+
+    files = [("files", open(path, "rb")) for path in file_paths if os.path.exists(path)]
+    if not files:
+        print("No test files found.")
+        return
+
+    print(f"Uploading {len(files)} files to {url}...")
+    try:
+        with requests.post(url, files=files, stream=True) as response:
+            if response.status_code != 200:
+                print(f"Failed with status {response.status_code}")
+                print(response.text)
+                return
+
+            # One JSON result per line, in completion order
+            for line in response.iter_lines():
+                if line:
+                    result = json.loads(line)
+                    print(f"[{result['index']}] {result['filename']}: {result.get('type', result.get('error'))}")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        for _, f in files:
+            f.close()
+
+if __name__ == "__main__":
+    test_batch_ingestion()
@@ -0,0 +1,33 @@
+import requests
+import json
+
+def test_chat_stream():
+    url = "http://localhost:8000/agents/chat/stream"
+
+    payload = {
+        "message": "What is the total amount?",
+        "context": "Document: invoice.pdf\nVendor: Acme Corp\nDate: 2023-10-27\nTotal Amount: $550.00\nItems: Widget A, Widget B"
+    }
+
+    print(f"Sending streaming chat request to {url}...")
+    try:
+        with requests.post(url, json=payload, stream=True) as response:
+            if response.status_code != 200:
+                print(f"Error: {response.status_code}")
+                print(response.text)
+                return
+
+            # Server-Sent Events: print tokens as they arrive
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if "token" in data:
+                        print(data["token"], end="", flush=True)
+                    elif "error" in data:
+                        print(f"\nError: {data['error']}")
+            print()
+    except Exception as e:
+        print(f"Connection error: {e}")
+
+if __name__ == "__main__":
+    test_chat_stream()
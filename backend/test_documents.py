@@ -0,0 +1,52 @@
+import requests
+import os
+import time
+
+BASE_URL = "http://localhost:8000"
+HEADERS = {"X-User-Id": "demo_user"}
+
+def test_documents():
+    file_path = "backend/test_image.png"
+    if not os.path.exists(file_path):
+        print(f"File {file_path} does not exist.")
+        return
+
+    try:
+        # Ingest a document first, so there is one to query and approve
+        print(f"Ingesting {file_path}...")
+        with open(file_path, "rb") as f:
+            response = requests.post(f"{BASE_URL}/agents/ingest", files={"file": f}, headers=HEADERS)
+        if response.status_code != 200:
+            print(f"Error: {response.status_code}")
+            print(response.text)
+            return
+        job = response.json()
+        while job["status"] not in ("completed", "failed"):
+            time.sleep(1)
+            job = requests.get(f"{BASE_URL}/agents/jobs/{job['job_id']}").json()
+        if job["status"] == "failed" or job["result"].get("error"):
+            print(f"Ingestion failed: {job.get('error') or job['result'].get('error')}")
+            return
+        doc_id = job["result"]["content_hash"]
+
+        # Analytics over the server-side store: only a filter is sent, not the documents
+        print("Requesting analytics for stored invoices...")
+        response = requests.post(f"{BASE_URL}/agents/analytics", json={"doc_type": "invoice"}, headers=HEADERS)
+        if response.status_code == 200:
+            print(response.json()["summary"])
+        else:
+            print(f"Error: {response.status_code}")
+            print(response.text)
+            return
+
+        # The export is streamed; count rows as they arrive
+        with requests.post(f"{BASE_URL}/agents/export", json={"format": "csv"}, headers=HEADERS, stream=True) as export:
+            print(f"Exported {sum(1 for _ in export.iter_lines()) - 1} rows")
+
+        updated = requests.patch(f"{BASE_URL}/documents/{doc_id}", json={"status": "approved"}, headers=HEADERS)
+        print(updated.status_code, updated.json())
+    except Exception as e:
+        print(f"Connection error: {e}")
+
+if __name__ == "__main__":
+    test_documents()
@@ -0,0 +1,21 @@
+import requests
+
+def test_duplicates():
+    url = "http://localhost:8000/agents/duplicates"
+    params = {"user_id": "demo_user", "threshold": 0.8}
+
+    print(f"Finding near-duplicate documents at {url}...")
+    try:
+        response = requests.get(url, params=params)
+        if response.status_code == 200:
+            for cluster in response.json()["clusters"]:
+                names = ", ".join(doc["filename"] or doc["id"] for doc in cluster["documents"])
+                print(f"{cluster['size']} documents (similarity >= {cluster['min_similarity']:.2f}): {names}")
+        else:
+            print(f"Error: {response.status_code}")
+            print(response.text)
+    except Exception as e:
+        print(f"Connection error: {e}")
+
+if __name__ == "__main__":
+    test_duplicates()
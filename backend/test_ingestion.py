@@ -1,5 +1,6 @@
 import requests
 import os
+import time
 
 def test_ingestion():
     url = "http://localhost:8000/agents/ingest"
@@ -15,8 +16,14 @@ def test_ingestion():
         try:
             response = requests.post(url, files=files)
             if response.status_code == 200:
-                print("Success!")
-                print(response.json())
+                job = response.json()
+                print(f"Queued job {job['job_id']}, polling...")
+                while job["status"] not in ("completed", "failed"):
+                    time.sleep(1)
+                    job = requests.get(f"http://localhost:8000/agents/jobs/{job['job_id']}").json()
+                    print(f"  stage: {job['stage']}")
+                print("Success!" if job["status"] == "completed" else "Job failed!")
+                print(job)
             else:
                 print(f"Failed with status {response.status_code}")
                 print(response.text)
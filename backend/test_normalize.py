@@ -0,0 +1,67 @@
+from decimal import Decimal
+from normalize import amount_cents, currency_code, iso_date, normalize_fields
+
+AMOUNT_CASES = [
+    ("$1,234.50", 123450),
+    ("1.234,50 EUR", 123450),
+    ("1 234,50", 123450),
+    ("1'234.50 CHF", 123450),
+    ("1234.5", 123450),
+    ("(42.00)", -4200),
+    ("-$50.00", -5000),
+    ("$-5", -500),
+    ("$100 2 items", 10000),
+    ("1e5", 10000000),
+    (1234.5, 123450),
+    (1e16, 10 ** 18),
+    (float("nan"), None),
+    (float("inf"), None),
+    (Decimal("NaN"), None),
+    ("NaN", None),
+    ("n/a", None),
+    ("TBD", None),
+    (True, None),
+]
+
+CURRENCY_CASES = [
+    ("$10", None, "USD"),
+    ("1.234,50 EUR", None, "EUR"),
+    ("10", "gbp", "GBP"),
+    ("10", "NET 30", "USD"),
+    ("TBD", "TBD", None),
+]
+
+DATE_CASES = [
+    ("2024-03-05", "2024-03-05"),
+    ("2024-03-05T10:00:00", "2024-03-05"),
+    ("March 5, 2024", "2024-03-05"),
+    ("05.03.2024", "2024-03-05"),
+    ("2024-02-30", None),
+    ("soon", None),
+]
+
+def test_normalize():
+    failures = 0
+    for value, expected in AMOUNT_CASES:
+        result = amount_cents(value)
+        if result != expected:
+            failures += 1
+            print(f"amount_cents({value!r}) = {result!r}, expected {expected!r}")
+    for amount, currency, expected in CURRENCY_CASES:
+        result = currency_code(amount, currency)
+        if result != expected:
+            failures += 1
+            print(f"currency_code({amount!r}, {currency!r}) = {result!r}, expected {expected!r}")
+    for value, expected in DATE_CASES:
+        result = iso_date(value)
+        if result != expected:
+            failures += 1
+            print(f"iso_date({value!r}) = {result!r}, expected {expected!r}")
+
+    record = normalize_fields({"Vendor Name": " ACME  Corp ", "Total Amount": "$99.90", "date": "2024-01-31"})
+    print(f"Normalized record: {record}")
+    assert failures == 0, f"{failures} normalization cases failed"
+    print("All normalization cases passed")
+
+if __name__ == "__main__":
+    test_normalize()
@@ -0,0 +1,20 @@
+import requests
+
+def test_search():
+    url = "http://localhost:8000/documents/search"
+    params = {"q": "total amount due to Acme", "user_id": "demo_user", "top_k": 5}
+
+    print(f"Searching documents at {url}...")
+    try:
+        response = requests.get(url, params=params)
+        if response.status_code == 200:
+            for result in response.json()["results"]:
+                print(f"{result['score']:.3f}  {result['filename']} #{result['chunk']}  {result['text'][:80]!r}")
+        else:
+            print(f"Error: {response.status_code}")
+            print(response.text)
+    except Exception as e:
+        print(f"Connection error: {e}")
+
+if __name__ == "__main__":
+    test_search()
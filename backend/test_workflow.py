@@ -44,5 +44,27 @@ def test_workflow():
     except Exception as e:
         print(f"Connection error: {e}")
 
+def test_workflow_batch():
+    url = "http://localhost:8000/agents/workflow/batch"
+
+    # Same invoice number twice for one vendor, plus an outlier amount
+    payload = {
+        "documents": [
+            {"id": "a", "filename": "acme_1.pdf", "extracted_data": {"vendor": "Acme", "total_amount": "$100.00", "invoice_number": "INV-1"}},
+            {"id": "b", "filename": "acme_2.pdf", "extracted_data": {"vendor": "ACME ", "total_amount": "$120.00", "invoice_number": "inv 1"}},
+            {"id": "c", "filename": "acme_3.pdf", "extracted_data": {"vendor": "Acme", "total_amount": "$900.00", "invoice_number": "INV-3"}}
+        ]
+    }
+
+    print(f"Sending batch workflow request to {url}...")
+    try:
+        response = requests.post(url, json=payload)
+        print(f"Status: {response.status_code}")
+        print(json.dumps(response.json(), indent=2))
+    except Exception as e:
+        print(f"Connection error: {e}")
+
 if __name__ == "__main__":
     test_workflow()
+    print("-" * 20)
+    test_workflow_batch()
@@ -0,0 +1,42 @@
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware capping request bodies on the routes in `routes`
+    ({(method, path): max bytes}). A larger Content-Length is refused with 413
+    before anything is read; bodies without one (chunked) are counted as they
+    stream through `receive()` and cut off with 413 once they pass the limit, so
+    no more than the limit is ever spooled to disk.
+    """
+
+    def __init__(self, app, routes: dict):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        limit = self.routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Upload exceeds the {limit} byte limit"
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                response = JSONResponse({"detail": detail}, status_code=413)
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing; FastAPI passes HTTPExceptions through as responses
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,350 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from storage import data_dir
+
+# Rows scored per matrix-vector product when scanning the store
+VECTOR_SEARCH_BLOCK_ROWS = int(os.getenv("VECTOR_SEARCH_BLOCK_ROWS", "65536"))
+# IVF coarse quantiser, trained once the store reaches VECTOR_IVF_MIN_ROWS; VECTOR_IVF_LISTS=0 disables it
+VECTOR_IVF_LISTS = int(os.getenv("VECTOR_IVF_LISTS", "1024"))
+VECTOR_IVF_MIN_ROWS = int(os.getenv("VECTOR_IVF_MIN_ROWS", "1000000"))
+VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+
+IVF_TRAIN_ITERATIONS = 20
+IVF_SAMPLES_PER_LIST = 64
+# Rows assigned per centroid product while training, to bound temporary memory
+IVF_ASSIGN_BLOCK_ROWS = 8192
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def nearest_centroids(matrix, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), IVF_ASSIGN_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + IVF_ASSIGN_BLOCK_ROWS])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def train_centroids(sample: np.ndarray, lists: int, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means over unit vectors: centroids are renormalised after every
+    update, so assignment is a plain dot product.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(IVF_TRAIN_ITERATIONS):
+        assignments = nearest_centroids(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=lists)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        # Empty lists keep their previous centroid
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        centroids = normalize(centroids).astype(np.float32)
+    return centroids
+
+class VectorStore:
+    """
+    Append-only embedding store. Unit-normalised float32 vectors are appended to a
+    flat file that is memory-mapped for search, so opening the store reads nothing
+    up front. A SQLite sidecar maps each row offset to its (user, document, chunk);
+    re-indexed or removed documents are tombstoned rather than rewritten. The
+    per-row owner codes and tombstones search needs are mirrored in flat files
+    beside the vectors, so they load with one read each.
+    """
+
+    def __init__(self, directory: str):
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.assignments_path = os.path.join(directory, "ivf_assignments.i32")
+        self.centroids_path = os.path.join(directory, "ivf_centroids.npy")
+        self.owners_path = os.path.join(directory, "owners.i32")
+        self.deleted_path = os.path.join(directory, "deleted.u8")
+        self.lock = threading.Lock()
+        self.training = False
+
+        self.db = sqlite3.connect(os.path.join(directory, "vectors.sqlite3"), check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "row INTEGER PRIMARY KEY, user_id TEXT NOT NULL, doc_id TEXT NOT NULL, "
+            "ordinal INTEGER NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS rows_document ON rows (user_id, doc_id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS users (code INTEGER PRIMARY KEY, user_id TEXT NOT NULL UNIQUE)")
+
+        dim = self.db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        self.dim = int(dim[0]) if dim else None
+        self.rows = self.db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+        self.centroids = np.load(self.centroids_path) if os.path.exists(self.centroids_path) else None
+        self._truncate_uncommitted()
+
+        self.matrix = None  # memmap over the first `matrix_rows` rows
+        self.matrix_rows = 0
+        # Per-row user code and liveness, loaded on first search; capacity grows geometrically
+        self.owners = None
+        self.alive = None
+        self.user_codes = dict(self.db.execute("SELECT user_id, code FROM users"))
+        self.lists = None  # (row order by list, list offsets, rows covered)
+
+    def _truncate_uncommitted(self):
+        # Vectors are written before their sidecar rows commit; drop any tail a crash left behind
+        if self.dim and os.path.exists(self.vectors_path):
+            expected = self.rows * self.dim * 4
+            if os.path.getsize(self.vectors_path) > expected:
+                os.truncate(self.vectors_path, expected)
+        if self.centroids is not None and os.path.exists(self.assignments_path):
+            if os.path.getsize(self.assignments_path) > self.rows * 4:
+                os.truncate(self.assignments_path, self.rows * 4)
+        for path, width in ((self.owners_path, 4), (self.deleted_path, 1)):
+            if os.path.exists(path) and os.path.getsize(path) > self.rows * width:
+                os.truncate(path, self.rows * width)
+
+    def _matrix(self):
+        if self.matrix_rows != self.rows:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+            self.matrix_rows = self.rows
+        return self.matrix
+
+    def _user_code(self, user_id: str) -> int:
+        code = self.user_codes.get(user_id)
+        if code is None:
+            code = self.db.execute("INSERT INTO users (user_id) VALUES (?)", (user_id,)).lastrowid
+            self.user_codes[user_id] = code
+        return code
+
+    def _reserve(self, rows: int):
+        """Makes room for `rows` rows in the in-memory owner and liveness arrays."""
+        if rows <= len(self.owners):
+            return
+        capacity = max(rows, 2 * len(self.owners), 1024)
+        owners = np.zeros(capacity, dtype=np.int32)
+        alive = np.zeros(capacity, dtype=bool)
+        owners[:len(self.owners)] = self.owners
+        alive[:len(self.alive)] = self.alive
+        # Searches already running keep the arrays they started with
+        self.owners, self.alive = owners, alive
+
+    def _sidecars_current(self) -> bool:
+        for path, width in ((self.owners_path, 4), (self.deleted_path, 1)):
+            if not os.path.exists(path) or os.path.getsize(path) != self.rows * width:
+                return False
+        # A crash between the sidecar and SQLite tombstone writes shows up as a count mismatch
+        deleted = self.db.execute("SELECT COUNT(*) FROM rows WHERE deleted = 1").fetchone()[0]
+        return deleted == np.count_nonzero(np.fromfile(self.deleted_path, dtype=np.uint8))
+
+    def _rebuild_sidecars(self):
+        """Rewrites the owner and tombstone files from SQLite (stores created before they existed)."""
+        print(f"[SmartMemory] Rebuilding row sidecars for {self.rows} vectors")
+        owners = np.zeros(self.rows, dtype=np.int32)
+        deleted = np.zeros(self.rows, dtype=np.uint8)
+        for (user_id,) in self.db.execute("SELECT DISTINCT user_id FROM rows").fetchall():
+            rows = np.fromiter((row for (row,) in self.db.execute("SELECT row FROM rows WHERE user_id = ?", (user_id,))), dtype=np.int64)
+            owners[rows] = self._user_code(user_id)
+        rows = np.fromiter((row for (row,) in self.db.execute("SELECT row FROM rows WHERE deleted = 1")), dtype=np.int64)
+        deleted[rows] = 1
+        owners.tofile(self.owners_path)
+        deleted.tofile(self.deleted_path)
+
+    def _load_rows(self):
+        if self.owners is not None:
+            return
+        if not self._sidecars_current():
+            self._rebuild_sidecars()
+        self.owners = np.fromfile(self.owners_path, dtype=np.int32, count=self.rows)
+        self.alive = np.fromfile(self.deleted_path, dtype=np.uint8, count=self.rows) == 0
+        self._reserve(self.rows)
+
+    def _delete(self, user_id: str, doc_id: str) -> int:
+        rows = [row for (row,) in self.db.execute(
+            "SELECT row FROM rows WHERE user_id = ? AND doc_id = ? AND deleted = 0", (user_id, doc_id)
+        )]
+        if rows:
+            self.db.execute("UPDATE rows SET deleted = 1 WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+            if os.path.exists(self.deleted_path):
+                with open(self.deleted_path, "r+b") as f:
+                    for row in rows:
+                        f.seek(row)
+                        f.write(b"\x01")
+            if self.alive is not None:
+                self.alive[rows] = False
+        return len(rows)
+
+    def has_document(self, user_id: str, doc_id: str) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM rows WHERE user_id = ? AND doc_id = ? AND deleted = 0 LIMIT 1", (user_id, doc_id)
+            ).fetchone()
+            return row is not None
+
+    def add(self, user_id: str, doc_id: str, vectors) -> int:
+        """
+        Stores one vector per chunk of a document (row i = chunk ordinal i), replacing
+        any vectors previously stored for it. Returns the number of rows appended.
+        """
+        vectors = normalize(np.asarray(vectors, dtype=np.float32)).astype(np.float32)
+        if vectors.ndim != 2 or not len(vectors):
+            return 0
+
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store ({self.dim})")
+
+            self._delete(user_id, doc_id)
+            start = self.rows
+            code = self._user_code(user_id)
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            if start == 0 or os.path.exists(self.owners_path):
+                # Stores that predate the sidecars get them rebuilt on the next search instead
+                with open(self.owners_path, "ab") as f:
+                    f.write(np.full(len(vectors), code, dtype=np.int32).tobytes())
+                with open(self.deleted_path, "ab") as f:
+                    f.write(bytes(len(vectors)))
+            if self.centroids is not None:
+                with open(self.assignments_path, "ab") as f:
+                    f.write(nearest_centroids(vectors, self.centroids).tobytes())
+
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO rows (row, user_id, doc_id, ordinal) VALUES (?, ?, ?, ?)",
+                [(start + ordinal, user_id, doc_id, ordinal) for ordinal in range(len(vectors))],
+            )
+            self.db.execute("COMMIT")
+            self.rows += len(vectors)
+
+            if self.owners is not None:
+                self._reserve(self.rows)
+                self.owners[start:self.rows] = code
+                self.alive[start:self.rows] = True
+
+            train = (
+                VECTOR_IVF_LISTS > 0 and self.centroids is None and not self.training
+                and self.rows >= VECTOR_IVF_MIN_ROWS
+            )
+            if train:
+                self.training = True
+
+        if train:
+            self.train_ivf()
+        return len(vectors)
+
+    def remove_document(self, user_id: str, doc_id: str) -> int:
+        with self.lock:
+            return self._delete(user_id, doc_id)
+
+    def train_ivf(self):
+        """
+        Trains the coarse quantiser on a sample of the store and assigns every row to
+        its nearest list. Runs outside the lock, so ingest carries on meanwhile.
+        """
+        with self.lock:
+            matrix, rows = self._matrix(), self.rows
+        lists = min(VECTOR_IVF_LISTS, rows)
+        print(f"[SmartMemory] Training IVF quantiser: {lists} lists over {rows} vectors")
+        try:
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(rows, size=min(rows, lists * IVF_SAMPLES_PER_LIST), replace=False))
+            centroids = train_centroids(np.asarray(matrix[sample_rows]), lists)
+            nearest_centroids(matrix, centroids).tofile(self.assignments_path)
+
+            with self.lock:
+                # Rows appended while training still need their lists
+                if self.rows > rows:
+                    with open(self.assignments_path, "ab") as f:
+                        f.write(nearest_centroids(self._matrix()[rows:], centroids).tobytes())
+                np.save(self.centroids_path, centroids)
+                self.centroids = centroids
+                self.lists = None
+        finally:
+            self.training = False
+
+    def _probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Returns the rows in the `nprobe` lists nearest to the query, in row order.
+        """
+        assignments = np.memmap(self.assignments_path, dtype=np.int32, mode="r", shape=(self.rows,))
+        if self.lists is None or self.rows - self.lists[2] > VECTOR_SEARCH_BLOCK_ROWS:
+            order = np.argsort(assignments, kind="stable")
+            offsets = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = (order, offsets, self.rows)
+        order, offsets, covered = self.lists
+
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        candidates = [order[offsets[c]:offsets[c + 1]] for c in probes]
+        # Rows appended since the lists were built are matched against their stored assignment
+        tail = np.flatnonzero(np.isin(assignments[covered:], probes)) + covered
+        return np.sort(np.concatenate(candidates + [tail]))
+
+    def search(self, vector, user_id: str = None, top_k: int = 10, nprobe: int = VECTOR_IVF_NPROBE) -> list:
+        """
+        Returns up to top_k rows by cosine similarity to `vector`, optionally limited to
+        one user's documents: [{row, doc_id, ordinal, score}], best first.
+        """
+        query = normalize(np.asarray(vector, dtype=np.float32)).astype(np.float32)
+        with self.lock:
+            if not self.rows or self.dim is None:
+                return []
+            if query.shape != (self.dim,):
+                raise ValueError(f"Query dimension {query.shape[-1]} does not match the store ({self.dim})")
+            self._load_rows()
+            matrix, owners, alive = self._matrix(), self.owners, self.alive
+            code = None
+            if user_id is not None:
+                code = self.user_codes.get(user_id)
+                if code is None:
+                    return []
+            candidates = self._probe(query, nprobe) if self.centroids is not None else None
+
+        if candidates is None:
+            blocks = (slice(start, min(start + VECTOR_SEARCH_BLOCK_ROWS, len(matrix))) for start in range(0, len(matrix), VECTOR_SEARCH_BLOCK_ROWS))
+        else:
+            blocks = (candidates[start:start + VECTOR_SEARCH_BLOCK_ROWS] for start in range(0, len(candidates), VECTOR_SEARCH_BLOCK_ROWS))
+
+        best_rows, best_scores = [], []
+        for block in blocks:
+            rows = np.arange(block.start, block.stop) if isinstance(block, slice) else block
+            keep = alive[rows] if code is None else alive[rows] & (owners[rows] == code)
+            rows = rows[keep]
+            if not len(rows):
+                continue
+            scores = (matrix[block] @ query)[keep] if isinstance(block, slice) else matrix[rows] @ query
+            if len(scores) > top_k:
+                top = np.argpartition(-scores, top_k)[:top_k]
+                rows, scores = rows[top], scores[top]
+            best_rows.append(rows)
+            best_scores.append(scores)
+
+        if not best_rows:
+            return []
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        ranked = np.argsort(-scores)[:top_k]
+
+        with self.lock:
+            placeholders = ",".join("?" * len(ranked))
+            meta = {
+                row: (doc_id, ordinal) for row, doc_id, ordinal in self.db.execute(
+                    f"SELECT row, doc_id, ordinal FROM rows WHERE row IN ({placeholders})", [int(rows[i]) for i in ranked]
+                )
+            }
+        return [
+            {"row": int(rows[i]), "doc_id": meta[int(rows[i])][0], "ordinal": meta[int(rows[i])][1], "score": round(float(scores[i]), 4)}
+            for i in ranked
+        ]
+
+    def stats(self) -> dict:
+        with self.lock:
+            deleted = self.db.execute("SELECT COUNT(*) FROM rows WHERE deleted = 1").fetchone()[0]
+            return {
+                "rows": self.rows,
+                "deleted_rows": deleted,
+                "dim": self.dim,
+                "ivf_lists": 0 if self.centroids is None else len(self.centroids),
+            }
+
+vector_store = VectorStore(data_dir("vectors"))
@@ -0,0 +1,148 @@
+import re
+import math
+import sqlite3
+import threading
+from storage import data_path
+from normalize import normalized, amount_of, vendor_key
+
+def invoice_key(invoice_number) -> str:
+    """
+    Normalised invoice number: "INV-0042", "inv 0042" and "Inv#0042" all match.
+    """
+    return re.sub(r"[^0-9a-z]", "", str(invoice_number or "").lower())
+
+class VendorHistory:
+    """
+    Per-vendor index of approved documents: running count, mean and M2 of amounts
+    (Welford), and a set of normalised invoice numbers, so duplicate and outlier
+    checks are a lookup rather than a scan. Recording is idempotent per document;
+    recording it again (e.g. after an edit) replaces its previous contribution.
+    """
+
+    def __init__(self, db_path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        if db_path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS vendors ("
+            "user_id TEXT NOT NULL, vendor_key TEXT NOT NULL, count INTEGER NOT NULL, mean REAL NOT NULL, "
+            "m2 REAL NOT NULL, PRIMARY KEY (user_id, vendor_key))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS members ("
+            "user_id TEXT NOT NULL, doc_id TEXT NOT NULL, vendor_key TEXT NOT NULL, invoice_key TEXT, "
+            "amount REAL, filename TEXT, PRIMARY KEY (user_id, doc_id))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS members_invoice ON members (user_id, vendor_key, invoice_key)")
+
+    def _update_stats(self, user_id: str, key: str, amount: float, sign: int):
+        row = self.db.execute(
+            "SELECT count, mean, m2 FROM vendors WHERE user_id = ? AND vendor_key = ?", (user_id, key)
+        ).fetchone()
+        count, mean, m2 = row or (0, 0.0, 0.0)
+        if sign > 0:
+            count += 1
+            delta = amount - mean
+            mean += delta / count
+            m2 += delta * (amount - mean)
+        elif count <= 1:
+            count, mean, m2 = 0, 0.0, 0.0
+        else:
+            # Welford's update run backwards
+            previous_mean = (count * mean - amount) / (count - 1)
+            m2 = max(m2 - (amount - previous_mean) * (amount - mean), 0.0)
+            count, mean = count - 1, previous_mean
+
+        if count:
+            self.db.execute(
+                "INSERT OR REPLACE INTO vendors (user_id, vendor_key, count, mean, m2) VALUES (?, ?, ?, ?, ?)",
+                (user_id, key, count, mean, m2),
+            )
+        else:
+            self.db.execute("DELETE FROM vendors WHERE user_id = ? AND vendor_key = ?", (user_id, key))
+
+    def _forget(self, user_id: str, doc_id: str):
+        member = self.db.execute(
+            "SELECT vendor_key, amount FROM members WHERE user_id = ? AND doc_id = ?", (user_id, doc_id)
+        ).fetchone()
+        if member is None:
+            return
+        self.db.execute("DELETE FROM members WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+        if member[1] is not None:
+            self._update_stats(user_id, member[0], member[1], -1)
+
+    def record(self, user_id: str, doc: dict):
+        """
+        Adds (or re-adds) a document to its vendor's history. Documents without a
+        vendor are only removed from the index.
+        """
+        extracted = doc.get("extracted_data") or {}
+        record = normalized(extracted)
+        key = record["vendor_key"]
+        amount = amount_of(record)
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self._forget(user_id, doc["id"])
+                if key:
+                    self.db.execute(
+                        "INSERT INTO members (user_id, doc_id, vendor_key, invoice_key, amount, filename) VALUES (?, ?, ?, ?, ?, ?)",
+                        (user_id, doc["id"], key, invoice_key(extracted.get("invoice_number")) or None, amount, doc.get("filename")),
+                    )
+                    if amount is not None:
+                        self._update_stats(user_id, key, amount, 1)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def forget(self, user_id: str, doc_id: str):
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self._forget(user_id, doc_id)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def sync(self, user_id: str, doc: dict):
+        """
+        Keeps the index in step with a stored document: approved documents are
+        recorded, anything else is removed.
+        """
+        if doc.get("status") == "approved":
+            self.record(user_id, doc)
+        else:
+            self.forget(user_id, doc["id"])
+
+    def stats(self, user_id: str, vendor: str) -> dict:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT count, mean, m2 FROM vendors WHERE user_id = ? AND vendor_key = ?", (user_id, vendor_key(vendor))
+            ).fetchone()
+        if row is None:
+            return None
+        count, mean, m2 = row
+        return {"count": count, "mean": mean, "std_dev": math.sqrt(m2 / (count - 1)) if count > 1 else 0.0}
+
+    def find_invoice(self, user_id: str, vendor: str, invoice_number: str, exclude: set = ()) -> dict:
+        """
+        Returns another recorded document of this vendor with the same normalised
+        invoice number, or None. Documents whose ids are in `exclude` do not count.
+        """
+        key = invoice_key(invoice_number)
+        if not key:
+            return None
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT doc_id, filename FROM members WHERE user_id = ? AND vendor_key = ? AND invoice_key = ? LIMIT ?",
+                (user_id, vendor_key(vendor), key, len(exclude) + 1),
+            ).fetchall()
+        for doc_id, filename in rows:
+            if doc_id not in exclude:
+                return {"id": doc_id, "filename": filename}
+        return None
+
+vendor_history = VendorHistory(data_path("vendor_history.sqlite3"))
@@ -0,0 +1,185 @@
+import re
+import math
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape, quoteattr
+
+# Limits of the XLSX format; rows past the last one continue on a new sheet
+MAX_SHEET_ROWS = 1048576
+MAX_CELL_CHARS = 32767
+ROW_BATCH = 256
+
+EXCEL_EPOCH = date(1899, 12, 30)
+# Characters XML 1.0 does not allow (OCR text occasionally contains form feeds and the like)
+ILLEGAL_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+# Cell style ids in STYLES: 0 default, 1 bold header, 2 date, 3 amount
+HEADER_STYLE, DATE_STYLE, NUMBER_STYLE = 1, 2, 3
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{n}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>{sheets}</sheets></workbook>'
+)
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{sheets}'
+    '<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>'
+)
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '{cols}<sheetData>'
+)
+SHEET_END = '</sheetData></worksheet>'
+
+def column_letter(index: int) -> str:
+    """0 -> A, 25 -> Z, 26 -> AA."""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def cell_xml(ref: str, value, style: int = 0) -> str:
+    """
+    One cell: numbers and dates are typed (dates as Excel serial numbers), anything
+    else is an inline string, so no shared-string table has to be built up front.
+    """
+    style_attr = f' s="{style}"' if style else ""
+    if value is None or value == "":
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"{style_attr}><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+    if isinstance(value, (date, datetime)):
+        if isinstance(value, datetime):
+            serial = (value - datetime(1899, 12, 30)).total_seconds() / 86400
+        else:
+            serial = (value - EXCEL_EPOCH).days
+        return f'<c r="{ref}" s="{style or DATE_STYLE}"><v>{serial}</v></c>'
+    text = ILLEGAL_XML_CHARS.sub("", str(value))[:MAX_CELL_CHARS]
+    return f'<c r="{ref}" t="inlineStr"{style_attr}><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+class ChunkSink:
+    """Write-only, non-seekable file object; zipfile then streams entries with data descriptors."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+def iter_xlsx(header: list, rows, sheet_name: str = "Sheet", widths: list = None, styles: list = None,
+              chunk_bytes: int = 64 * 1024):
+    """
+    Streams an XLSX workbook, yielding bytes of about `chunk_bytes` as rows are
+    written. `rows` is any iterable of value lists; `styles` optionally gives a
+    cell style per column (DATE_STYLE, NUMBER_STYLE). Memory use is independent of
+    the row count. More than MAX_SHEET_ROWS rows continue on "<sheet_name> 2", ...
+    """
+    sink = ChunkSink()
+    styles = styles or [0] * len(header)
+    letters = [column_letter(i) for i in range(len(header))]
+    cols = ""
+    if widths:
+        cols = "<cols>" + "".join(
+            f'<col min="{i + 1}" max="{i + 1}" width="{width}" customWidth="1"/>' for i, width in enumerate(widths)
+        ) + "</cols>"
+
+    rows = iter(rows)
+    pending = next(rows, None)
+    sheets = 0
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        # Sheets first: the workbook parts that list them are written once their number is known
+        while sheets == 0 or pending is not None:
+            sheets += 1
+            # Size unknown up front: zip64 lets a full sheet pass the 2 GiB entry limit
+            with archive.open(f"xl/worksheets/sheet{sheets}.xml", "w", force_zip64=True) as entry:
+                entry.write(SHEET_START.format(cols=cols).encode("utf-8"))
+                header_cells = "".join(cell_xml(f"{letters[i]}1", name, HEADER_STYLE) for i, name in enumerate(header))
+                entry.write(f'<row r="1">{header_cells}</row>'.encode("utf-8"))
+
+                number = 1
+                buffered = []
+                while pending is not None and number < MAX_SHEET_ROWS:
+                    number += 1
+                    cells = "".join(
+                        cell_xml(f"{letters[i]}{number}", value, styles[i]) for i, value in enumerate(pending[:len(letters)])
+                    )
+                    buffered.append(f'<row r="{number}">{cells}</row>')
+                    pending = next(rows, None)
+                    # Rows go to the compressor in batches; compressed output leaves once a chunk is full
+                    if len(buffered) >= ROW_BATCH:
+                        entry.write("".join(buffered).encode("utf-8"))
+                        buffered = []
+                        if sink.size >= chunk_bytes:
+                            yield sink.take()
+
+                buffered.append(SHEET_END)
+                entry.write("".join(buffered).encode("utf-8"))
+
+        names = [sheet_name if n == 1 else f"{sheet_name} {n}" for n in range(1, sheets + 1)]
+        archive.writestr("xl/workbook.xml", WORKBOOK.format(sheets="".join(
+            f'<sheet name={quoteattr(name[:31])} sheetId="{n}" r:id="rId{n}"/>' for n, name in enumerate(names, 1)
+        )))
+        archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS.format(sheets="".join(
+            f'<Relationship Id="rId{n}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{n}.xml"/>' for n in range(1, sheets + 1)
+        )))
+        archive.writestr("xl/styles.xml", STYLES)
+        archive.writestr("_rels/.rels", ROOT_RELS)
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES.format(
+            sheets="".join(SHEET_CONTENT_TYPE.format(n=n) for n in range(1, sheets + 1))
+        ))
+    yield sink.take()
@@ -39,7 +39,8 @@ export const DocumentDetailsCard = ({ extractedData }: DocumentDetailsCardProps)
       </CardHeader>
       <CardContent className="p-0">
         <div className="divide-y">
-          {Object.entries(extractedData).map(([key, value]) => (
+          {/* Nested metadata such as field_confidence is not a display field */}
+          {Object.entries(extractedData).filter(([, value]) => value === null || typeof value !== "object").map(([key, value]) => (
             <div key={key} className="flex items-center justify-between p-4 hover:bg-muted/30 transition-colors">
               <div className="flex items-center gap-3">
                 <div className="p-2 rounded-md bg-primary/5">
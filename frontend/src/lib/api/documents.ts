@@ -19,6 +19,12 @@ export const fetchDocuments = async (): Promise<Document[]> => {
   return data || [];
 };
 
+// Identifies the caller to the backend, which keeps documents and rate limits per user
+export const userHeaders = async (): Promise<Record<string, string>> => {
+  const { data: { user } } = await supabase.auth.getUser();
+  return user ? { "X-User-Id": user.id } : {};
+};
+
 export const createDocument = async (doc: any) => {
   const { data: { user } } = await supabase.auth.getUser();
   if (!user) throw new Error("User not authenticated");
@@ -44,11 +50,23 @@ export const updateDocumentStatus = async (id: string, status: string) => {
   if (error) throw error;
 };
 
-export const deleteDocument = async (id: string) => {
+export const deleteDocument = async (doc: Document) => {
+  // Remove the backend copy (store, search index, blob) first; 404 means it is already gone
+  const contentHash = doc.extracted_data?.content_hash;
+  if (contentHash) {
+    const response = await fetch(`http://localhost:8000/documents/${contentHash}`, {
+      method: "DELETE",
+      headers: await userHeaders(),
+    });
+    if (!response.ok && response.status !== 404) {
+      throw new Error(`Backend delete failed (${response.status})`);
+    }
+  }
+
   const { error } = await supabase
     .from("documents")
     .delete()
-    .eq("id", id);
+    .eq("id", doc.id);
 
   if (error) throw error;
 };
@@ -8,6 +8,7 @@ import { Checkbox } from "@/components/ui/checkbox";
 import { TrendingUp, DollarSign, FileText, AlertCircle, Download, Loader2 } from "lucide-react";
 import { motion } from "framer-motion";
 import { supabase } from "@/integrations/supabase/client";
+import { userHeaders } from "@/lib/api/documents";
 
 export default function Analytics() {
     const [documents, setDocuments] = useState([]);
@@ -22,6 +23,14 @@ export default function Analytics() {
         fetchDocuments();
     }, []);
 
+    // Documents ingested by the backend are selected by id from its store; older ones are sent in full.
+    // Ids are sent even when everything is selected: the backend store is shared by all frontend users
+    // and keeps documents deleted here, so its whole-store aggregates would cover more than this list.
+    const documentSelection = (docs) => {
+        const docIds = docs.map(doc => doc.extracted_data?.content_hash);
+        return docIds.every(Boolean) ? { doc_ids: docIds } : { documents: docs };
+    };
+
     const fetchDocuments = async () => {
         const { data } = await supabase
             .from("documents")
@@ -41,8 +50,8 @@ export default function Analytics() {
         try {
             const response = await fetch("http://localhost:8000/agents/analytics", {
                 method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ documents: docs })
+                headers: { "Content-Type": "application/json", ...(await userHeaders()) },
+                body: JSON.stringify(documentSelection(docs))
             });
             const data = await response.json();
             setAnalytics(data);
@@ -61,8 +70,8 @@ export default function Analytics() {
             const selectedDocs = documents.filter(doc => selectedDocuments.includes(doc.id));
             const response = await fetch("http://localhost:8000/agents/analytics", {
                 method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ documents: selectedDocs, query })
+                headers: { "Content-Type": "application/json", ...(await userHeaders()) },
+                body: JSON.stringify({ ...documentSelection(selectedDocs), query })
             });
             const data = await response.json();
             setQueryResponse(data.query_response || "No response received");
@@ -105,22 +114,24 @@ export default function Analytics() {
             const selectedDocs = documents.filter(doc => selectedDocuments.includes(doc.id));
             const response = await fetch("http://localhost:8000/agents/export", {
                 method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ documents: selectedDocs, format })
+                headers: { "Content-Type": "application/json", ...(await userHeaders()) },
+                body: JSON.stringify({ ...documentSelection(selectedDocs), format })
             });
-            const data = await response.json();
-
-            if (format === 'excel') {
-                console.log("Excel data:", data.data);
-                alert("Excel export ready! (Frontend conversion needed)");
-            } else {
-                const blob = new Blob([data.content], { type: 'text/plain' });
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = data.filename;
-                a.click();
+            if (!response.ok) {
+                throw new Error((await response.json()).detail || `Export failed (${response.status})`);
             }
+
+            // Exports are streamed as file downloads
+            const extensions = { csv: 'csv', quickbooks: 'iif', excel: 'xlsx', parquet: 'parquet' };
+            const disposition = response.headers.get("Content-Disposition") || "";
+            const filename = disposition.match(/filename="(.+)"/)?.[1] || `rida_export.${extensions[format]}`;
+            const blob = await response.blob();
+            const url = window.URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = filename;
+            a.click();
+            window.URL.revokeObjectURL(url);
         } catch (error) {
             console.error("Export error:", error);
         }
@@ -151,6 +162,14 @@ export default function Analytics() {
                             <Download className="mr-2 h-4 w-4" />
                             QuickBooks
                         </Button>
+                        <Button onClick={() => handleExport('excel')} variant="outline">
+                            <Download className="mr-2 h-4 w-4" />
+                            Excel
+                        </Button>
+                        <Button onClick={() => handleExport('parquet')} variant="outline">
+                            <Download className="mr-2 h-4 w-4" />
+                            Parquet
+                        </Button>
                     </div>
                 </div>
 
@@ -103,8 +103,11 @@ const Chat = () => {
 
     // Prepare Context from Selected Docs
     let contextText = "";
+    let documentIds: string[] = [];
     if (selectedDocs.length > 0) {
       const selectedDocObjects = documents.filter(d => selectedDocs.includes(d.id));
+      // Documents indexed at ingest are retrieved server-side; the context below is the fallback
+      documentIds = selectedDocObjects.map(d => d.extracted_data?.content_hash).filter(Boolean);
       contextText = selectedDocObjects.map(d => {
         // FIX APPLIED: Improved extracted data handling
         const extractedData = d.extracted_data || {};
@@ -121,10 +124,11 @@ const Chat = () => {
     try {
       const response = await fetch("http://localhost:8000/agents/chat", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-User-Id": user.id },
         body: JSON.stringify({
           message: input,
-          context: contextText
+          context: contextText,
+          document_ids: documentIds
         })
       });
 
@@ -7,7 +7,7 @@ import { Button } from "@/components/ui/button";
 import { Upload, FileText, CloudUpload, Loader2, CheckCircle, AlertCircle, Trash2 } from "lucide-react";
 import { useNavigate } from "react-router-dom";
 import { useToast } from "@/hooks/use-toast";
-import { fetchDocuments, createDocument, deleteDocument, type Document } from "@/lib/api/documents";
+import { fetchDocuments, createDocument, deleteDocument, userHeaders, type Document } from "@/lib/api/documents";
 import { motion, AnimatePresence } from "framer-motion";
 
 const Documents = () => {
@@ -52,36 +52,59 @@ const Documents = () => {
 
       const ingestResponse = await fetch("http://localhost:8000/agents/ingest", {
         method: "POST",
+        headers: await userHeaders(),
         body: formData,
       });
 
       if (!ingestResponse.ok) {
         if (ingestResponse.status === 429) {
-          throw new Error("Free Tier Limit Reached: Max 3 uploads allowed.");
+          const { detail } = await ingestResponse.json();
+          throw new Error(detail);
         }
         throw new Error("Ingestion failed");
       }
 
-      const ingestData = await ingestResponse.json();
+      // Ingestion runs as a background job; poll until it finishes
+      const job = await ingestResponse.json();
+      let ingestData = null;
+      while (!ingestData) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+
+        const jobResponse = await fetch(`http://localhost:8000/agents/jobs/${job.job_id}`);
+        if (!jobResponse.ok) {
+          throw new Error("Ingestion failed");
+        }
+
+        const jobData = await jobResponse.json();
+        if (jobData.status === "failed") {
+          throw new Error(jobData.error || "Ingestion failed");
+        }
+        if (jobData.status === "completed") {
+          ingestData = jobData.result;
+        }
+      }
 
       update({ id: toastId, title: "Processing", description: "Extracting data with Raindrop SmartInference..." });
 
-      // 2. Extract data (Extraction Agent)
-      const extractResponse = await fetch("http://localhost:8000/agents/extract", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          text: ingestData.text,
-          doc_type: ingestData.type
-        }),
-      });
+      // 2. Extract data (Extraction Agent) - ingest already returns fields for new uploads
+      let extractData = ingestData.extracted_data;
+      if (!extractData) {
+        const extractResponse = await fetch("http://localhost:8000/agents/extract", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+            text: ingestData.text,
+            doc_type: ingestData.type
+          }),
+        });
+
+        if (!extractResponse.ok) {
+          throw new Error("Extraction failed");
+        }
 
-      if (!extractResponse.ok) {
-        throw new Error("Extraction failed");
+        extractData = await extractResponse.json();
       }
 
-      const extractData = await extractResponse.json();
-
       // 3. Save to Supabase
       const { error } = await createDocument({
         filename: file.name,
@@ -89,7 +112,8 @@ const Documents = () => {
         file_url: ingestData.vultr_backup_url || "", // Use mock URL
         extracted_data: {
           ...extractData,
-          thumbnail_url: ingestData.thumbnail,
+          thumbnail_url: ingestData.thumbnail_url,
+          content_hash: ingestData.content_hash,
           raindrop_id: ingestData.raindrop_id
         },
         status: "ready"
@@ -118,7 +142,7 @@ const Documents = () => {
     }
   };
 
-  const handleDelete = async (e: React.MouseEvent, id: string) => {
+  const handleDelete = async (e: React.MouseEvent, doc: Document) => {
     e.stopPropagation(); // Prevent any parent click events
 
     if (!window.confirm("Are you sure you want to delete this document?")) {
@@ -126,10 +150,10 @@ const Documents = () => {
     }
 
     try {
-      await deleteDocument(id);
+      await deleteDocument(doc);
 
       // Update local state immediately
-      setDocuments((prev) => prev.filter((doc) => doc.id !== id));
+      setDocuments((prev) => prev.filter((d) => d.id !== doc.id));
 
       toast({
         title: "Deleted",
@@ -376,7 +400,7 @@ const Documents = () => {
                               <Button
                                 variant="ghost"
                                 size="sm"
-                                onClick={(e) => handleDelete(e, doc.id)}
+                                onClick={(e) => handleDelete(e, doc)}
                                 className="text-red-500 hover:text-red-700 hover:bg-red-50"
                               >
                                 <Trash2 className="h-4 w-4" />